@@ -1,47 +1,516 @@
 import argparse
+import glob
+import hashlib
+import json
+import os
+import sqlite3
 import sys
-import re
 from pathlib import Path
 
+from md_headings import HeadingScanner, heading_outline
+
+# Outlines are cached per document under here, keyed by the document's path
+CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'bolt_parser'
+CACHE_VERSION = 2
+# Bytes copied per read when streaming a section whose offsets are known
+STREAM_CHUNK = 64 * 1024
+# Streaming only seeks via cached outlines up to this size: loading the outline
+# of a document with huge numbers of headings costs more than scanning it
+STREAM_OUTLINE_MAX = 256 * 1024
+# Bolt artifacts, relative to a project root: <dir>/<workspace>/<template>.md
+ARTIFACT_GLOBS = ('docs/design/*/*.md', '.bolts/*/*.md')
+CATALOG_VERSION = 1
+# Seconds a catalog writer waits for another process to finish
+CATALOG_TIMEOUT = 30.0
+
+
+def build_outline(data: bytes) -> list:
+    """One pass over a markdown document: every heading with its byte offsets.
+
+    See md_headings.heading_outline: [level, title, start, body_start, end,
+    parent] per heading, skipping `#` lines in code fences and frontmatter.
+    """
+    return heading_outline(data)
+
+
+def _cache_path(path: Path) -> Path:
+    return CACHE_DIR / (hashlib.sha1(str(path).encode('utf-8')).hexdigest() + '.json')
+
+
+def _read_cache(path: Path, max_bytes=None):
+    cache_path = _cache_path(path)
+    try:
+        if max_bytes is not None and cache_path.stat().st_size > max_bytes:
+            return None
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get('version') != CACHE_VERSION:
+        return None  # not ours, or from another version: parse again
+    return cached
+
+
+def cached_outline(filepath: str, max_bytes=None):
+    """The cached outline if the document is unchanged since, else None. Reads no document.
+
+    With `max_bytes`, larger cache entries are not even loaded.
+    """
+    path = Path(filepath).resolve()
+    st = path.stat()
+    cached = _read_cache(path, max_bytes)
+    if cached and cached['mtime_ns'] == st.st_mtime_ns and cached['size'] == st.st_size:
+        return cached['outline']
+    return None
+
+
+def load_outline(filepath: str) -> list:
+    """The document's outline, from the on-disk cache when it is still valid.
+
+    An unchanged mtime and size reuse the cached outline without reading
+    the document; otherwise the document is read and hashed, and only
+    parsed again if its content actually changed. OSError if unreadable.
+    """
+    path = Path(filepath).resolve()
+    st = path.stat()
+    cache_path = _cache_path(path)
+    cached = _read_cache(path)
+    if cached and cached['mtime_ns'] == st.st_mtime_ns and cached['size'] == st.st_size:
+        return cached['outline']
+
+    data = path.read_bytes()
+    digest = hashlib.sha1(data).hexdigest()
+    if cached and cached['hash'] == digest:
+        outline = cached['outline']  # touched but unchanged (e.g. a git checkout)
+    else:
+        outline = build_outline(data)
+    entry = {
+        'version': CACHE_VERSION,
+        'path': str(path),
+        'mtime_ns': st.st_mtime_ns,
+        'size': st.st_size,
+        'hash': digest,
+        'outline': outline,
+    }
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_name(f'{cache_path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass  # the cache is an optimization; a read-only home still works
+    return outline
+
+
+def find_section(outline: list, section_name: str):
+    """The first heading whose text contains `section_name` (case-insensitive)."""
+    needle = section_name.lower()
+    for heading in outline:
+        if needle in heading[1].lower():
+            return heading
+    return None
+
+
 def extract_section(filepath: str, section_name: str) -> str:
+    return extract_sections(filepath, [section_name])[section_name]
+
+
+def extract_sections(filepath: str, section_names: list) -> dict:
+    """{section name: content} for several sections of one document.
+
+    The outline comes from the cache and the file is opened once for all
+    the slices. A missing file or section gives an "Error: ..." string.
+    """
     path = Path(filepath)
     if not path.is_file():
-        return f"Error: File {filepath} not found."
+        return {name: f"Error: File {filepath} not found." for name in section_names}
 
     try:
-        with open(path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        outline = load_outline(filepath)
+        f = open(path, 'rb')
     except Exception as e:
+        return {name: f"Error reading file: {e}" for name in section_names}
+
+    results = {}
+    with f:
+        for name in section_names:
+            # The heading that contains the section name, at any level
+            heading = find_section(outline, name)
+            if heading is None:
+                results[name] = f"Error: Section containing '{name}' not found in {filepath}."
+                continue
+            # Its body runs to the next heading of the same or a higher level
+            _, _, _, body_start, end, _ = heading
+            f.seek(body_start)
+            results[name] = f.read(end - body_start).decode('utf-8', errors='replace').strip()
+    return results
+
+
+class _StrippedWriter:
+    """Writes bytes to `out` as .strip() would leave them, without holding the text.
+
+    Leading whitespace is dropped; trailing whitespace is held back until
+    more content follows it, so only a run of blank lines is ever buffered.
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self.started = False
+        self.pending = b''
+
+    def write(self, data: bytes):
+        if not self.started:
+            data = data.lstrip()
+            if not data:
+                return
+        body = data.rstrip()
+        if not body:
+            self.pending += data
+            return
+        self.out.write(self.pending + body)
+        if not self.started:
+            self.started = True
+            self.out.flush()  # the first bytes go out right away
+        self.pending = data[len(body):]
+
+
+def stream_section(filepath: str, section_name: str, out) -> str:
+    """Writes a section's body to the binary stream `out` while reading it.
+
+    With a valid (and small) cached outline the file is read from the
+    section's offset in chunks; otherwise it is scanned line by line from
+    the top, and the scan stops at the heading that ends the section.
+    Either way memory stays bounded and nothing past the section is read,
+    except that a leading `---` is read ahead to its closing line: one that
+    is never closed is a rule, as in build_outline, and the scan starts
+    over from the top. Returns an error message, or None once the section
+    has been written.
+    """
+    path = Path(filepath)
+    if not path.is_file():
+        return f"Error: File {filepath} not found."
+    not_found = f"Error: Section containing '{section_name}' not found in {filepath}."
+    writer = _StrippedWriter(out)
+    try:
+        outline = cached_outline(filepath, STREAM_OUTLINE_MAX)
+        with open(path, 'rb') as f:
+            if outline is not None:
+                heading = find_section(outline, section_name)
+                if heading is None:
+                    return not_found
+                _, _, _, body_start, end, _ = heading
+                f.seek(body_start)
+                remaining = end - body_start
+                while remaining > 0:
+                    chunk = f.read(min(STREAM_CHUNK, remaining))
+                    if not chunk:
+                        break
+                    writer.write(chunk)
+                    remaining -= len(chunk)
+                return None
+
+            # Skip the frontmatter, if the document really has one
+            scanner = HeadingScanner()
+            scanner.heading(f.readline())
+            closed = False
+            if scanner.in_frontmatter:
+                for line in f:
+                    scanner.heading(line)
+                    if not scanner.in_frontmatter:
+                        closed = True
+                        break
+            if not closed:
+                f.seek(0)
+                scanner = HeadingScanner(frontmatter=False)
+
+            needle = section_name.lower()
+            level = None
+            for line in f:
+                heading = scanner.heading(line)
+                if level is None:
+                    title = heading[1].decode('utf-8', errors='replace') if heading else ''
+                    if heading and needle in title.lower():
+                        level = heading[0]
+                    continue
+                if heading and heading[0] <= level:
+                    break  # the terminating heading: the rest is never read
+                writer.write(line)
+    except OSError as e:
         return f"Error reading file: {e}"
+    return None if level is not None else not_found
+
+
+def expand_paths(patterns: list) -> list:
+    """Files named by paths or glob patterns (`**` included), in order, without repeats.
+
+    A pattern matching nothing is kept as is, so it is reported as not found.
+    """
+    paths = []
+    for pattern in patterns:
+        is_glob = any(char in pattern for char in '*?[')
+        matches = sorted(glob.glob(pattern, recursive=True)) if is_glob else []
+        for path in matches or [pattern]:
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def catalog_path(root: Path) -> Path:
+    """Where the section catalog of the project at `root` lives by default."""
+    return CACHE_DIR / ('catalog-' + hashlib.sha1(str(root).encode('utf-8')).hexdigest() + '.sqlite')
+
+
+def open_catalog(db_path: Path) -> sqlite3.Connection:
+    """Opens (creating it if needed) a section catalog, rebuilt if its version changed."""
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db_path), timeout=CATALOG_TIMEOUT)
+    if conn.execute('PRAGMA user_version').fetchone()[0] != CATALOG_VERSION:
+        with conn:
+            conn.execute('DROP TABLE IF EXISTS artifacts')
+            conn.execute('DROP TABLE IF EXISTS sections')
+            conn.execute(f'PRAGMA user_version = {CATALOG_VERSION}')
+    with conn:
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS artifacts (path TEXT PRIMARY KEY, workspace TEXT,'
+            ' template TEXT, status TEXT, mtime_ns INTEGER, size INTEGER)'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS sections (path TEXT, position INTEGER, level INTEGER,'
+            ' title TEXT, title_key TEXT, parent INTEGER, content TEXT, PRIMARY KEY (path, position))'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS artifacts_workspace ON artifacts (workspace, template)')
+    return conn
+
+
+def frontmatter_status(data: bytes):
+    """The `status:` field of a document's frontmatter, or None."""
+    lines = data.splitlines()
+    if not lines or lines[0].strip() != b'---':
+        return None
+    for line in lines[1:]:
+        if line.strip() == b'---':
+            break
+        key, sep, value = line.partition(b':')
+        if sep and key.strip() == b'status':
+            value = value.strip()
+            if len(value) >= 2 and value[:1] in (b'"', b"'") and value[-1:] == value[:1]:
+                value = value[1:-1]  # YAML quoting: "draft" is draft
+            return value.decode('utf-8', errors='replace') or None
+    return None
+
+
+def _index_artifact(conn, rel_path: str, data: bytes, st):
+    *_, workspace, filename = rel_path.split('/')
+    conn.execute('DELETE FROM sections WHERE path = ?', (rel_path,))
+    conn.execute(
+        'INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?)',
+        (rel_path, workspace, filename[:-3], frontmatter_status(data), st.st_mtime_ns, st.st_size),
+    )
+    conn.executemany(
+        'INSERT INTO sections VALUES (?, ?, ?, ?, ?, ?, ?)',
+        (
+            (rel_path, i, level, title, title.lower(), parent,
+             data[body_start:end].decode('utf-8', errors='replace').strip())
+            for i, (level, title, _, body_start, end, parent) in enumerate(build_outline(data))
+        ),
+    )
+
+
+def refresh_catalog(conn, root: Path, full=False) -> tuple:
+    """Brings the catalog in line with the bolt artifacts under `root`.
+
+    Only artifacts whose mtime or size changed since they were indexed are
+    read again (all of them with `full`); deleted ones are dropped.
+    Returns (artifacts indexed, artifacts re-read, artifacts removed).
+    """
+    known = {
+        path: (mtime_ns, size)
+        for path, mtime_ns, size in conn.execute('SELECT path, mtime_ns, size FROM artifacts')
+    }
+    seen = set()
+    changed = 0
+    with conn:
+        for pattern in ARTIFACT_GLOBS:
+            for file in sorted(root.glob(pattern)):
+                rel_path = file.relative_to(root).as_posix()
+                try:
+                    st = file.stat()
+                    if not full and known.get(rel_path) == (st.st_mtime_ns, st.st_size):
+                        seen.add(rel_path)
+                        continue
+                    data = file.read_bytes()
+                except OSError:
+                    continue  # vanished or unreadable: dropped below like a deleted one
+                seen.add(rel_path)
+                _index_artifact(conn, rel_path, data, st)
+                changed += 1
+        removed = [path for path in known if path not in seen]
+        for path in removed:
+            conn.execute('DELETE FROM artifacts WHERE path = ?', (path,))
+            conn.execute('DELETE FROM sections WHERE path = ?', (path,))
+    return len(seen), changed, len(removed)
+
+
+def query_catalog(conn, workspace=None, template=None, section=None, status=None) -> list:
+    """Artifacts matching every given filter, from the catalog alone.
+
+    `workspace` is a glob (`feat-*`), `template` the file name without
+    `.md` and `status` the frontmatter status. With `section`, each artifact
+    gives the first section whose heading contains it (case-insensitive),
+    as extract_section would, and artifacts without one are left out.
+    """
+    where, params = [], []
+    for column, op, value in (
+        ('a.workspace', 'GLOB', workspace),
+        ('a.template', '=', template),
+        ('a.status', '=', status),
+    ):
+        if value is not None:
+            where.append(f'{column} {op} ?')
+            params.append(value)
+    if section is None:
+        sql = 'SELECT a.path, a.workspace, a.template, a.status FROM artifacts a'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        rows = conn.execute(sql + ' ORDER BY a.workspace, a.template, a.path', params)
+        return [dict(zip(('path', 'workspace', 'template', 'status'), row)) for row in rows]
+
+    where.append('instr(s.title_key, ?) > 0')
+    params.append(section.lower())
+    rows = conn.execute(
+        'SELECT a.path, a.workspace, a.template, a.status, s.title, s.content'
+        ' FROM sections s JOIN artifacts a ON a.path = s.path WHERE ' + ' AND '.join(where)
+        + ' ORDER BY a.workspace, a.template, a.path, s.position',
+        params,
+    )
+    results = {}
+    for row in rows:
+        # Rows come in document order, so the first one per artifact wins
+        results.setdefault(
+            row[0], dict(zip(('path', 'workspace', 'template', 'status', 'section', 'content'), row))
+        )
+    return list(results.values())
+
+
+COMMANDS = ('extract', 'index', 'query')
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='bolt_parser.py',
+        description="Extract sections from markdown documents, or catalog the sections of "
+        "every bolt artifact (docs/design/<workspace>/*.md, .bolts/<workspace>/*.md) in "
+        "sqlite and query them across workspaces. Without a command, `extract` is meant: "
+        "name it explicitly to extract from a file called `index` or `query`.",
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+    extract = commands.add_parser('extract', help="Extract sections from markdown documents (default)")
+    extract.add_argument("filepaths", nargs="+", help="Markdown files or glob patterns (quote globs)")
+    extract.add_argument(
+        "--section",
+        action="append",
+        required=True,
+        help="Substring of the heading to extract (repeat for several sections)",
+    )
+    extract.add_argument("--json", action="store_true", help="Print a JSON map of file -> section -> content")
+    extract.add_argument(
+        "--stream",
+        action="store_true",
+        help="Write each section as it is read, with bounded memory (for very large files)",
+    )
+
+    index = commands.add_parser('index', help="Build or incrementally update the catalog")
+    query = commands.add_parser('query', help="Find sections across workspaces")
+    for command in (index, query):
+        command.add_argument("--root", default=".", help="Project root (default: the current directory)")
+        command.add_argument("--db", help="Catalog file (default: one per root in the cache directory)")
+    index.add_argument("--full", action="store_true", help="Re-read every artifact, not just changed ones")
+    query.add_argument("--workspace", help="Workspace name or glob (e.g. 'feat-*')")
+    query.add_argument("--template", help="Artifact name without .md (spec, plan, research, ...)")
+    query.add_argument("--section", help="Substring of the heading to return from each artifact")
+    query.add_argument("--status", help="Frontmatter status (e.g. draft)")
+    query.add_argument("--json", action="store_true", help="Print the matches as JSON")
+    query.add_argument("--no-refresh", action="store_true", help="Answer from the catalog as is")
+    return parser
+
+
+def catalog_main(args):
+    """`index` and `query`: the cross-workspace section catalog."""
+    root = Path(args.root).resolve()
+    db_path = Path(args.db) if args.db else catalog_path(root)
+    try:
+        conn = open_catalog(db_path)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Error opening catalog {db_path}: {e}")
+        sys.exit(1)
+    try:
+        if args.command == 'index':
+            total, changed, removed = refresh_catalog(conn, root, args.full)
+            print(f"Indexed {total} artifacts ({changed} read, {removed} removed) in {db_path}")
+            return
+        if not args.no_refresh:
+            refresh_catalog(conn, root)
+        matches = query_catalog(conn, args.workspace, args.template, args.section, args.status)
+    finally:
+        conn.close()
+    if args.json:
+        print(json.dumps(matches, indent=2, ensure_ascii=False))
+        return
+    if args.section is None:
+        for match in matches:
+            print(f"{match['workspace']}\t{match['template']}\t{match['status'] or '-'}\t{match['path']}")
+        return
+    for match in matches:
+        print(f"===== {match['path']} :: {match['section']} =====")
+        print(match['content'])
+        print()
+
+
+def extract_main(args):
+    """`extract`: sections of the given documents."""
+    if args.stream:
+        paths = expand_paths(args.filepaths)
+        out = sys.stdout.buffer
+        for path in paths:
+            for name in dict.fromkeys(args.section):
+                if len(paths) > 1 or len(args.section) > 1:
+                    out.write(f"===== {path} :: {name} =====\n".encode('utf-8'))
+                error = stream_section(path, name, out)
+                if error:
+                    out.write(error.encode('utf-8'))
+                out.write(b"\n\n" if len(paths) > 1 or len(args.section) > 1 else b"\n")
+        out.flush()
+        return
+
+    results = {path: extract_sections(path, args.section) for path in expand_paths(args.filepaths)}
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+        return
+    if len(results) == 1 and len(args.section) == 1:
+        print(next(iter(next(iter(results.values())).values())))
+        return
+    for path, sections in results.items():
+        for name, content in sections.items():
+            print(f"===== {path} :: {name} =====")
+            print(content)
+            print()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # `extract` is the default command: anything else in first place is a path or an option
+    if not argv or argv[0] not in COMMANDS + ('-h', '--help'):
+        argv = ['extract'] + argv
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command != 'extract':
+        catalog_main(args)
+        return
+    if args.stream and args.json:
+        parser.error("--stream writes plain text; it cannot be combined with --json")
+    extract_main(args)
 
-    # Find the heading that contains the section name
-    # Matches #, ##, ### etc. followed by text containing section_name
-    pattern = re.compile(rf'^(#+)\s+.*?{re.escape(section_name)}.*$', re.IGNORECASE | re.MULTILINE)
-    match = pattern.search(content)
-    
-    if not match:
-        return f"Error: Section containing '{section_name}' not found in {filepath}."
-    
-    start_pos = match.end()
-    heading_level = len(match.group(1))
-    
-    # Find the next heading of the same or higher level (fewer or equal '#'s)
-    # E.g., if we matched ## (level 2), the next section ends at the next ^# or ^##.
-    next_pattern = re.compile(rf'^(#{{1,{heading_level}}})\s+.*$', re.MULTILINE)
-    next_match = next_pattern.search(content, start_pos)
-    
-    end_pos = next_match.start() if next_match else len(content)
-    
-    return content[start_pos:end_pos].strip()
-
-def main():
-    parser = argparse.ArgumentParser(description="Extract a specific section from a markdown document.")
-    parser.add_argument("filepath", help="Path to the markdown file")
-    parser.add_argument("--section", required=True, help="Substring of the heading to extract")
-    args = parser.parse_args()
-    
-    extracted = extract_section(args.filepath, args.section)
-    print(extracted)
 
 if __name__ == "__main__":
     main()
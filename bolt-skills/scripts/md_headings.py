@@ -0,0 +1,131 @@
+"""Markdown heading tokenizer that knows about code fences and frontmatter.
+
+A `# comment` line inside a ``` or ~~~ code fence, or inside the YAML
+frontmatter at the top of a document, is not a heading, but a regex run
+over lines cannot tell. This tokenizer tracks both in one linear pass,
+with no dependencies, over str or bytes (so byte offsets stay byte
+offsets). Headings are CommonMark ATX headings: up to three spaces of
+indentation, one to six '#'s, then a space, a tab or the end of the line;
+a closing run of '#'s is not part of the title.
+
+bolt-skills/scripts/ and personal-skills/build-knowledge/scripts/ each
+ship this file, since every skill is installed on its own: keep the two
+copies identical (test_bolt_parser and test_librarian compare them).
+"""
+
+import re
+import itertools
+
+__all__ = ["HeadingScanner", "heading_outline"]
+
+
+class _Patterns:
+    """The tokenizer's regexes, compiled for str or for bytes."""
+
+    def __init__(self, encode):
+        # A line that matters: a heading, or a code fence's opening/closing run
+        # (group 1 is the whole line, so offsets come out the same either way)
+        line = r"( {0,3}(?:(#{1,6})(?:[ \t]([^\r\n]*))?|(`{3,}|~{3,})([^\r\n]*)))(?=\r?$)"
+        self.line = re.compile(encode("^" + line), re.M)
+        # The same after a newline: searching for the newline first lets the
+        # regex engine skip through prose instead of trying every position
+        self.next_line = re.compile(encode("\n" + line), re.M)
+        self.closing = re.compile(encode(r"(?:^|[ \t])#+$"))
+        self.frontmatter = re.compile(encode(r"^---[ \t]*(?=\r?$)"), re.M)
+        self.empty = encode("")
+        self.backtick = encode("`")
+        self.hash = encode("#")
+
+
+_PATTERNS = {str: _Patterns(str), bytes: _Patterns(lambda s: s.encode("ascii"))}
+
+
+class HeadingScanner:
+    """Classifies the lines of one document, fed in order.
+
+    `heading(line)` returns (level, title) for a heading line and None for
+    anything else (line ending optional; title of the line's type). With
+    `frontmatter`, a first line of `---` opens a frontmatter block that
+    runs to the next `---` line.
+    """
+
+    def __init__(self, frontmatter=True):
+        self.at_start = frontmatter
+        self.in_frontmatter = False
+        self.fence = None  # (character, length) of the open code fence
+
+    def heading(self, line):
+        patterns = _PATTERNS[type(line)]
+        if self.at_start:
+            self.at_start = False
+            if patterns.frontmatter.match(line):
+                self.in_frontmatter = True
+                return None
+        if self.in_frontmatter:
+            if patterns.frontmatter.match(line):
+                self.in_frontmatter = False
+            return None
+        match = patterns.line.match(line)
+        return None if match is None else self._classify(match, patterns)
+
+    def _classify(self, match, patterns):
+        _, hashes, title, fence, info = match.groups()
+        if self.fence is not None:
+            # Only a bare run of the same character, at least as long, closes it
+            if fence and fence[:1] == self.fence[0] and len(fence) >= self.fence[1]:
+                if not info.strip():
+                    self.fence = None
+            return None
+        if fence:
+            # A backtick fence's info string cannot contain backticks
+            if not (fence[:1] == patterns.backtick and patterns.backtick in info):
+                self.fence = (fence[:1], len(fence))
+            return None
+        title = (title or patterns.empty).strip()
+        if title.endswith(patterns.hash):
+            title = patterns.closing.sub(patterns.empty, title).rstrip()
+        return len(hashes), title
+
+
+def heading_outline(data: bytes) -> list:
+    """Every heading of a markdown document with its byte offsets, in one pass.
+
+    Returns [level, title, start, body_start, end, parent] per heading, in
+    document order. A section runs from its heading line (`start`; its body
+    from `body_start`) to the next heading of the same or a higher level
+    (fewer '#'s), or to the end of the document. `parent` is the index of
+    the enclosing heading, or -1, so the list doubles as the heading tree.
+    A leading `---` that is never closed is a rule, not frontmatter.
+    """
+    patterns = _PATTERNS[bytes]
+    start = 0
+    opening = patterns.frontmatter.match(data)
+    if opening:
+        closing = patterns.frontmatter.search(data, opening.end())
+        if closing:
+            start = closing.end()
+
+    # Only candidate lines reach Python; prose never leaves the regex engine
+    matches = patterns.next_line.finditer(data, start)
+    first = patterns.line.match(data) if start == 0 else None
+    if first:
+        matches = itertools.chain([first], matches)
+
+    outline = []
+    open_sections = []  # indices into outline still waiting for their end
+    scanner = HeadingScanner(frontmatter=False)
+    for match in matches:
+        heading = scanner._classify(match, patterns)
+        if heading is None:
+            continue
+        level, title = heading
+        offset = match.start(1)
+        while open_sections and outline[open_sections[-1]][0] >= level:
+            outline[open_sections.pop()][4] = offset
+        parent = open_sections[-1] if open_sections else -1
+        title = title.decode("utf-8", errors="replace")
+        outline.append([level, title, offset, match.end(), None, parent])
+        open_sections.append(len(outline) - 1)
+    for i in open_sections:
+        outline[i][4] = len(data)
+    return outline
@@ -0,0 +1,272 @@
+import unittest
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+from pathlib import Path
+
+import bolt_parser
+from bolt_parser import (
+    extract_section,
+    frontmatter_status,
+    load_outline,
+    open_catalog,
+    query_catalog,
+    refresh_catalog,
+)
+
+
+class TestOutlineCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.saved_cache_dir = bolt_parser.CACHE_DIR
+        bolt_parser.CACHE_DIR = Path(self.folder) / "cache"
+        self.doc = os.path.join(self.folder, "spec.md")
+        self.write("# Spec\n\n## Goals\n\nfirst goals\n\n## Risks\n\nnone\n")
+
+    def tearDown(self):
+        bolt_parser.CACHE_DIR = self.saved_cache_dir
+        shutil.rmtree(self.folder)
+
+    def write(self, text):
+        with open(self.doc, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def cache_file(self):
+        return bolt_parser._cache_path(Path(self.doc).resolve())
+
+    def test_edit_after_cached_read(self):
+        self.assertEqual(extract_section(self.doc, "Goals"), "first goals")
+        self.assertTrue(self.cache_file().exists())
+
+        self.write("# Spec\n\n## Scope\n\nnew scope\n\n## Goals\n\nsecond goals\n")
+        self.assertEqual(extract_section(self.doc, "Scope"), "new scope")
+        self.assertEqual(extract_section(self.doc, "Goals"), "second goals")
+
+        # Same size and a moved mtime: the content hash catches the edit
+        self.write("# Spec\n\n## Scope\n\nold scope\n\n## Goals\n\nsecond goals\n")
+        st = os.stat(self.doc)
+        os.utime(self.doc, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.assertEqual(extract_section(self.doc, "Scope"), "old scope")
+
+    def test_garbage_cache_is_reparsed(self):
+        expected = load_outline(self.doc)
+        for garbage in (b"\x00not json{", b"[]", b'"outline"'):
+            with open(self.cache_file(), "wb") as f:
+                f.write(garbage)
+            self.assertEqual(load_outline(self.doc), expected)
+            self.assertEqual(extract_section(self.doc, "Risks"), "none")
+        # ... and the entry is written again in full
+        self.assertEqual(bolt_parser._read_cache(Path(self.doc).resolve())["outline"], expected)
+
+    def test_fenced_comment_is_not_a_heading(self):
+        self.write("# Code\n\n```sh\n# comment\n```\n\n## After\n\ntext\n")
+        self.assertEqual(
+            extract_section(self.doc, "comment"),
+            f"Error: Section containing 'comment' not found in {self.doc}.",
+        )
+        self.assertEqual(
+            extract_section(self.doc, "Code"), "```sh\n# comment\n```\n\n## After\n\ntext"
+        )
+        self.assertEqual(extract_section(self.doc, "After"), "text")
+
+    def test_unwritable_cache_dir(self):
+        # A file where the cache directory should be: every cache write fails
+        blocker = Path(self.folder) / "blocker"
+        blocker.write_text("")
+        bolt_parser.CACHE_DIR = blocker / "bolt_parser"
+        self.assertEqual(extract_section(self.doc, "Goals"), "first goals")
+        self.assertEqual(extract_section(self.doc, "Goals"), "first goals")
+        self.assertFalse(bolt_parser.CACHE_DIR.exists())
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# personal-skills/build-knowledge/scripts/ ships the same tokenizer
+LIBRARIAN_SCRIPTS = os.path.join(HERE, "..", "..", "personal-skills", "build-knowledge", "scripts")
+
+
+class TestSharedTokenizer(unittest.TestCase):
+    def test_copies_are_identical(self):
+        if not os.path.isdir(LIBRARIAN_SCRIPTS):
+            self.skipTest("installed without personal-skills: no second copy to compare")
+        with open(os.path.join(HERE, "md_headings.py"), "rb") as f:
+            ours = f.read()
+        with open(os.path.join(LIBRARIAN_SCRIPTS, "md_headings.py"), "rb") as f:
+            self.assertEqual(ours, f.read(), "the two md_headings.py copies have diverged")
+
+
+SCRIPT = os.path.join(HERE, "bolt_parser.py")
+
+# (document, section) pairs the streaming and the default paths must agree on
+STREAM_FIXTURES = [
+    ("# Plan\n\n## Steps\n\none\n### Detail\n\ntwo\n## Next\n\nlater\n", "Steps"),
+    ("---\nstatus: draft\n# not a heading\n---\n# Spec\n\n## Goals\n\ngoals\n", "Goals"),
+    ("---\nstatus: draft\n# not a heading\n---\n# Spec\n\n## Goals\n\ngoals\n", "not a heading"),
+    # Never closed: a rule, so every heading below it counts
+    ("---\n\n# Spec\n\n## Goals\n\ngoals\n\n## Risks\n\nnone\n", "Goals"),
+    ("---\r\n# Spec\r\n\r\n## Goals\r\n\r\ngoals\r\n", "Goals"),
+    ("# Code\n\n```sh\n# comment\n```\n\n## After\n\ntext\n", "comment"),
+    ("# Code\n\n```sh\n# comment\n```\n\n## After\n\ntext\n", "Code"),
+]
+
+
+class TestStreamMatchesDefault(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.env = dict(os.environ, XDG_CACHE_HOME=os.path.join(self.folder, "cache"))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def run_parser(self, *args):
+        result = subprocess.run(
+            [sys.executable, SCRIPT, *args], capture_output=True, env=self.env, check=True
+        )
+        return result.stdout
+
+    def test_fixtures(self):
+        for i, (text, section) in enumerate(STREAM_FIXTURES):
+            path = os.path.join(self.folder, f"doc{i}.md")
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                f.write(text)
+            with self.subTest(document=text, section=section):
+                # Scanned (no cache yet), then the default path, then seeking via its cache
+                streamed = self.run_parser(path, "--section", section, "--stream")
+                default = self.run_parser(path, "--section", section)
+                self.assertEqual(streamed, default)
+                self.assertEqual(self.run_parser(path, "--section", section, "--stream"), default)
+
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.write("docs/design/feat-a/spec.md",
+                   '---\nstatus: "approved"\n---\n# Spec\n\n## Success Criteria\n\nfast\n')
+        self.write("docs/design/feat-b/spec.md",
+                   "---\nstatus: 'draft'\n---\n# Spec\n\n## Success Criteria\n\nsafe\n")
+        self.write(".bolts/fix-c/plan.md", "# Plan\n\n## Steps\n\none\n")
+        self.conn = open_catalog(Path(self.root) / "catalog.sqlite")
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.root)
+
+    def write(self, rel_path, text):
+        path = os.path.join(self.root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def test_frontmatter_status(self):
+        self.assertEqual(frontmatter_status(b'---\nstatus: "draft"\n---\n'), "draft")
+        self.assertEqual(frontmatter_status(b"---\nstatus: 'draft'\n---\n"), "draft")
+        self.assertEqual(frontmatter_status(b"---\nstatus: draft\n---\n"), "draft")
+        self.assertEqual(frontmatter_status(b'---\nstatus: "draft\n---\n'), '"draft')
+        self.assertIsNone(frontmatter_status(b'---\nstatus: ""\n---\n'))
+        self.assertIsNone(frontmatter_status(b"# no frontmatter\nstatus: draft\n"))
+
+    def test_refresh_is_incremental(self):
+        root = Path(self.root)
+        self.assertEqual(refresh_catalog(self.conn, root), (3, 3, 0))
+        self.assertEqual(refresh_catalog(self.conn, root), (3, 0, 0))
+
+        self.write(".bolts/fix-c/plan.md", "# Plan\n\n## Steps\n\none\ntwo\n")
+        os.remove(os.path.join(self.root, "docs/design/feat-b/spec.md"))
+        self.assertEqual(refresh_catalog(self.conn, root), (2, 1, 1))
+        self.assertEqual(refresh_catalog(self.conn, root, full=True), (2, 2, 0))
+        steps = query_catalog(self.conn, section="steps")
+        self.assertEqual([m["content"] for m in steps], ["one\ntwo"])
+
+    def test_query_filters(self):
+        refresh_catalog(self.conn, Path(self.root))
+
+        def paths(matches):
+            return [m["path"] for m in matches]
+
+        self.assertEqual(
+            paths(query_catalog(self.conn, workspace="feat-*")),
+            ["docs/design/feat-a/spec.md", "docs/design/feat-b/spec.md"],
+        )
+        self.assertEqual(paths(query_catalog(self.conn, template="plan")), [".bolts/fix-c/plan.md"])
+        approved = query_catalog(self.conn, status="approved", section="success")
+        self.assertEqual(
+            [(m["workspace"], m["status"], m["section"], m["content"]) for m in approved],
+            [("feat-a", "approved", "Success Criteria", "fast")],
+        )
+        self.assertEqual(query_catalog(self.conn, template="spec", section="missing"), [])
+
+    def run_parser(self, *args):
+        env = dict(os.environ, XDG_CACHE_HOME=os.path.join(self.root, "cache"))
+        return subprocess.run(
+            [sys.executable, SCRIPT, *args], capture_output=True, text=True,
+            env=env, cwd=self.root, check=True,
+        ).stdout
+
+    def test_command_line(self):
+        run = self.run_parser
+        self.assertIn("Indexed 3 artifacts (3 read, 0 removed)", run("index"))
+        matches = json.loads(run("query", "--status", "draft", "--section", "success", "--json"))
+        self.assertEqual([(m["path"], m["content"]) for m in matches],
+                         [("docs/design/feat-b/spec.md", "safe")])
+        self.assertEqual(run("query", "--template", "plan"), "fix-c\tplan\t-\t.bolts/fix-c/plan.md\n")
+
+        # Files named like a command are still documents to extract from
+        self.write("index", "# Index\n\n## Terms\n\nwords\n")
+        self.assertEqual(run("extract", "index", "--section", "Terms"), "words\n")
+        self.assertEqual(run("./index", "--section", "Terms"), "words\n")
+        self.assertEqual(run("docs/design/feat-a/spec.md", "--section", "Success"), "fast\n")
+
+    def test_several_files_and_sections(self):
+        run = self.run_parser
+        # Matches in order, without repeats; a pattern matching nothing is kept
+        design = os.path.join(self.root, "docs", "design")
+        self.assertEqual(
+            bolt_parser.expand_paths([
+                os.path.join(design, "*", "spec.md"),
+                os.path.join(design, "feat-a", "spec.md"),
+                os.path.join(self.root, "**", "feat-b", "*.md"),
+                "nothing/*.md",
+            ]),
+            [
+                os.path.join(design, "feat-a", "spec.md"),
+                os.path.join(design, "feat-b", "spec.md"),
+                "nothing/*.md",
+            ],
+        )
+
+        specs = "docs/design/*/spec.md"
+
+        # One JSON map of file -> section -> content; a glob matching nothing is not found
+        matches = json.loads(
+            run(specs, "nothing/*.md", "--section", "Success", "--section", "Spec", "--json")
+        )
+        self.assertEqual(matches, {
+            "docs/design/feat-a/spec.md": {"Success": "fast", "Spec": "## Success Criteria\n\nfast"},
+            "docs/design/feat-b/spec.md": {"Success": "safe", "Spec": "## Success Criteria\n\nsafe"},
+            "nothing/*.md": {
+                "Success": "Error: File nothing/*.md not found.",
+                "Spec": "Error: File nothing/*.md not found.",
+            },
+        })
+
+        # Text output frames every result, the same with and without --stream
+        framed = (
+            "===== docs/design/feat-a/spec.md :: Success =====\nfast\n\n"
+            "===== docs/design/feat-b/spec.md :: Success =====\nsafe\n\n"
+            "===== .bolts/fix-c/plan.md :: Success =====\n"
+            "Error: Section containing 'Success' not found in .bolts/fix-c/plan.md.\n\n"
+        )
+        args = (specs, ".bolts/fix-c/plan.md", "--section", "Success")
+        self.assertEqual(run(*args), framed)
+        self.assertEqual(run(*args, "--stream"), framed)
+        self.assertEqual(
+            run("docs/design/feat-a/spec.md", "--section", "Spec", "--section", "Success"),
+            "===== docs/design/feat-a/spec.md :: Spec =====\n## Success Criteria\n\nfast\n\n"
+            "===== docs/design/feat-a/spec.md :: Success =====\nfast\n\n",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,429 @@
+"""Benchmarks the Librarian on synthetic vaults and writes the timings as JSON.
+
+    python benchmark.py --sizes 1000 10000 100000 --out results.json
+
+For each size a deterministic vault (frontmatter, headings, prose, lists,
+code, wikilinks and markdown links) is generated, then search_notes,
+read_note, create_note and append_note are timed:
+
+- cold: a fresh interpreter importing librarian and running one call,
+  as an agent invoking the CLI does (the OS file cache stays warm);
+- warm: repeated calls on one tool, as the daemon serves them (with its
+  inotify watcher where available), with the search result cache
+  disabled; `cached` repeats one search with it on.
+
+Searches run with and without synonym expansion, and `grep -rli` over the
+same vault is timed on the same queries as the baseline. The heading
+tokenizer is compared with the line regex it replaced and with mistune.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_REPEAT = 20
+# Marks a generated vault, so --vault-dir can reuse it across runs
+VAULT_MARKER = ".benchmark-vault"
+# Notes written by the create/append benchmarks, removed afterwards
+BENCH_PREFIX = "zz-bench-"
+# Notes the heading parsers are compared on (mistune is slow on big vaults)
+HEADING_SAMPLE = 2000
+
+# Real words with WordNet synonyms, mixed into the prose so that synonym
+# expansion has something to expand
+COMMON_WORDS = [
+    "car", "house", "quick", "error", "build", "deploy", "test", "memory",
+    "search", "index", "network", "storage", "server", "design", "release",
+    "fast", "buy", "start", "big", "problem", "answer", "create", "change",
+]
+SYLLABLES = [
+    "ka", "lo", "mi", "ra", "te", "su", "no", "vi", "den", "tor", "pal",
+    "gri", "mon", "sha", "qua", "zel", "bro", "fin", "lux", "har",
+]
+TAGS = ["project", "idea", "meeting", "research", "howto", "log", "draft", "review"]
+
+
+def _make_vocabulary(rng, size=5000):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+class _Prose:
+    """Zipf-distributed words, so a few terms are everywhere and most are rare."""
+
+    def __init__(self, rng, vocabulary):
+        self.rng = rng
+        self.words = vocabulary + COMMON_WORDS
+        weights = [1.0 / rank for rank in range(1, len(self.words) + 1)]
+        rng.shuffle(self.words)
+        self.cum_weights = []
+        total = 0.0
+        for weight in weights:
+            total += weight
+            self.cum_weights.append(total)
+
+    def words_(self, count):
+        return self.rng.choices(self.words, cum_weights=self.cum_weights, k=count)
+
+    def sentence(self):
+        words = self.words_(self.rng.randint(8, 20))
+        return " ".join(words).capitalize() + "."
+
+
+def generate_vault(folder, n_notes, seed=0):
+    """Writes `n_notes` interlinked notes into `folder`. Returns their relative paths."""
+    rng = random.Random(seed)
+    prose = _Prose(rng, _make_vocabulary(rng))
+    n_folders = min(50, max(5, n_notes // 1000))
+    folders = [""]
+    for i in range(n_folders):
+        top = f"{prose.words_(1)[0]}-{i}"
+        folders.append(top)
+        folders.extend(f"{top}/{prose.words_(1)[0]}-{j}" for j in range(rng.randint(0, 3)))
+    for rel_dir in folders:
+        os.makedirs(os.path.join(folder, rel_dir), exist_ok=True)
+
+    paths = []
+    for i in range(n_notes):
+        rel_dir = rng.choice(folders)
+        name = f"{'-'.join(prose.words_(2))}-{i}.md"
+        paths.append(f"{rel_dir}/{name}" if rel_dir else name)
+
+    for i, rel_path in enumerate(paths):
+        title = " ".join(prose.words_(3)).title()
+        lines = [
+            "---",
+            f"title: {title}",
+            f"tags: [{', '.join(rng.sample(TAGS, rng.randint(1, 3)))}]",
+            f"status: {rng.choice(['draft', 'active', 'done'])}",
+            "---",
+            f"# {title}",
+            "",
+        ]
+        for _ in range(rng.randint(2, 5)):
+            lines += [f"## {' '.join(prose.words_(rng.randint(1, 4))).title()}", ""]
+            lines.append(" ".join(prose.sentence() for _ in range(rng.randint(2, 6))))
+            lines.append("")
+            if rng.random() < 0.4:
+                lines += [f"- {' '.join(prose.words_(rng.randint(3, 8)))}" for _ in range(3)]
+                lines.append("")
+            if rng.random() < 0.15:
+                lines += ["```python", "# set up", f"{prose.words_(1)[0]} = {i}", "```", ""]
+        links = []
+        for target in rng.sample(paths, min(len(paths), rng.randint(1, 6))):
+            if rng.random() < 0.7:
+                links.append(f"[[{os.path.basename(target)[:-3]}]]")
+            else:
+                href = os.path.relpath(target, os.path.dirname(rel_path) or ".")
+                links.append(f"[{os.path.basename(target)[:-3]}]({href})")
+        lines.append("Related: " + ", ".join(links))
+        with open(os.path.join(folder, rel_path), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    hubs = [f"- [[{os.path.basename(path)[:-3]}]]" for path in paths[:50]]
+    with open(os.path.join(folder, "000_Index.md"), "w", encoding="utf-8") as f:
+        f.write("# Knowledge Base Index\n\n" + "\n".join(hubs) + "\n")
+    with open(os.path.join(folder, VAULT_MARKER), "w", encoding="utf-8") as f:
+        json.dump({"notes": n_notes, "seed": seed, "paths": paths}, f)
+    return paths
+
+
+def _queries(rng, paths, vault):
+    """Search terms of varied selectivity: common, rare, prefix and phrase."""
+    with open(os.path.join(vault, rng.choice(paths)), encoding="utf-8") as f:
+        words = [w.strip(".,") for w in f.read().split() if w.strip(".,").isalpha()]
+    rare = rng.choice(words)
+    phrase = " ".join(words[len(words) // 2 : len(words) // 2 + 2])
+    return [["search"], ["deploy", "release"], [rare], [rare[:4]], [phrase]]
+
+
+def _stats(seconds):
+    ms = sorted(s * 1000 for s in seconds)
+    return {
+        "n": len(ms),
+        "mean_ms": round(sum(ms) / len(ms), 3),
+        "median_ms": round(ms[len(ms) // 2], 3),
+        "p95_ms": round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 3),
+        "min_ms": round(ms[0], 3),
+        "max_ms": round(ms[-1], 3),
+    }
+
+
+def _cold_main():
+    """Child process: times `import librarian` plus one tool call."""
+    spec = json.loads(sys.argv[1])
+    started = time.perf_counter()
+    import librarian
+
+    tool = librarian.KnowledgeGraphTool(storage_folder=spec["vault"])
+    if not spec["synonyms"]:
+        tool.synonyms = None
+    getattr(tool, spec["method"])(*spec["args"], **spec["kwargs"])
+    print(json.dumps({"seconds": time.perf_counter() - started}))
+
+
+def _cold(vault, method, args, kwargs=None, synonyms=True):
+    """(in-process seconds, wall seconds including interpreter start) of one cold call."""
+    spec = {
+        "vault": vault, "method": method, "args": args,
+        "kwargs": kwargs or {}, "synonyms": synonyms,
+    }
+    code = (
+        f"import sys; sys.path.insert(0, {SCRIPTS_DIR!r});"
+        " import benchmark; benchmark._cold_main()"
+    )
+    started = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, "-c", code, json.dumps(spec)],
+        capture_output=True, text=True, check=True,
+    )
+    wall = time.perf_counter() - started
+    return json.loads(out.stdout.strip().splitlines()[-1])["seconds"], wall
+
+
+def _timed(fn, calls):
+    seconds = []
+    for args in calls:
+        started = time.perf_counter()
+        fn(*args)
+        seconds.append(time.perf_counter() - started)
+    return seconds
+
+
+def _grep(vault, terms):
+    if shutil.which("grep") is None:
+        return None
+    command = ["grep", "-rliF", "--include=*.md"]
+    for term in terms:
+        command += ["-e", term]
+    started = time.perf_counter()
+    subprocess.run(command + [vault], capture_output=True)
+    return time.perf_counter() - started
+
+
+def _regex_outline(data, heading_re=re.compile(rb"^(#{1,6})\s+(.*?)\s*$")):
+    """Headings as the line-by-line regex used before the tokenizer found them."""
+    outline = []
+    offset = 0
+    for line in data.splitlines(keepends=True):
+        match = heading_re.match(line)
+        if match:
+            outline.append((len(match.group(1)), match.group(2).decode("utf-8", "replace"), offset))
+        offset += len(line)
+    return outline
+
+
+def _mistune_outline(markdown, data):
+    tokens = markdown(data.decode("utf-8", errors="replace"))
+    return [token for token in tokens if token["type"] == "heading"]
+
+
+def benchmark_headings(vault, paths, repeat=DEFAULT_REPEAT):
+    """Compares heading parsers on up to HEADING_SAMPLE notes of the vault.
+
+    The fence-aware tokenizer against the line regex it replaced and, when
+    installed, mistune's AST (as used by md_to_docx.py; it has no notion of
+    frontmatter). Each timing is one pass over the whole sample; `headings`
+    is what each parser found.
+    """
+    sys.path.insert(0, SCRIPTS_DIR)
+    from md_headings import heading_outline
+
+    notes = []
+    for path in paths[:HEADING_SAMPLE]:
+        with open(os.path.join(vault, path), "rb") as f:
+            notes.append(f.read())
+    parsers = {"regex": _regex_outline, "tokenizer": heading_outline}
+    try:
+        import mistune
+    except ImportError:
+        mistune = None
+    if mistune is not None:
+        markdown = mistune.create_markdown(renderer="ast")
+        parsers["mistune"] = lambda data: _mistune_outline(markdown, data)
+
+    results = {"notes": len(notes), "bytes": sum(map(len, notes))}
+    for name, parse in parsers.items():
+        found = sum(len(parse(data)) for data in notes)
+        runs = max(1, repeat // 4)
+        seconds = _timed(lambda: [parse(data) for data in notes], [()] * runs)
+        results[name] = {"headings": found, "pass": _stats(seconds)}
+    return results
+
+
+def benchmark_vault(vault, paths, repeat=DEFAULT_REPEAT, seed=0):
+    """Times every operation against one generated vault. Returns a results dict."""
+    sys.path.insert(0, SCRIPTS_DIR)
+    from librarian import KnowledgeGraphTool, SynonymSource, VaultWatcher
+
+    rng = random.Random(seed + 1)
+    queries = _queries(rng, paths, vault)
+    searches = [(queries[i % len(queries)],) for i in range(repeat)]
+    reads = [(rng.choice(paths),) for _ in range(repeat)]
+    results = {}
+
+    # Index build from scratch, then the cold (fresh process) variants
+    shutil.rmtree(os.path.join(vault, ".librarian"), ignore_errors=True)
+    tool = KnowledgeGraphTool(storage_folder=vault)
+    started = time.perf_counter()
+    tool.sync_notes(full=True)
+    results["index_build_s"] = round(time.perf_counter() - started, 3)
+    tool.close()
+
+    has_synonyms = SynonymSource().available
+    results["synonyms_available"] = has_synonyms
+    variants = [("", False)] + ([("_synonyms", True)] if has_synonyms else [])
+    for suffix, synonyms in variants:
+        for name, kwargs in (("search", {}), ("search_ranked", {"ranked": True})):
+            runs = [
+                _cold(vault, "search_notes", [list(query)], kwargs, synonyms)
+                for (query,) in searches[: max(1, repeat // 4)]
+            ]
+            results[f"{name}{suffix}"] = {
+                "cold": _stats([r[0] for r in runs]),
+                "cold_process": _stats([r[1] for r in runs]),
+            }
+    for name, method, kwargs in (
+        ("read", "read_note", {}),
+        ("read_section", "read_note", {"section": "a"}),
+    ):
+        runs = [_cold(vault, method, [path], kwargs) for (path,) in reads[: max(1, repeat // 4)]]
+        results[name] = {
+            "cold": _stats([r[0] for r in runs]),
+            "cold_process": _stats([r[1] for r in runs]),
+        }
+
+    # Warm: one long-lived tool, as in the daemon (watching the vault if it can)
+    for suffix, synonyms in variants:
+        tool = KnowledgeGraphTool(storage_folder=vault)
+        if not synonyms:
+            tool.synonyms = None
+        tool.search_notes(["warmup"])
+        try:
+            tool.index.watcher = VaultWatcher(vault)
+        except OSError:
+            pass
+        results["watcher"] = tool.index.watcher is not None
+        tool.cache.maxsize = 0
+        results[f"search{suffix}"]["warm"] = _stats(_timed(tool.search_notes, searches))
+        results[f"search_ranked{suffix}"]["warm"] = _stats(
+            _timed(lambda q: tool.search_notes(q, ranked=True), searches)
+        )
+        tool.cache.maxsize = 256
+        tool.search_notes(queries[0])
+        results[f"search{suffix}"]["cached"] = _stats(
+            _timed(tool.search_notes, [(queries[0],)] * repeat)
+        )
+        tool.close()
+
+    tool = KnowledgeGraphTool(storage_folder=vault)
+    results["read"]["warm"] = _stats(_timed(tool.read_note, reads))
+    results["read_section"]["warm"] = _stats(
+        _timed(lambda p: tool.read_note(p, section="a"), reads)
+    )
+    # Writes only touch notes of their own, so the vault can be reused
+    tool.search_notes(["warmup"])  # builds the index, so writes update it
+    created = [f"{BENCH_PREFIX}{i}.md" for i in range(repeat)]
+    creates = [(name, "# Benchmark\n\nnew note body") for name in created]
+    results["create"] = {"warm": _stats(_timed(tool.create_note, creates))}
+    appends = [(name, "appended entry") for name in created]
+    results["append"] = {"warm": _stats(_timed(tool.append_note, appends))}
+    tool.close()
+    cold_creates = [
+        _cold(vault, "create_note", [f"{BENCH_PREFIX}cold-{i}.md", "cold"]) for i in range(3)
+    ]
+    results["create"]["cold"] = _stats([r[0] for r in cold_creates])
+    cold_appends = [_cold(vault, "append_note", [name, "cold entry"]) for name in created[:3]]
+    results["append"]["cold"] = _stats([r[0] for r in cold_appends])
+    for name in os.listdir(vault):
+        if name.startswith(BENCH_PREFIX):
+            os.remove(os.path.join(vault, name))
+
+    results["headings"] = benchmark_headings(vault, paths, repeat)
+    grep = [_grep(vault, query) for (query,) in searches]
+    results["grep"] = None if grep[0] is None else {"warm": _stats(grep)}
+    return results
+
+
+def run(sizes, out, vault_dir=None, repeat=DEFAULT_REPEAT, seed=0):
+    """Generates (or reuses) a vault per size, benchmarks it and writes the JSON report."""
+    sys.path.insert(0, SCRIPTS_DIR)
+    import librarian
+
+    base = vault_dir or tempfile.mkdtemp(prefix="librarian-bench-")
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "index_schema": librarian.INDEX_SCHEMA_VERSION,
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "vaults": [],
+    }
+    try:
+        for size in sizes:
+            vault = os.path.join(base, f"vault-{size}-{seed}")
+            marker = os.path.join(vault, VAULT_MARKER)
+            started = time.perf_counter()
+            if os.path.exists(marker):
+                with open(marker, encoding="utf-8") as f:
+                    paths = json.load(f)["paths"]
+            else:
+                shutil.rmtree(vault, ignore_errors=True)
+                paths = generate_vault(vault, size, seed)
+            generated = time.perf_counter() - started
+            print(f"{size} notes ready in {generated:.1f} s, benchmarking...", file=sys.stderr)
+            entry = {
+                "notes": size,
+                "bytes": sum(
+                    os.path.getsize(os.path.join(vault, path)) for path in paths
+                ),
+                "generate_s": round(generated, 3),
+            }
+            entry.update(benchmark_vault(vault, paths, repeat, seed))
+            report["vaults"].append(entry)
+    finally:
+        if vault_dir is None:
+            shutil.rmtree(base, ignore_errors=True)
+
+    text = json.dumps(report, indent=2) + "\n"
+    if out == "-":
+        sys.stdout.write(text)
+    else:
+        with open(out, "w", encoding="utf-8") as f:
+            f.write(text)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Librarian benchmark suite")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Vault sizes in notes"
+    )
+    parser.add_argument("--out", default="-", help="JSON report path ('-' for stdout)")
+    parser.add_argument("--vault-dir", help="Where to generate vaults (default: a temp dir)")
+    parser.add_argument(
+        "--repeat", type=int, default=DEFAULT_REPEAT, help="Calls per warm measurement"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Vault generator seed")
+    args = parser.parse_args()
+    run(args.sizes, args.out, args.vault_dir, args.repeat, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,2329 @@
 import os
-import subprocess
 import re
+import math
 import sys
-import argparse
+import time
+import zlib
+import array
+import functools
+import posixpath
+import contextlib
+import dataclasses
+from dataclasses import dataclass, field
+from collections import OrderedDict, deque
+from urllib.parse import unquote
 
-try:
-    from nltk.corpus import wordnet
-except ImportError:
-    wordnet = None
+from md_headings import HeadingScanner, heading_outline
+from librarian_cli import (  # the CLI entry point, which also owns the daemon protocol
+    INDEX_DIR,
+    METRICS_LOG_ENV,
+    _check_range,
+    call_daemon,
+    main,
+    socket_path,
+    validate_request,
+)
+
+# Only the search path needs the index, and only the daemon needs sockets:
+# sqlite3, json, socket(server) and nltk are imported where they are used so
+# that read/create/append start as fast as possible.
+
+INDEX_SCHEMA_VERSION = 11
+# One index database per top-level folder; notes at the vault root get their own
+SHARDS_DIR = "shards"
+ROOT_SHARD = ".root"
+# Shard work goes to a process pool only once the shards it touches hold this
+# many bytes of index (or still have to be built): below that, starting workers
+# costs more than the queries themselves
+PARALLEL_MIN_INDEX_BYTES = 64 * 1024 * 1024
+# Byte offsets where append_note entries start, one sidecar file per note
+ENTRIES_DIR = "entries"
+# Write-ahead records for in-flight appends, one per note being appended to
+WAL_DIR = "wal"
+# Seconds a writer waits for another process to release the sqlite index
+INDEX_LOCK_TIMEOUT = 30.0
+# Appended entries rolled out of notes by `compact`: one gzip file per note.
+# Unlike the index these are the only copy, so they live outside INDEX_DIR
+ARCHIVE_DIR = ".archive"
+# Entries `compact` leaves in the live note by default
+COMPACT_KEEP = 10
+# The line `compact` leaves where the archived entries used to be
+ARCHIVE_POINTER_RE = re.compile(
+    r"^> Archived (\d+) older entries \((\d+) bytes\) to .*$", re.M
+)
+
+# inotify(7) event bits used by VaultWatcher
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+)
+TOKEN_RE = re.compile(r"\w+")
+WIKILINK_RE = re.compile(r"\[\[([^\[\]]+)\]\]")
+MDLINK_RE = re.compile(r"\[[^\]]*\]\(([^)\s]+)(?:\s+\"[^\"]*\")?\)")
+FRONTMATTER_RE = re.compile(r"\A---[ \t]*\r?\n(.*?)^---[ \t]*$", re.S | re.M)
+# Obsidian-style inline tags; not URL fragments, link anchors or entities
+TAG_RE = re.compile(r"(?<![\w#&/(])#([A-Za-z_][\w/-]*)")
+# `query` filters: key=value (exact) or key~=value (substring)
+FILTER_RE = re.compile(r"^\s*([\w-]+)\s*(~?=)\s*(.*?)\s*$")
+AGE_RE = re.compile(r"^(\d+(?:\.\d+)?)([smhdw])$")
+AGE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+# Search expressions: a parenthesis, or an optionally field-prefixed word or
+# "quoted phrase" with an optional ~ (add synonyms)
+EXPR_TOKEN_RE = re.compile(r'\s*(?:([()])|(?:(\w+):)?(?:"([^"]*)"|([^\s()"~]+))(~)?)')
+EXPR_FIELDS = ("title", "heading", "tag")
+# Filename resolution for `read`: separators ignored when comparing names,
+# the most typos a near-miss may have, and how many candidates to suggest
+NAME_SEPARATORS_RE = re.compile(r"[\s_\-]+")
+NAME_MAX_DISTANCE = 3
+NAME_SUGGESTIONS = 5
+
+# Ranking: Okapi BM25 parameters, plus how much a hit in a heading counts
+# relative to a body hit and how much synonym hits count relative to the
+# keywords the agent actually asked for
+BM25_K1 = 1.2
+BM25_B = 0.75
+HEADING_WEIGHT = 2.0
+SYNONYM_WEIGHT = 0.5
+SNIPPET_CHARS = 160
+# Search outputs remembered per process (the daemon's lasts across sessions)
+SEARCH_CACHE_SIZE = 256
+# Headings listed per note by `query`; the rest are summarised as a count
+QUERY_HEADINGS = 8
+
+# Semantic search: each note is a hashed character-trigram vector of this
+# many float32s, stored as one row of a raw matrix file next to its shard
+SEMANTIC_DIM = 512
+# Cosine below this is hash-collision noise rather than shared wording
+SEMANTIC_MIN_SCORE = 0.1
+
+# Synonyms: precomputed WordNet table written by setup.py, next to this script,
+# and the per-process memo in front of it
+SYNONYMS_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "synonyms.db")
+SYNONYM_CACHE_SIZE = 4096
+# WordNet's morphy suffix rules per part of speech, so inflected keywords
+# resolve to table entries without loading NLTK. A rule only yields a base
+# form that the table holds for the same part of speech
+MORPHY_SUFFIXES = {
+    "n": [
+        ("s", ""), ("ses", "s"), ("ves", "f"), ("xes", "x"), ("zes", "z"),
+        ("ches", "ch"), ("shes", "sh"), ("men", "man"), ("ies", "y"),
+    ],
+    "v": [
+        ("s", ""), ("ies", "y"), ("es", "e"), ("es", ""),
+        ("ed", "e"), ("ed", ""), ("ing", "e"), ("ing", ""),
+    ],
+    "a": [("er", ""), ("est", ""), ("er", "e"), ("est", "e")],
+}
+
+# Clients with a step counter of their own the daemon remembers
+MAX_CLIENTS = 1024
+
+
+def _tokenize(text):
+    """Lowercased word tokens of `text`, in order."""
+    return TOKEN_RE.findall(text.lower())
+
+
+def _field_positions(text):
+    """Token positions per field: {"body": {term: [pos]}, "heading": {...}}.
+
+    Heading positions share the body's numbering, so a heading hit is also
+    a body hit at the same position.
+    """
+    fields = {"body": {}, "heading": {}}
+    pos = 0
+    scanner = HeadingScanner()
+    for line in text.lower().splitlines():
+        is_heading = scanner.heading(line) is not None
+        for term in TOKEN_RE.findall(line):
+            fields["body"].setdefault(term, []).append(pos)
+            if is_heading:
+                fields["heading"].setdefault(term, []).append(pos)
+            pos += 1
+    return fields, pos
+
+
+def _heading_outline(data):
+    """[(level, title, start, end)] byte offsets of every heading's section.
+
+    A section runs from its heading line to the next heading of the same or
+    a higher level (fewer '#'s), or to the end of the note; `#` lines in
+    code fences and frontmatter are not headings.
+    """
+    return [(level, title, start, end) for level, title, start, _, end, _ in heading_outline(data)]
+
+
+@contextlib.contextmanager
+def _locked(f):
+    """Holds an exclusive advisory lock on open file `f`.
+
+    Locks are per note, so writers to different notes never wait on each
+    other. Without fcntl (Windows) this is a no-op.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _write_durably(f, data):
+    f.write(data)
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _content_hash(data):
+    import hashlib
+
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _create_exclusive(path, content):
+    """Atomically creates `path` with `content`; False if it already exists.
+
+    The content is written to a hidden temp file and hard-linked into
+    place, so readers never see a half-written note and only one of several
+    racing creators wins. Filesystems without hard links fall back to an
+    exclusive open.
+    """
+    data = content.encode("utf-8")
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}.{os.getpid()}.{os.urandom(4).hex()}.tmp")
+    with open(tmp_path, "xb") as f:
+        _write_durably(f, data)
+    try:
+        os.link(tmp_path, path)
+    except FileExistsError:
+        return False
+    except OSError:
+        try:
+            with open(path, "xb") as f:
+                _write_durably(f, data)
+        except FileExistsError:
+            return False
+    finally:
+        os.remove(tmp_path)
+    return True
+
+
+class ReadStats:
+    """Running count of note bytes and files read by this process.
+
+    Module-level because notes are read deep inside the index as well as by
+    the tool; Profile takes the difference around one operation. Reads in
+    text mode count characters, and shard workers in other processes are
+    not counted.
+    """
+
+    def __init__(self):
+        self.bytes_read = 0
+        self.files = 0
+
+    def add(self, size, files=1):
+        self.bytes_read += size
+        self.files += files
+
+
+READS = ReadStats()
+
+
+def _read_range(path, start, end=None):
+    """Decoded bytes [start, end) of a file, reading only that slice."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read() if end is None else f.read(max(0, end - start))
+    READS.add(len(data))
+    return data.decode("utf-8", errors="replace")
+
+
+def _extract_links(rel_path, text):
+    """Vault-relative targets of the note's [[wikilinks]] and markdown links.
+
+    Wikilinks are taken as written (`[[Topic|alias]]` -> "Topic.md"), so a
+    bare name may still need resolving against the vault. Markdown links
+    are resolved relative to the linking note; external URLs, in-page
+    anchors and non-markdown files are skipped.
+    """
+    targets = set()
+    for match in WIKILINK_RE.finditer(text):
+        name = match.group(1).split("|")[0].split("#")[0].strip()
+        if name:
+            targets.add(name if name.endswith(".md") else name + ".md")
+    for match in MDLINK_RE.finditer(text):
+        href = unquote(match.group(1).split("#")[0])
+        if not href.endswith(".md") or "://" in href or href.startswith("mailto:"):
+            continue
+        if href.startswith("/"):
+            target = posixpath.normpath(href.lstrip("/"))
+        else:
+            target = posixpath.normpath(posixpath.join(posixpath.dirname(rel_path), href))
+        if not target.startswith(".."):
+            targets.add(target)
+    targets.discard(rel_path)
+    return targets
+
+
+def _yaml_scalar(value):
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+        return value[1:-1]
+    return value
+
+
+def _frontmatter(text):
+    """({key: [values]}, body) of a note starting with a `---` YAML block.
+
+    Only the flat subset notes actually use is understood: `key: value`,
+    inline lists (`[a, b]`) and `- item` block lists. Values stay strings.
+    """
+    match = FRONTMATTER_RE.match(text)
+    if not match:
+        return {}, text
+    fields = {}
+    key = None
+    for line in match.group(1).splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith("#"):
+            continue
+        if stripped.startswith("- ") and key is not None:
+            fields[key].append(_yaml_scalar(stripped[2:]))
+            continue
+        name, sep, value = line.partition(":")
+        if not sep or line[0].isspace():
+            key = None  # nested mappings are not supported
+            continue
+        key = name.strip().lower()
+        value = value.strip()
+        if value.startswith("[") and value.endswith("]"):
+            fields[key] = [_yaml_scalar(v) for v in value[1:-1].split(",") if v.strip()]
+        else:
+            fields[key] = [_yaml_scalar(value)] if value else []
+    return fields, text[match.end():]
+
+
+def _note_metadata(rel_path, text, outline):
+    """(title, {frontmatter key: [values]}, tags) of a note.
+
+    The title is the frontmatter `title`, else the first heading, else the
+    file name. Tags come from frontmatter `tags`/`tag` and inline `#tags`.
+    """
+    fields, body = _frontmatter(text)
+    tags = {
+        tag.lstrip("#").lower()
+        for key in ("tags", "tag")
+        for value in fields.get(key, [])
+        for tag in re.split(r"[,\s]+", value)
+        if tag.lstrip("#")
+    }
+    tags.update(tag.lower() for tag in TAG_RE.findall(body))
+    if fields.get("title"):
+        title = fields["title"][0]
+    elif outline:
+        title = outline[0][1]
+    else:
+        title = posixpath.splitext(posixpath.basename(rel_path))[0]
+    return title, fields, tags
+
+
+def _parse_filter(text):
+    """"key=value" or "key~=value" -> (key, op, value); ValueError if malformed.
+
+    `modified_since`/`modified_before` values become epoch seconds.
+    """
+    match = FILTER_RE.match(text)
+    if not match or not match.group(3):
+        raise ValueError(f"expected KEY=VALUE or KEY~=VALUE, got '{text}'")
+    key, op, value = match.groups()
+    key = key.lower().replace("-", "_")
+    if key in ("modified_since", "modified_before"):
+        value = _parse_time(value)
+    return key, op, value
+
+
+def _parse_expression(text):
+    """Parses a search expression into nested tuples for NoteIndex.evaluate.
+
+    Terms are words or "quoted phrases", optionally prefixed with `title:`,
+    `heading:` or `tag:` and suffixed with `~` to add synonyms. They combine
+    with AND (implied between adjacent terms), OR, NOT and parentheses.
+    Nodes are ("or", nodes), ("and", nodes), ("not", node), ("tag", name)
+    and ("term", field, text, synonyms). ValueError if malformed.
+    """
+    tokens = []
+    pos, text = 0, text.strip()
+    while pos < len(text):
+        match = EXPR_TOKEN_RE.match(text, pos)
+        if not match:
+            raise ValueError(f"cannot parse search expression at '{text[pos:].strip()}'")
+        pos = match.end()
+        paren, field, phrase, word, tilde = match.groups()
+        if paren:
+            tokens.append(paren)
+        elif field is None and phrase is None and word in ("AND", "OR", "NOT"):
+            tokens.append(word)
+        else:
+            value = word if phrase is None else phrase
+            if field is not None and field.lower() not in EXPR_FIELDS:
+                value, field = f"{field} {value}", None  # e.g. a URL: just words
+            if field is not None and field.lower() == "tag":
+                tokens.append(("tag", value.lstrip("#").lower()))
+            else:
+                field = "body" if field is None else field.lower()
+                tokens.append(("term", field, value, tilde is not None))
+
+    def parse_or(i):
+        nodes = []
+        while True:
+            node, i = parse_and(i)
+            nodes.append(node)
+            if i == len(tokens) or tokens[i] != "OR":
+                return (nodes[0] if len(nodes) == 1 else ("or", tuple(nodes))), i
+            i += 1
+
+    def parse_and(i):
+        node, i = parse_not(i)
+        nodes = [node]
+        while i < len(tokens) and tokens[i] not in ("OR", ")"):
+            if tokens[i] == "AND":
+                i += 1
+            node, i = parse_not(i)
+            nodes.append(node)
+        return (nodes[0] if len(nodes) == 1 else ("and", tuple(nodes))), i
+
+    def parse_not(i):
+        if i < len(tokens) and tokens[i] == "NOT":
+            node, i = parse_not(i + 1)
+            return ("not", node), i
+        if i == len(tokens):
+            raise ValueError("search expression ends early")
+        token = tokens[i]
+        if token == "(":
+            node, i = parse_or(i + 1)
+            if i == len(tokens) or tokens[i] != ")":
+                raise ValueError("missing ')' in search expression")
+            return node, i + 1
+        if isinstance(token, tuple):
+            return token, i + 1
+        raise ValueError(f"unexpected '{token}' in search expression")
+
+    if not tokens:
+        raise ValueError("empty search expression")
+    node, i = parse_or(0)
+    if i != len(tokens):
+        raise ValueError(f"unexpected '{tokens[i]}' in search expression")
+    return node
+
+
+def _name_key(text):
+    """Lowercased note name or path without ".md" and separators, for matching."""
+    text = text.lower()
+    if text.endswith(".md"):
+        text = text[:-3]
+    return NAME_SEPARATORS_RE.sub("", text)
+
+
+def _edit_distance(a, b, bound):
+    """Levenshtein distance of `a` and `b`, or bound + 1 once it must exceed `bound`."""
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    previous = list(range(len(b) + 1))
+    for i, char in enumerate(a, start=1):
+        current = [i]
+        for j, other in enumerate(b, start=1):
+            current.append(min(
+                previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != other)
+            ))
+        if min(current) > bound:
+            return bound + 1
+        previous = current
+    return previous[-1]
+
+
+def _positive_terms(node, negated=False):
+    """Texts of the body, heading and title terms a match must contain."""
+    kind = node[0]
+    if kind == "term":
+        return [] if negated else [node[2]]
+    if kind == "not":
+        return _positive_terms(node[1], not negated)
+    if kind in ("and", "or"):
+        return [term for child in node[1] for term in _positive_terms(child, negated)]
+    return []
+
+
+def _parse_time(value):
+    """Epoch seconds for an ISO date/time or an age such as "7d", "12h" or "30m"."""
+    match = AGE_RE.match(value)
+    if match:
+        return time.time() - float(match.group(1)) * AGE_UNITS[match.group(2)]
+    from datetime import datetime
+
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ValueError(f"expected a date, a time or an age like 7d, got '{value}'")
+
+
+@functools.lru_cache(maxsize=65536)
+def _term_features(term):
+    """(bucket, sign) of each character trigram of " term ", via a stable hash."""
+    padded = f" {term} "
+    features = []
+    for i in range(len(padded) - 2):
+        h = zlib.crc32(padded[i : i + 3].encode("utf-8"))
+        features.append((h % SEMANTIC_DIM, 1.0 if h >> 31 else -1.0))
+    return tuple(features)
+
+
+def _ngram_vector(term_counts):
+    """L2-normalised signed feature-hashing vector of a note's terms, or None.
+
+    Trigrams make "migrate", "migrating" and "migrations" land close together
+    without a language model; terms are weighted by sublinear frequency.
+    Pure Python, so writing notes never needs numpy.
+    """
+    vec = [0.0] * SEMANTIC_DIM
+    for term, count in term_counts.items():
+        weight = 1.0 + math.log(count)
+        for bucket, sign in _term_features(term):
+            vec[bucket] += sign * weight
+    norm = math.hypot(*vec)
+    if not norm:
+        return None
+    return array.array("f", [v / norm for v in vec])
+
+
+def _prefix_range(rel_dir):
+    """(low, high) bounds selecting every path inside `rel_dir` with >= / <."""
+    return rel_dir + "/", rel_dir + "0"  # "0" sorts right after "/"
+
+
+class VaultWatcher:
+    """Change feed for a vault from Linux inotify, read without blocking.
+
+    `changes()` returns the vault-relative paths (notes or folders) touched
+    since the last call, or None when the kernel queue overflowed and the
+    caller has to rescan. Hidden folders (like the index itself) are not
+    watched. Raises OSError where inotify is unavailable.
+    """
+
+    def __init__(self, storage_folder):
+        import ctypes
+        import ctypes.util
+
+        self.storage_folder = storage_folder
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not available on this platform")
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs = {}  # watch descriptor -> vault-relative folder
+        self._watch_tree("")
+
+    def _watch_tree(self, rel_dir):
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            full_path = os.path.join(self.storage_folder, current)
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(full_path), WATCH_MASK)
+            if wd < 0:
+                continue
+            self._dirs[wd] = current
+            try:
+                entries = list(os.scandir(full_path))
+            except OSError:
+                continue
+            for entry in entries:
+                if not entry.name.startswith(".") and entry.is_dir(follow_symlinks=False):
+                    stack.append(posixpath.join(current, entry.name))
+
+    def changes(self):
+        import struct
+
+        changed = set()
+        overflow = False
+        while True:
+            try:
+                buffer = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = struct.unpack_from("iIII", buffer, offset)
+                raw_name = buffer[offset + 16 : offset + 16 + length].rstrip(b"\0")
+                offset += 16 + length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                if mask & IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                    continue
+                rel_dir = self._dirs.get(wd)
+                if rel_dir is None:
+                    continue
+                if mask & IN_DELETE_SELF:
+                    changed.add(rel_dir)
+                    continue
+                name = os.fsdecode(raw_name)
+                if not name or name.startswith("."):
+                    continue
+                rel_path = posixpath.join(rel_dir, name)
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self._watch_tree(rel_path)
+                    changed.add(rel_path)
+                elif name.endswith(".md") and not mask & IN_CREATE:
+                    changed.add(rel_path)  # creation is followed by IN_CLOSE_WRITE
+        return None if overflow else changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class NoteIndex:
+    """Persistent inverted index (field, term -> note paths and token positions)
+    for one shard of the vault: a top-level folder, or the notes at the root.
+
+    Stored as sqlite in `<vault>/.librarian/shards/<shard>.db`. Notes the
+    tool creates are indexed immediately; appended-to notes and notes edited
+    by hand are picked up by `sync`, which compares the recorded mtime/size
+    with the filesystem. `VaultIndex` combines the shards.
+    """
+
+    def __init__(self, storage_folder, shard=""):
+        self.storage_folder = storage_folder
+        self.shard = shard
+        base = os.path.join(storage_folder, INDEX_DIR, SHARDS_DIR, shard or ROOT_SHARD)
+        self.db_path = base + ".db"
+        self.vectors_path = base + ".f32"
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            import sqlite3
+
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            # Callers serialize access (see make_server), but may close the
+            # connection from another thread than the one that opened it
+            self._conn = sqlite3.connect(
+                self.db_path, timeout=INDEX_LOCK_TIMEOUT, check_same_thread=False
+            )
+            self._ensure_schema()
+        return self._conn
+
+    def exists(self):
+        return self._conn is not None or os.path.exists(self.db_path)
+
+    def _ensure_schema(self):
+        conn = self._conn
+        if conn.execute("PRAGMA user_version").fetchone()[0] == INDEX_SCHEMA_VERSION:
+            return
+        # WAL lets searches read while another process writes
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute("PRAGMA user_version").fetchone()[0] == INDEX_SCHEMA_VERSION:
+            conn.rollback()  # another process migrated it while we waited
+            return
+        # Unknown or outdated layout: the index is derived data, start over
+        script = """
+            DROP TABLE IF EXISTS notes;
+            DROP TABLE IF EXISTS postings;
+            DROP TABLE IF EXISTS links;
+            DROP TABLE IF EXISTS headings;
+            DROP TABLE IF EXISTS dirs;
+            DROP TABLE IF EXISTS vector_rows;
+            DROP TABLE IF EXISTS vector_free;
+            DROP TABLE IF EXISTS tags;
+            DROP TABLE IF EXISTS fields;
+            DROP TABLE IF EXISTS meta;
+            CREATE TABLE meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT INTO meta (key, value) VALUES ('generation', 0);
+            CREATE TABLE notes (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                dir TEXT NOT NULL,
+                name TEXT NOT NULL,
+                mtime REAL NOT NULL,
+                size INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                length INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                links INTEGER NOT NULL
+            );
+            CREATE INDEX notes_name ON notes (name);
+            CREATE INDEX notes_dir ON notes (dir);
+            CREATE INDEX notes_mtime ON notes (mtime);
+            CREATE TABLE tags (
+                tag TEXT NOT NULL,
+                path TEXT NOT NULL,
+                PRIMARY KEY (tag, path)
+            ) WITHOUT ROWID;
+            CREATE INDEX tags_path ON tags (path);
+            CREATE TABLE fields (
+                path TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL
+            );
+            CREATE INDEX fields_path ON fields (path);
+            CREATE INDEX fields_key ON fields (key, value);
+            CREATE TABLE dirs (
+                path TEXT PRIMARY KEY,
+                mtime REAL NOT NULL,
+                children TEXT NOT NULL
+            );
+            CREATE TABLE postings (
+                field TEXT NOT NULL,
+                term TEXT NOT NULL,
+                note INTEGER NOT NULL,
+                positions BLOB NOT NULL,
+                PRIMARY KEY (field, term, note)
+            ) WITHOUT ROWID;
+            CREATE INDEX postings_note ON postings (note);
+            CREATE TABLE links (
+                source TEXT NOT NULL,
+                target TEXT NOT NULL,
+                PRIMARY KEY (source, target)
+            ) WITHOUT ROWID;
+            CREATE INDEX links_target ON links (target);
+            CREATE TABLE headings (
+                path TEXT NOT NULL,
+                ordinal INTEGER NOT NULL,
+                level INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                start INTEGER NOT NULL,
+                end INTEGER NOT NULL,
+                PRIMARY KEY (path, ordinal)
+            ) WITHOUT ROWID;
+            CREATE TABLE vector_rows (
+                path TEXT PRIMARY KEY,
+                row INTEGER NOT NULL UNIQUE
+            );
+            CREATE TABLE vector_free (row INTEGER PRIMARY KEY)
+            """
+        for statement in script.split(";"):
+            conn.execute(statement)
+        if os.path.exists(self.vectors_path):
+            os.remove(self.vectors_path)
+        conn.execute(f"PRAGMA user_version = {INDEX_SCHEMA_VERSION}")
+        conn.commit()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    @property
+    def generation(self):
+        """Moves on with every change to the shard's notes, by any process."""
+        return self.conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+
+    def _changed(self):
+        # Inside the writer's transaction, so readers see it with the change
+        self.conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+
+    # --- maintenance ---
+
+    def _note_files(self):
+        """Yields (relative path, stat) for every note in the shard, skipping hidden folders."""
+        stack = [os.path.join(self.storage_folder, self.shard)]
+        while stack:
+            current = stack.pop()
+            try:
+                entries = list(os.scandir(current))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if self.shard:  # the root shard's folders are shards of their own
+                        stack.append(entry.path)
+                elif entry.name.endswith(".md") and entry.is_file():
+                    rel = os.path.relpath(entry.path, self.storage_folder)
+                    yield rel.replace(os.sep, "/"), entry.stat()
+
+    def _index_file(self, rel_path, st=None):
+        conn = self.conn
+        full_path = os.path.join(self.storage_folder, rel_path)
+        try:
+            if st is None:
+                st = os.stat(full_path)
+            with open(full_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            self._remove_file(rel_path)
+            return
+        READS.add(len(data))
+
+        digest = _content_hash(data)
+        row = conn.execute("SELECT hash FROM notes WHERE path = ?", (rel_path,)).fetchone()
+        if row is not None and row[0] == digest:
+            # Touched but unchanged (e.g. a git checkout): just record the new stat
+            conn.execute(
+                "UPDATE notes SET mtime = ?, size = ? WHERE path = ?",
+                (st.st_mtime, st.st_size, rel_path),
+            )
+            return
+
+        self._changed()
+        text = data.decode("utf-8", errors="replace")
+        fields, length = _field_positions(text)
+        outline = _heading_outline(data)
+        title, frontmatter, tags = _note_metadata(rel_path, text, outline)
+        fields["title"] = {}
+        for pos, term in enumerate(_tokenize(title)):
+            fields["title"].setdefault(term, []).append(pos)
+
+        links = _extract_links(rel_path, text)
+        rel_dir, name = posixpath.split(rel_path)
+        # Upserted, not replaced: postings refer to the note by its row id
+        conn.execute(
+            "INSERT INTO notes (path, dir, name, mtime, size, hash, length, title, links)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (path) DO UPDATE SET mtime = excluded.mtime, size = excluded.size,"
+            " hash = excluded.hash, length = excluded.length, title = excluded.title,"
+            " links = excluded.links",
+            (
+                rel_path, rel_dir, name, st.st_mtime, st.st_size, digest, length,
+                title, len(links),
+            ),
+        )
+        note_id = conn.execute("SELECT id FROM notes WHERE path = ?", (rel_path,)).fetchone()[0]
+        conn.execute("DELETE FROM postings WHERE note = ?", (note_id,))
+        conn.executemany(
+            "INSERT INTO postings (field, term, note, positions) VALUES (?, ?, ?, ?)",
+            (
+                (field, term, note_id, array.array("I", plist).tobytes())
+                for field, positions in fields.items()
+                for term, plist in positions.items()
+            ),
+        )
+        conn.execute("DELETE FROM links WHERE source = ?", (rel_path,))
+        conn.executemany(
+            "INSERT INTO links (source, target) VALUES (?, ?)",
+            ((rel_path, target) for target in links),
+        )
+        conn.execute("DELETE FROM headings WHERE path = ?", (rel_path,))
+        conn.executemany(
+            "INSERT INTO headings (path, ordinal, level, title, start, end)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            ((rel_path, i, *section) for i, section in enumerate(outline)),
+        )
+        conn.execute("DELETE FROM tags WHERE path = ?", (rel_path,))
+        conn.executemany(
+            "INSERT INTO tags (tag, path) VALUES (?, ?)", ((tag, rel_path) for tag in tags)
+        )
+        conn.execute("DELETE FROM fields WHERE path = ?", (rel_path,))
+        conn.executemany(
+            "INSERT INTO fields (path, key, value) VALUES (?, ?, ?)",
+            (
+                (rel_path, key, value)
+                for key, values in frontmatter.items()
+                for value in values
+            ),
+        )
+        self._store_vector(
+            rel_path, _ngram_vector({t: len(p) for t, p in fields["body"].items()})
+        )
+
+    def _store_vector(self, rel_path, vector):
+        """Writes a note's vector into its matrix row (allocating one if new).
+
+        Called inside the index transaction, whose write lock also keeps
+        concurrent writers from claiming the same row.
+        """
+        conn = self.conn
+        row = conn.execute("SELECT row FROM vector_rows WHERE path = ?", (rel_path,)).fetchone()
+        if vector is None:
+            if row is not None:
+                self._free_vector(rel_path, row[0])
+            return
+        if row is not None:
+            row = row[0]
+        else:
+            free = conn.execute("SELECT row FROM vector_free LIMIT 1").fetchone()
+            if free is not None:
+                row = free[0]
+                conn.execute("DELETE FROM vector_free WHERE row = ?", (row,))
+            else:
+                stored = conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM vector_rows")
+                file_rows = (
+                    os.path.getsize(self.vectors_path) // (SEMANTIC_DIM * 4)
+                    if os.path.exists(self.vectors_path)
+                    else 0
+                )
+                row = max(stored.fetchone()[0], file_rows)
+            conn.execute(
+                "INSERT INTO vector_rows (path, row) VALUES (?, ?)", (rel_path, row)
+            )
+        self._write_vector_row(row, vector.tobytes())
+
+    def _write_vector_row(self, row, data):
+        mode = "r+b" if os.path.exists(self.vectors_path) else "w+b"
+        with open(self.vectors_path, mode) as f:
+            f.seek(row * SEMANTIC_DIM * 4)
+            f.write(data)
+
+    def _free_vector(self, rel_path, row):
+        # A zero row scores 0 against every query, so it never surfaces
+        self._write_vector_row(row, bytes(SEMANTIC_DIM * 4))
+        self.conn.execute("DELETE FROM vector_rows WHERE path = ?", (rel_path,))
+        self.conn.execute("INSERT OR IGNORE INTO vector_free (row) VALUES (?)", (row,))
+
+    def _remove_file(self, rel_path):
+        self._changed()
+        self._store_vector(rel_path, None)
+        self.conn.execute(
+            "DELETE FROM postings WHERE note = (SELECT id FROM notes WHERE path = ?)",
+            (rel_path,),
+        )
+        self.conn.execute("DELETE FROM links WHERE source = ?", (rel_path,))
+        self.conn.execute("DELETE FROM headings WHERE path = ?", (rel_path,))
+        self.conn.execute("DELETE FROM tags WHERE path = ?", (rel_path,))
+        self.conn.execute("DELETE FROM fields WHERE path = ?", (rel_path,))
+        self.conn.execute("DELETE FROM notes WHERE path = ?", (rel_path,))
+
+    def update(self, rel_path):
+        """Re-indexes one note after the tool wrote it."""
+        with self.conn:
+            self._index_file(rel_path)
+
+    def ensure_current(self, rel_path):
+        """Re-indexes one note if it changed on disk, without walking the vault.
+
+        Returns whether it did.
+        """
+        try:
+            st = os.stat(os.path.join(self.storage_folder, rel_path))
+        except OSError:
+            return False
+        row = self.conn.execute(
+            "SELECT mtime, size FROM notes WHERE path = ?", (rel_path,)
+        ).fetchone()
+        if row == (st.st_mtime, st.st_size):
+            return False
+        with self.conn:
+            self._index_file(rel_path, st)
+        return True
+
+    def sync(self, full=False):
+        """Re-indexes notes that changed on disk, using the vault manifest.
+
+        The manifest records each folder's mtime and subfolders. A quick sync
+        (the default) lists only folders whose mtime moved, i.e. where notes
+        were added, removed or renamed (including editors and git replacing
+        files); in the other folders it stats the notes it already knows,
+        which catches edits made in place (they leave the folder mtime
+        alone). Only notes whose mtime or size moved are read again. `full`
+        lists every folder, in case a folder mtime did not move when it
+        should have. Returns the number of notes touched.
+        """
+        conn = self.conn
+        with conn:
+            touched, seen_dirs = self._walk([self.shard], full)
+            recorded = {path for (path,) in conn.execute("SELECT path FROM dirs")}
+            recorded.update(dir for (dir,) in conn.execute("SELECT DISTINCT dir FROM notes"))
+            for rel_dir in recorded - seen_dirs:
+                touched += self._remove_dir(rel_dir)
+        return touched
+
+    def _walk(self, roots, full):
+        """Syncs the folders under `roots`. Returns (notes touched, folders seen)."""
+        conn = self.conn
+        touched = 0
+        seen_dirs = set()
+        stack = list(roots)
+        while stack:
+            rel_dir = stack.pop()
+            full_dir = os.path.join(self.storage_folder, rel_dir)
+            try:
+                dir_stat = os.stat(full_dir)  # before listing, so later changes still show
+            except OSError:
+                continue
+            seen_dirs.add(rel_dir)
+            row = conn.execute(
+                "SELECT mtime, children FROM dirs WHERE path = ?", (rel_dir,)
+            ).fetchone()
+            if not full and row is not None and row[0] == dir_stat.st_mtime:
+                # Nothing added, removed or renamed here: only in-place edits to find
+                touched += self._restat_dir(rel_dir)
+                stack.extend(child for child in row[1].split("\n") if child)
+                continue
+
+            files, subdirs = {}, []
+            try:
+                entries = list(os.scandir(full_dir))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                rel_path = posixpath.join(rel_dir, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    if self.shard:
+                        subdirs.append(rel_path)
+                elif entry.name.endswith(".md") and entry.is_file():
+                    files[rel_path] = entry.stat()
+
+            known = {
+                path: (mtime, size)
+                for path, mtime, size in conn.execute(
+                    "SELECT path, mtime, size FROM notes WHERE dir = ?", (rel_dir,)
+                )
+            }
+            for rel_path, st in files.items():
+                if known.pop(rel_path, None) != (st.st_mtime, st.st_size):
+                    self._index_file(rel_path, st)
+                    touched += 1
+            for rel_path in known:
+                self._remove_file(rel_path)
+                touched += 1
+            conn.execute(
+                "INSERT OR REPLACE INTO dirs (path, mtime, children) VALUES (?, ?, ?)",
+                (rel_dir, dir_stat.st_mtime, "\n".join(sorted(subdirs))),
+            )
+            stack.extend(subdirs)
+        return touched, seen_dirs
+
+    def _restat_dir(self, rel_dir):
+        """Re-indexes the notes of a listed folder whose mtime or size moved. Returns how many."""
+        touched = 0
+        notes = self.conn.execute(
+            "SELECT path, mtime, size FROM notes WHERE dir = ?", (rel_dir,)
+        ).fetchall()
+        for rel_path, mtime, size in notes:
+            try:
+                st = os.stat(os.path.join(self.storage_folder, rel_path))
+            except OSError:
+                self._remove_file(rel_path)
+                touched += 1
+                continue
+            if (st.st_mtime, st.st_size) != (mtime, size):
+                self._index_file(rel_path, st)
+                touched += 1
+        return touched
+
+    def _remove_dir(self, rel_dir):
+        """Drops a vanished folder's notes and manifest entries (not subfolders)."""
+        paths = [
+            path
+            for (path,) in self.conn.execute("SELECT path FROM notes WHERE dir = ?", (rel_dir,))
+        ]
+        for rel_path in paths:
+            self._remove_file(rel_path)
+        self.conn.execute("DELETE FROM dirs WHERE path = ?", (rel_dir,))
+        return len(paths)
+
+    def apply_changes(self, changes):
+        """Syncs just the notes and folders a watcher reported in this shard."""
+        conn = self.conn
+        touched = 0
+        with conn:
+            for rel_path in sorted(changes):
+                full_path = os.path.join(self.storage_folder, rel_path)
+                if os.path.isdir(full_path):
+                    count, _ = self._walk([rel_path], full=True)
+                    touched += count
+                elif os.path.isfile(full_path):
+                    st = os.stat(full_path)
+                    row = conn.execute(
+                        "SELECT mtime, size FROM notes WHERE path = ?", (rel_path,)
+                    ).fetchone()
+                    if row != (st.st_mtime, st.st_size):
+                        self._index_file(rel_path, st)
+                        touched += 1
+                else:
+                    # Gone: a note, or a folder with everything below it
+                    low, high = _prefix_range(rel_path)
+                    gone = [rel_path] + [
+                        path
+                        for (path,) in conn.execute(
+                            "SELECT path FROM notes WHERE path >= ? AND path < ?", (low, high)
+                        )
+                    ]
+                    for path in gone:
+                        if self.has_note(path):
+                            self._remove_file(path)
+                            touched += 1
+                    conn.execute(
+                        "DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)",
+                        (rel_path, low, high),
+                    )
+        return touched
+
+    # --- lookups ---
+
+    def _postings(self, token, prefix=False, field="body"):
+        """{path: [positions]} for an exact token, or every token starting with it."""
+        if prefix:
+            rows = self.conn.execute(
+                "SELECT notes.path, positions FROM postings JOIN notes ON notes.id = note"
+                " WHERE field = ? AND term >= ? AND term < ?",
+                (field, token, token + "\uffff"),
+            )
+        else:
+            rows = self.conn.execute(
+                "SELECT notes.path, positions FROM postings JOIN notes ON notes.id = note"
+                " WHERE field = ? AND term = ?",
+                (field, token),
+            )
+        result = {}
+        for path, positions in rows:
+            packed = array.array("I")
+            packed.frombytes(positions)
+            result.setdefault(path, []).extend(packed)
+        return result
+
+    def match(self, term, field="body"):
+        """{path: [start positions]} of `term`, or None when it has no word characters.
+
+        A single word matches any indexed word starting with it (so "data"
+        also finds "database"). Several words are matched as a phrase using
+        the stored positions, the last word again acting as a prefix.
+        """
+        tokens = _tokenize(term)
+        if not tokens:
+            return None
+        if len(tokens) == 1:
+            return self._postings(tokens[0], prefix=True, field=field)
+
+        candidates = None
+        per_token = []
+        for i, token in enumerate(tokens):
+            postings = self._postings(token, prefix=i == len(tokens) - 1, field=field)
+            paths = set(postings)
+            candidates = paths if candidates is None else candidates & paths
+            if not candidates:
+                return {}
+            per_token.append(postings)
+
+        matches = {}
+        for path in candidates:
+            starts = set(per_token[0][path])
+            for offset, postings in enumerate(per_token[1:], start=1):
+                starts &= {p - offset for p in postings[path]}
+                if not starts:
+                    break
+            if starts:
+                matches[path] = sorted(starts)
+        return matches
+
+    def lookup(self, term):
+        """Paths matching `term`, or None when it has no word characters."""
+        matches = self.match(term)
+        return None if matches is None else set(matches)
+
+    def evaluate(self, node):
+        """Paths of this shard matching a parsed search expression.
+
+        Terms are positional matches as in `match`; AND intersects, OR
+        unites, and NOT subtracts from its siblings (or from every note).
+        """
+        kind = node[0]
+        if kind == "term":
+            _, field, text, _ = node
+            matches = self.match(text, field)
+            if matches is None:  # no word characters: only the body can contain it
+                return set(self.scan(text)) if field == "body" else set()
+            return set(matches)
+        if kind == "tag":
+            # A tag also matches its nested tags ("project" finds "project/x")
+            rows = self.conn.execute(
+                "SELECT path FROM tags WHERE tag = ? OR (tag >= ? AND tag < ?)",
+                (node[1], node[1] + "/", node[1] + "0"),
+            )
+            return {path for (path,) in rows}
+        if kind == "not":
+            return set(self.paths()) - self.evaluate(node[1])
+        if kind == "or":
+            return set().union(*(self.evaluate(child) for child in node[1]))
+        paths = None
+        for child in node[1]:
+            if child[0] != "not":
+                found = self.evaluate(child)
+                paths = found if paths is None else paths & found
+                if not paths:
+                    return set()
+        if paths is None:
+            paths = set(self.paths())
+        for child in node[1]:
+            if child[0] == "not":
+                paths -= self.evaluate(child[1])
+        return paths
+
+    def paths(self):
+        """Every note path in the shard."""
+        return [path for (path,) in self.conn.execute("SELECT path FROM notes")]
+
+    def hits(self, terms):
+        """This shard's BM25 inputs for `terms`, for VaultIndex.rank to combine.
+
+        Returns ({term: (body counts, heading counts)} for terms with hits,
+        number of notes, total length in tokens, {path: length} of the hits).
+        """
+        hits = {}
+        for term in terms:
+            matches = self.match(term)
+            if matches is None:
+                counts, heading_counts = self.scan(term), {}
+            else:
+                counts = {path: len(starts) for path, starts in matches.items()}
+                heading_counts = {
+                    path: len(starts)
+                    for path, starts in self.match(term, field="heading").items()
+                }
+            if counts:
+                hits[term] = (counts, heading_counts)
+        count, total = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM notes"
+        ).fetchone()
+        paths = {path for counts, _ in hits.values() for path in counts}
+        lengths = {
+            path: length
+            for path, length in self.conn.execute("SELECT path, length FROM notes")
+            if path in paths
+        }
+        return hits, count, total, lengths
+
+    def sections(self, rel_path):
+        """[(level, title, start, end)] for a note, from the heading index."""
+        return self.conn.execute(
+            "SELECT level, title, start, end FROM headings WHERE path = ? ORDER BY ordinal",
+            (rel_path,),
+        ).fetchall()
+
+    def has_note(self, rel_path):
+        row = self.conn.execute("SELECT 1 FROM notes WHERE path = ?", (rel_path,))
+        return row.fetchone() is not None
+
+    def named(self, name):
+        """Paths of the shard's notes called `name`, shortest first."""
+        rows = self.conn.execute(
+            "SELECT path FROM notes WHERE name = ? ORDER BY length(path), path", (name,)
+        )
+        return [path for (path,) in rows]
+
+    def links_from(self, rel_path):
+        """Link targets of one note, as written."""
+        rows = self.conn.execute(
+            "SELECT target FROM links WHERE source = ? ORDER BY target", (rel_path,)
+        )
+        return [target for (target,) in rows]
+
+    def links_to(self, targets):
+        """Notes in this shard linking to any of `targets`."""
+        placeholders = ",".join("?" * len(targets))
+        rows = self.conn.execute(
+            f"SELECT DISTINCT source FROM links WHERE target IN ({placeholders})",
+            targets,
+        )
+        return [source for (source,) in rows]
+
+    def query(self, filters, limit):
+        """Metadata of the notes matching every (key, op, value) filter, newest first.
+
+        See KnowledgeGraphTool.query_notes for the keys. Returns at most
+        `limit` dicts with path, title, mtime, size, links, tags, headings
+        and fields (the frontmatter).
+        """
+        clauses, params = [], []
+
+        def test(column, op, value):
+            if op == "=":
+                return f"{column} = ? COLLATE NOCASE", value
+            escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            return f"{column} LIKE ? ESCAPE '\\'", f"%{escaped}%"
+
+        for key, op, value in filters:
+            if key == "modified_since":
+                clauses.append("mtime >= ?")
+                params.append(value)
+            elif key == "modified_before":
+                clauses.append("mtime < ?")
+                params.append(value)
+            elif key == "tag":
+                sql, param = test("tag", op, value.lstrip("#").lower())
+                clauses.append(f"path IN (SELECT path FROM tags WHERE {sql})")
+                params.append(param)
+            elif key == "heading":
+                sql, param = test("title", op, value)
+                clauses.append(f"path IN (SELECT path FROM headings WHERE {sql})")
+                params.append(param)
+            elif key in ("title", "path", "name"):
+                sql, param = test(key, op, value)
+                clauses.append(sql)
+                params.append(param)
+            else:
+                sql, param = test("value", op, value)
+                clauses.append(f"path IN (SELECT path FROM fields WHERE key = ? AND {sql})")
+                params.extend([key, param])
+        where = " AND ".join(clauses) or "1"
+        rows = self.conn.execute(
+            f"SELECT path, title, mtime, size, links FROM notes WHERE {where}"
+            " ORDER BY mtime DESC, path LIMIT ?",
+            params + [limit],
+        ).fetchall()
+
+        results = []
+        for path, title, mtime, size, links in rows:
+            fields = {}
+            for key, value in self.conn.execute(
+                "SELECT key, value FROM fields WHERE path = ? ORDER BY rowid", (path,)
+            ):
+                fields.setdefault(key, []).append(value)
+            results.append({
+                "path": path,
+                "title": title,
+                "mtime": mtime,
+                "size": size,
+                "links": links,
+                "tags": [tag for (tag,) in self.conn.execute(
+                    "SELECT tag FROM tags WHERE path = ? ORDER BY tag", (path,)
+                )],
+                "headings": [heading for (heading,) in self.conn.execute(
+                    "SELECT title FROM headings WHERE path = ? ORDER BY ordinal", (path,)
+                )],
+                "fields": fields,
+            })
+        return results
+
+    def scan(self, needle):
+        """Case-insensitive substring scan, for terms the tokenizer cannot index.
+
+        Returns {path: occurrence count}.
+        """
+        needle = needle.lower()
+        matches = {}
+        for rel_path, _ in self._note_files():
+            full_path = os.path.join(self.storage_folder, rel_path)
+            try:
+                with open(full_path, "r", encoding="utf-8", errors="replace") as f:
+                    text = f.read()
+            except OSError:
+                continue
+            READS.add(len(text))
+            count = text.lower().count(needle)
+            if count:
+                matches[rel_path] = count
+        return matches
+
+    def semantic(self, query, top_k=10):
+        """Notes closest to `query` by cosine similarity of trigram vectors.
+
+        Scores the whole memory-mapped matrix in one vectorised product.
+        Returns [(path, score)] best first; needs numpy.
+        """
+        import numpy as np
+
+        terms = {}
+        for term in _tokenize(query):
+            terms[term] = terms.get(term, 0) + 1
+        vector = _ngram_vector(terms)
+        if vector is None or not os.path.exists(self.vectors_path):
+            return []
+        rows = os.path.getsize(self.vectors_path) // (SEMANTIC_DIM * 4)
+        if not rows:
+            return []
+        matrix = np.memmap(
+            self.vectors_path, dtype=np.float32, mode="r", shape=(rows, SEMANTIC_DIM)
+        )
+        scores = matrix @ np.frombuffer(vector, dtype=np.float32)
+        # Over-fetch a little: freed or orphaned rows are dropped below
+        k = min(rows, top_k * 2)
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        placeholders = ",".join("?" * len(best))
+        paths = dict(
+            self.conn.execute(
+                f"SELECT row, path FROM vector_rows WHERE row IN ({placeholders})",
+                [int(r) for r in best],
+            )
+        )
+        results = [
+            (paths[int(r)], float(scores[r]))
+            for r in best
+            if int(r) in paths and scores[r] >= SEMANTIC_MIN_SCORE
+        ]
+        return results[:top_k]
+
+
+def _shard_name(rel_path):
+    """Shard holding a note: its top-level folder, or "" for notes at the root."""
+    return rel_path.split("/", 1)[0] if "/" in rel_path else ""
+
+
+def _shard_call(storage_folder, shard, method, args):
+    """Runs NoteIndex.<method>(*args) on one shard: the unit of work for the pool."""
+    index = NoteIndex(storage_folder, shard)
+    try:
+        return getattr(index, method)(*args)
+    finally:
+        index.close()
+
+
+class NameIndex:
+    """Sorted in-memory keys of every note, for resolving near-miss filenames.
+
+    Each note is keyed by its whole path and by its bare name (see
+    _name_key), so "team/plan" and "Plan" both find team/plan.md. Exact and
+    prefix lookups bisect the sorted keys; fuzzy lookups compute bounded
+    edit distances, skipping keys whose length alone rules them out.
+    """
+
+    def __init__(self, paths):
+        entries = set()
+        for path in paths:
+            entries.add((_name_key(path), path))
+            entries.add((_name_key(posixpath.basename(path)), path))
+        self.entries = sorted(entries)
+        self.keys = [key for key, _ in self.entries]
+
+    def prefixed(self, key):
+        """Paths with a key starting with `key`, and those whose key is `key`."""
+        import bisect
+
+        found, exact = set(), set()
+        i = bisect.bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i].startswith(key):
+            found.add(self.entries[i][1])
+            if self.keys[i] == key:
+                exact.add(self.entries[i][1])
+            i += 1
+        return found, exact
+
+    def nearest(self, key, bound):
+        """{path: edit distance} of the notes within `bound` edits of `key`."""
+        near = {}
+        for other, path in self.entries:
+            distance = _edit_distance(key, other, bound)
+            if distance <= bound and distance < near.get(path, bound + 1):
+                near[path] = distance
+        return near
+
+
+class VaultIndex:
+    """The whole vault's index: one NoteIndex per shard, queried together.
+
+    Sharding keeps each database small, lets a search scoped to a few
+    folders skip the others entirely, and lets large vaults spread sync and
+    search over a process pool. Answers that span shards (BM25 statistics,
+    link resolution, the semantic top-k) are merged here. Append sidecars
+    are per note, not per shard, and live here too.
+    """
+
+    def __init__(self, storage_folder):
+        self.storage_folder = storage_folder
+        self.shards_dir = os.path.join(storage_folder, INDEX_DIR, SHARDS_DIR)
+        self.workers = os.cpu_count() or 1
+        self.parallel_min_bytes = PARALLEL_MIN_INDEX_BYTES
+        self._shards = {}
+        self._pool = None
+        # Set by long-running processes; refresh then applies its events
+        # instead of walking the vault
+        self.watcher = None
+        self._names = None  # (generation, NameIndex), built on first use
+
+    def exists(self):
+        return os.path.isdir(self.shards_dir)
+
+    @property
+    def generation(self):
+        """Moves on whenever an indexed note changes, whichever process changed it.
+
+        Result caches key on it. Read from the shard databases (one small
+        query each), since other processes write to them too.
+        """
+        return tuple((name, self.shard(name).generation) for name in self.indexed_shards())
+
+    def shard(self, name):
+        index = self._shards.get(name)
+        if index is None:
+            index = self._shards[name] = NoteIndex(self.storage_folder, name)
+        return index
+
+    def shard_for(self, rel_path):
+        return self.shard(_shard_name(rel_path))
+
+    def indexed_shards(self, scope=None):
+        """Names of the shards that have a database, limited to `scope` if given."""
+        try:
+            files = os.listdir(self.shards_dir)
+        except OSError:
+            return []
+        names = []
+        for file_name in files:
+            if file_name.endswith(".db"):
+                name = file_name[: -len(".db")]
+                names.append("" if name == ROOT_SHARD else name)
+        return sorted(name for name in names if scope is None or name in scope)
+
+    def vault_shards(self, scope=None):
+        """Names of the shards on disk: "" for the root plus each top-level folder."""
+        names = [""]
+        try:
+            with os.scandir(self.storage_folder) as entries:
+                for entry in entries:
+                    if not entry.name.startswith(".") and entry.is_dir(follow_symlinks=False):
+                        names.append(entry.name)
+        except OSError:
+            pass
+        return sorted(name for name in names if scope is None or name in scope)
+
+    def close(self):
+        for index in self._shards.values():
+            index.close()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _parallel(self, names):
+        """Whether work over `names` is big enough to pay for worker processes."""
+        if self.workers < 2 or len(names) < 2:
+            return False
+        size = 0
+        for name in names:
+            with contextlib.suppress(OSError):
+                size += os.path.getsize(self.shard(name).db_path)
+        return size >= self.parallel_min_bytes
+
+    def _map(self, names, method, *args):
+        """{shard: NoteIndex.<method>(*args)} for each of `names`, fanned out when worthwhile."""
+        if not self._parallel(names):
+            return {name: getattr(self.shard(name), method)(*args) for name in names}
+        if self._pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        futures = {
+            name: self._pool.submit(_shard_call, self.storage_folder, name, method, args)
+            for name in names
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+    # --- maintenance ---
+
+    def refresh(self, scope=None):
+        """Brings the index up to date before a query. Returns the number of notes touched.
+
+        With a watcher attached only the paths it reported are looked at;
+        otherwise a quick sync (see NoteIndex.sync) of `scope` (default: all
+        shards) picks up added, removed and renamed notes, and notes edited
+        in place, at one stat per note.
+        """
+        if self.watcher is not None:
+            changes = self.watcher.changes()
+            if changes is not None:
+                return self._apply_changes(changes)
+        return self.sync(scope=scope)
+
+    def sync(self, full=False, scope=None):
+        """Syncs every shard (see NoteIndex.sync) and drops shards whose folder is gone.
+
+        WAL records of deleted notes go too. Returns the number of notes touched.
+        """
+        if not self.exists():
+            self._remove_unsharded_index()
+        names = self.vault_shards(scope)
+        touched = sum(self._map(names, "sync", full).values())
+        for name in set(self.indexed_shards(scope)) - set(names):
+            touched += self._drop_shard(name)
+        if touched:
+            self.discard_stale_appends()
+        return touched
+
+    def _apply_changes(self, changes):
+        by_shard = {}
+        for rel_path in changes:
+            name = _shard_name(rel_path)
+            if not name and not rel_path.endswith(".md"):
+                name = rel_path  # a top-level folder is a shard of its own
+            by_shard.setdefault(name, set()).add(rel_path)
+        touched = 0
+        for name, paths in sorted(by_shard.items()):
+            if name and not os.path.isdir(os.path.join(self.storage_folder, name)):
+                touched += self._drop_shard(name)
+            else:
+                touched += self.shard(name).apply_changes(paths)
+        if touched:
+            self.discard_stale_appends()
+        return touched
+
+    def _drop_shard(self, name):
+        """Deletes a vanished folder's shard. Returns how many notes it held."""
+        index = self.shard(name)
+        if not index.exists():
+            return 0
+        count = index.conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+        index.close()
+        del self._shards[name]
+        suffixes = ("", "-wal", "-shm")
+        for path in [index.db_path + s for s in suffixes] + [index.vectors_path]:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+        return count
+
+    def _remove_unsharded_index(self):
+        # Left behind by versions that kept the whole vault in one database
+        for name in ("index.db", "index.db-wal", "index.db-shm", "vectors.f32"):
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(self.storage_folder, INDEX_DIR, name))
+
+    def update(self, rel_path):
+        """Re-indexes one note after the tool wrote it. No-op until the index exists."""
+        if self.exists():
+            self.shard_for(rel_path).update(rel_path)
+
+    def ensure_current(self, rel_path):
+        """Re-indexes one note if it changed on disk, without walking the vault."""
+        self.shard_for(rel_path).ensure_current(rel_path)
+
+    # --- append entries (plain sidecar files, so writes never need sqlite) ---
+
+    def _entries_path(self, rel_path):
+        return os.path.join(
+            self.storage_folder, INDEX_DIR, ENTRIES_DIR, rel_path + ".offsets"
+        )
+
+    def _wal_path(self, rel_path):
+        return os.path.join(self.storage_folder, INDEX_DIR, WAL_DIR, rel_path + ".wal")
+
+    def begin_append(self, rel_path, offset, payload):
+        """Durably records an append of `payload` at `offset` before it happens.
+
+        The record also keeps the note's size, mtime and inode as they were,
+        so recovery can tell the same file from one edited or replaced since.
+        """
+        st = os.stat(os.path.join(self.storage_folder, rel_path))
+        path = self._wal_path(rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        header = f"{offset} {st.st_size} {st.st_mtime_ns} {st.st_ino}\n"
+        with open(path, "wb") as f:
+            _write_durably(f, header.encode() + payload)
+
+    def end_append(self, rel_path):
+        os.remove(self._wal_path(rel_path))
+
+    def discard_append(self, rel_path):
+        """Drops any WAL record for a note, e.g. one created anew at the same path."""
+        with contextlib.suppress(OSError):
+            self.end_append(rel_path)
+
+    def recover_append(self, rel_path, f):
+        """Completes an append (or compaction) interrupted mid-write, using its WAL record.
+
+        `f` is the note opened "r+b" with its lock held. A torn write is cut
+        back to where the append began and written again in full. The repair
+        only runs on the file the append started on, left as the crash left
+        it: untouched, or holding the start of the payload at `offset`.
+        Anything else (the note edited, replaced or recreated since) means
+        the record is stale, and it is dropped without touching the note.
+        """
+        try:
+            with open(self._wal_path(rel_path), "rb") as wal:
+                header, _, payload = wal.read().partition(b"\n")
+        except OSError:
+            return
+        try:
+            offset, size, mtime_ns, ino = map(int, header.split())
+        except ValueError:  # unreadable, or from an older version: moot
+            self.discard_append(rel_path)
+            return
+        st = os.fstat(f.fileno())
+        written = None
+        if st.st_ino == ino and st.st_size >= offset:
+            f.seek(offset)
+            written = f.read(len(payload))
+        if written is None or written == payload:
+            pass  # stale, or the write went through and only the bookkeeping was lost
+        elif (st.st_size, st.st_mtime_ns) == (size, mtime_ns) or (
+            # Torn: the note ends inside the payload (a compaction may have
+            # cut it back to `offset` before writing anything)
+            st.st_size == offset + len(written)
+            and payload.startswith(written)
+            and (written or offset < size)
+        ):
+            f.truncate(offset)
+            f.seek(offset)
+            _write_durably(f, payload)
+        else:
+            written = None  # edited by hand since: leave it be
+        if written is not None:
+            # A compaction records its offsets before writing, an append after
+            offsets = self.entry_offsets(rel_path, f) or []
+            if offset + 1 not in offsets:
+                offsets = (self.entry_offsets(rel_path, f, offset) or []) + [offset + 1]
+            f.seek(0)
+            self.replace_entries(rel_path, offsets, f.read(), os.fstat(f.fileno()))
+        self.discard_append(rel_path)
+
+    def discard_stale_appends(self):
+        """Drops the WAL records of notes deleted since their append began."""
+        root = os.path.join(self.storage_folder, INDEX_DIR, WAL_DIR)
+        for current, _, files in os.walk(root):
+            for name in files:
+                if name.endswith(".md.wal"):
+                    rel = os.path.relpath(os.path.join(current, name), root)
+                    rel_path = rel.replace(os.sep, "/")[: -len(".wal")]
+                    if not os.path.exists(os.path.join(self.storage_folder, rel_path)):
+                        self.discard_append(rel_path)
+
+    def forget_entries(self, rel_path):
+        try:
+            os.remove(self._entries_path(rel_path))
+        except OSError:
+            pass
+
+    def entry_offsets(self, rel_path, f, size=None):
+        """Recorded entry offsets of the note open as `f` (binary).
+
+        The offsets are stored with the size, mtime and hash of the note
+        they describe; a note edited by hand since no longer matches, and
+        then None is returned (or [] if none were ever recorded). With
+        `size`, they are checked against the first `size` bytes instead:
+        the note as it was before an interrupted append.
+        """
+        try:
+            with open(self._entries_path(rel_path), "r", encoding="utf-8") as sidecar:
+                stamp, *offsets = sidecar.read().split("\n")
+            recorded_size, mtime_ns, digest = stamp.split()
+            recorded_size, mtime_ns = int(recorded_size), int(mtime_ns)
+            offsets = [int(offset) for offset in offsets if offset]
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError):  # unreadable, or from an older version
+            return None
+        if size is None:
+            st = os.fstat(f.fileno())
+            if (st.st_size, st.st_mtime_ns) == (recorded_size, mtime_ns):
+                return offsets
+            size = st.st_size
+        if size != recorded_size:
+            return None
+        f.seek(0)
+        data = f.read(size)
+        READS.add(len(data))
+        return offsets if _content_hash(data) == digest else None
+
+    def replace_entries(self, rel_path, offsets, data, st=None):
+        """Atomically rewrites a note's entry offsets, for the note holding `data`.
+
+        `st` is the note's stat once `data` is on disk; without it (the
+        write still to come) later checks fall back to hashing the note.
+        """
+        path = self._entries_path(rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        stamp = f"{len(data)} {st.st_mtime_ns if st else 0} {_content_hash(data)}\n"
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(stamp + "".join(f"{offset}\n" for offset in offsets))
+        os.replace(tmp_path, path)
+
+    def appended_notes(self):
+        """Paths of the notes that have recorded append entries."""
+        root = os.path.join(self.storage_folder, INDEX_DIR, ENTRIES_DIR)
+        for current, _, files in os.walk(root):
+            for name in files:
+                if name.endswith(".md.offsets"):
+                    rel = os.path.relpath(os.path.join(current, name), root)
+                    yield rel.replace(os.sep, "/")[: -len(".offsets")]
+
+    # --- archives of compacted entries ---
+
+    def archive_path(self, rel_path):
+        return os.path.join(self.storage_folder, ARCHIVE_DIR, rel_path + ".gz")
+
+    def archive_entries(self, rel_path, data):
+        """Durably adds `data` to the note's archive, as one more gzip member."""
+        import gzip
+
+        path = self.archive_path(rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "ab") as f:
+            _write_durably(f, gzip.compress(data))
+
+    def read_archive(self, rel_path):
+        """Everything archived from a note, oldest first, or None if nothing is."""
+        import gzip
+
+        try:
+            with gzip.open(self.archive_path(rel_path), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        READS.add(len(data))
+        return data.decode("utf-8", errors="replace")
+
+    def search_archives(self, terms, scope=None):
+        """Notes whose archived entries contain any of `terms` (case-insensitive)."""
+        needles = [term.lower() for term in terms if term]
+        root = os.path.join(self.storage_folder, ARCHIVE_DIR)
+        found = set()
+        for current, _, files in os.walk(root):
+            for name in files:
+                if not name.endswith(".md.gz"):
+                    continue
+                rel_path = os.path.relpath(os.path.join(current, name), root)
+                rel_path = rel_path.replace(os.sep, "/")[: -len(".gz")]
+                if scope is not None and _shard_name(rel_path) not in scope:
+                    continue
+                text = (self.read_archive(rel_path) or "").lower()
+                if any(needle in text for needle in needles):
+                    found.add(rel_path)
+        return found
+
+    # --- lookups ---
+
+    def sections(self, rel_path):
+        return self.shard_for(rel_path).sections(rel_path)
+
+    def has_note(self, rel_path):
+        index = self.shard_for(rel_path)
+        return index.exists() and index.has_note(rel_path)
+
+    def lookup(self, term, scope=None):
+        """Paths matching `term`, or None when it has no word characters."""
+        if not _tokenize(term):
+            return None
+        found = self._map(self.indexed_shards(scope), "lookup", term)
+        return set().union(*found.values())
+
+    def evaluate(self, node, scope=None):
+        """Paths matching a parsed search expression, over the shards in scope."""
+        found = self._map(self.indexed_shards(scope), "evaluate", node)
+        return set().union(*found.values())
+
+    def scan(self, needle, scope=None):
+        """{path: occurrence count} of a case-insensitive substring (see NoteIndex.scan)."""
+        matches = {}
+        for found in self._map(self.indexed_shards(scope), "scan", needle).values():
+            matches.update(found)
+        return matches
+
+    def rank(self, weighted_terms, top_k=10, scope=None, within=None):
+        """BM25 over note bodies, with heading hits boosted.
+
+        `weighted_terms` maps each query term to a weight (synonyms count
+        less than the original keywords). Shards report raw counts and the
+        idf and average length are computed over all of them, so scores do
+        not depend on how the vault is split. `within` limits the results to
+        a set of paths. Returns [(path, score)] best first.
+        """
+        per_shard = self._map(self.indexed_shards(scope), "hits", list(weighted_terms))
+        hits, lengths = {}, {}
+        n_notes = total_length = 0
+        for shard_hits, count, total, shard_lengths in per_shard.values():
+            n_notes += count
+            total_length += total
+            lengths.update(shard_lengths)
+            for term, (counts, heading_counts) in shard_hits.items():
+                merged = hits.setdefault(term, ({}, {}))
+                merged[0].update(counts)
+                merged[1].update(heading_counts)
+        if not hits:
+            return []
+
+        avg_length = total_length / n_notes if n_notes else 0.0
+        scores = {}
+        for term, (counts, heading_counts) in hits.items():
+            weight = weighted_terms[term]
+            df = len(counts)
+            idf = math.log(1 + (n_notes - df + 0.5) / (df + 0.5))
+            for path, count in counts.items():
+                if within is not None and path not in within:
+                    continue
+                tf = count + HEADING_WEIGHT * heading_counts.get(path, 0)
+                length = lengths.get(path, avg_length)
+                norm = 1 - BM25_B + BM25_B * length / (avg_length or 1)
+                score = weight * idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+                scores[path] = scores.get(path, 0.0) + score
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:top_k]
+
+    def query(self, filters, limit, scope=None):
+        """Metadata of the newest notes matching `filters` (see NoteIndex.query)."""
+        found = self._map(self.indexed_shards(scope), "query", filters, limit)
+        results = [row for rows in found.values() for row in rows]
+        results.sort(key=lambda row: (-row["mtime"], row["path"]))
+        return results[:limit]
+
+    def semantic(self, query, top_k=10, scope=None):
+        """Notes closest to `query` (see NoteIndex.semantic), merged over shards."""
+        found = self._map(self.indexed_shards(scope), "semantic", query, top_k)
+        results = [hit for hits in found.values() for hit in hits]
+        results.sort(key=lambda item: (-item[1], item[0]))
+        return results[:top_k]
+
+    def names(self):
+        """NameIndex of every indexed note, rebuilt when the vault has changed."""
+        generation = self.generation
+        if self._names is None or self._names[0] != generation:
+            found = self._map(self.indexed_shards(), "paths")
+            self._names = (
+                generation,
+                NameIndex(path for paths in found.values() for path in paths),
+            )
+        return self._names[1]
+
+    def find_note(self, name):
+        """(path, suggestions) for a filename that names no note exactly.
+
+        `path` is the note `name` unambiguously refers to: the only one
+        with that name once case and separators are ignored, the only one
+        whose name starts with it, or the only closest spelling within a
+        few edits. Otherwise it is None and `suggestions` lists up to
+        NAME_SUGGESTIONS candidates, best first.
+        """
+        names = self.names()
+        key = _name_key(name)
+        prefixed, exact = names.prefixed(key)
+        if len(exact) == 1:
+            return exact.pop(), []
+        if len(prefixed) == 1:
+            return prefixed.pop(), []
+        bound = min(NAME_MAX_DISTANCE, max(1, len(key) // 4))
+        near = names.nearest(key, bound)
+        ranked = sorted(near, key=lambda path: (near[path], len(path), path))
+        if not prefixed and ranked and (
+            len(ranked) == 1 or near[ranked[0]] < near[ranked[1]]
+        ):
+            return ranked[0], []
+        suggestions = sorted(prefixed, key=lambda path: (path not in exact, len(path), path))
+        suggestions += [path for path in ranked if path not in prefixed]
+        return None, suggestions[:NAME_SUGGESTIONS]
+
+    def resolve(self, target):
+        """Note path a link target refers to, or None if no such note exists.
+
+        Exact vault-relative paths win; otherwise a bare wikilink name
+        matches a note of that name in any subfolder (shortest path first).
+        """
+        if self.has_note(target):
+            return target
+        if "/" in target:
+            return None
+        candidates = [
+            path for name in self.indexed_shards() for path in self.shard(name).named(target)
+        ]
+        return min(candidates, key=lambda path: (len(path), path), default=None)
+
+    def outgoing(self, rel_path):
+        """[(target as linked, resolved path or None)] for one note."""
+        index = self.shard_for(rel_path)
+        if not index.exists():
+            return []
+        return [(target, self.resolve(target)) for target in index.links_from(rel_path)]
+
+    def incoming(self, rel_path):
+        """Notes linking to `rel_path`, by full path or by bare wikilink name."""
+        targets = [rel_path]
+        name = posixpath.basename(rel_path)
+        if name != rel_path and self.resolve(name) == rel_path:
+            targets.append(name)
+        sources = set()
+        for shard in self.indexed_shards():
+            sources.update(self.shard(shard).links_to(targets))
+        return sorted(sources)
+
+    def traverse(self, start, depth, max_nodes):
+        """Breadth-first walk over outgoing links.
+
+        Returns [(depth, path, [(target, resolved)])] in visit order, stopping
+        at `depth` hops or `max_nodes` notes, whichever comes first.
+        """
+        visited = {start}
+        queue = deque([(0, start)])
+        order = []
+        while queue and len(order) < max_nodes:
+            level, path = queue.popleft()
+            links = self.outgoing(path)
+            order.append((level, path, links))
+            if level >= depth:
+                continue
+            for _, resolved in links:
+                if resolved and resolved not in visited:
+                    visited.add(resolved)
+                    queue.append((level + 1, resolved))
+        return order
+
+    def snippet(self, rel_path, terms):
+        """First line of the note mentioning any of `terms`, trimmed around the hit."""
+        needles = [t.lower() for t in terms if t]
+        full_path = os.path.join(self.storage_folder, rel_path)
+        try:
+            with open(full_path, "r", encoding="utf-8", errors="replace") as f:
+                READS.add(0)
+                for line in f:
+                    READS.add(len(line), files=0)
+                    lowered = line.lower()
+                    hit = min(
+                        (i for i in (lowered.find(n) for n in needles) if i >= 0),
+                        default=-1,
+                    )
+                    if hit < 0:
+                        continue
+                    line = line.strip()
+                    start = max(0, hit - SNIPPET_CHARS // 4)
+                    text = line[start : start + SNIPPET_CHARS]
+                    prefix = "..." if start > 0 else ""
+                    suffix = "..." if start + SNIPPET_CHARS < len(line) else ""
+                    return prefix + text + suffix
+        except OSError:
+            pass
+        return ""
+
+
+def _load_wordnet():
+    """The NLTK WordNet reader, or None when nltk is not installed."""
+    try:
+        from nltk.corpus import wordnet
+    except ImportError:
+        return None
+    return wordnet
+
+
+def build_synonym_table(path=SYNONYMS_DB):
+    """Precomputes WordNet expansions into a sqlite table at `path`.
+
+    Every lemma maps, per part of speech, to the lemma names of all synsets
+    of that part of speech containing it, and WordNet's irregular forms
+    (e.g. "geese") map to their base forms' expansions. Returns the number
+    of (word, part of speech) rows written.
+    """
+    import sqlite3
+
+    wordnet = _load_wordnet()
+    if wordnet is None:
+        raise RuntimeError("nltk is required to build the synonym table")
+
+    table = {}
+    for syn in wordnet.all_synsets():
+        pos = "a" if syn.pos() == "s" else syn.pos()  # satellites are adjectives
+        names = [lemma.name().replace("_", " ") for lemma in syn.lemmas()]
+        for name in names:
+            table.setdefault((name.lower(), pos), set()).update(names)
+    for pos, exceptions in getattr(wordnet, "_exception_map", {}).items():
+        for inflected, bases in exceptions.items():
+            for base in bases:
+                expansions = table.get((base.replace("_", " ").lower(), pos))
+                if expansions:
+                    table.setdefault((inflected.replace("_", " ").lower(), pos), set()).update(
+                        expansions
+                    )
+
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    with conn:
+        conn.execute(
+            "CREATE TABLE synonyms (word TEXT NOT NULL, pos TEXT NOT NULL,"
+            " expansions TEXT NOT NULL, PRIMARY KEY (word, pos)) WITHOUT ROWID"
+        )
+        conn.executemany(
+            "INSERT INTO synonyms (word, pos, expansions) VALUES (?, ?, ?)",
+            ((word, pos, "\n".join(sorted(names))) for (word, pos), names in table.items()),
+        )
+    conn.close()
+    os.replace(tmp_path, path)
+    return len(table)
+
+
+class SynonymSource:
+    """Synonym lookup with a bounded LRU memo.
+
+    Uses the precomputed table when `build_synonym_table` has been run, so
+    NLTK is never imported; otherwise falls back to WordNet directly.
+    """
+
+    def __init__(self, table_path=SYNONYMS_DB):
+        self.table_path = table_path
+        self._conn = None
+        self._wordnet = None
+        self.lookup = functools.lru_cache(maxsize=SYNONYM_CACHE_SIZE)(self._lookup)
+
+    @property
+    def available(self):
+        if self._conn is None and self._wordnet is None:
+            if os.path.exists(self.table_path):
+                import sqlite3
+
+                self._conn = sqlite3.connect(
+                    f"file:{self.table_path}?mode=ro", uri=True, check_same_thread=False
+                )
+                columns = {row[1] for row in self._conn.execute("PRAGMA table_info(synonyms)")}
+                if "pos" not in columns:  # built by an older setup.py: use WordNet
+                    self._conn.close()
+                    self._conn = None
+            if self._conn is None:
+                self._wordnet = _load_wordnet() or False
+        return bool(self._conn or self._wordnet)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _lookup(self, word):
+        """Frozen set of expansions for `word` (empty if unknown)."""
+        if not self.available:
+            return frozenset()
+        if self._conn is not None:
+            return self._lookup_table(word)
+        return frozenset(
+            lemma.name().replace("_", " ")
+            for syn in self._wordnet.synsets(word)
+            for lemma in syn.lemmas()
+        )
+
+    def _lookup_table(self, word):
+        """Expansions of the word itself; only if it has none, of its base forms.
+
+        Like WordNet's morphy, a suffix rule of one part of speech only
+        counts when the table has the base form as that part of speech, so
+        "red" never becomes the noun "r".
+        """
+        word = word.replace("_", " ").lower()
+        rows = self._conn.execute("SELECT expansions FROM synonyms WHERE word = ?", (word,))
+        expansions = frozenset(name for (names,) in rows for name in names.split("\n"))
+        if expansions:
+            return expansions
+        candidates = {
+            (word[: -len(suffix)] + replacement, pos)
+            for pos, rules in MORPHY_SUFFIXES.items()
+            for suffix, replacement in rules
+            if word.endswith(suffix) and len(word) > len(suffix)
+        }
+        if not candidates:
+            return frozenset()
+        where = " OR ".join(["(word = ? AND pos = ?)"] * len(candidates))
+        rows = self._conn.execute(
+            f"SELECT expansions FROM synonyms WHERE {where}",
+            [value for candidate in candidates for value in candidate],
+        )
+        return frozenset(name for (names,) in rows for name in names.split("\n"))
+
+
+class ResultCache:
+    """Bounded LRU of search outputs for one generation of the vault.
+
+    Keys describe a normalized query. Every entry goes stale together when
+    the index's generation moves on, so the cache is then simply emptied.
+    """
+
+    def __init__(self, maxsize=SEARCH_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, generation, key):
+        if generation != self.generation:
+            self._entries.clear()
+            self.generation = generation
+        output = self._entries.get(key)
+        if output is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return output
+
+    def put(self, key, output):
+        self._entries[key] = output
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+class Profile:
+    """Where one operation's time went: wall time per phase, plus note reads.
+
+    Phases nest, and time spent in an inner phase is not counted again in
+    the outer one, so the phases and "other" add up to the operation.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self._inner = []
+        self._reads = (READS.bytes_read, READS.files)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        self._inner.append(0.0)
+        try:
+            yield
+        finally:
+            spent = time.perf_counter() - started
+            self.phases[name] = self.phases.get(name, 0.0) + spent - self._inner.pop()
+            if self._inner:
+                self._inner[-1] += spent
+
+    def report(self, elapsed):
+        """Milliseconds per phase and the reads since the profile started."""
+        phases = dict(self.phases)
+        phases["other"] = max(0.0, elapsed - sum(phases.values()))
+        return {
+            "phases_ms": {name: round(spent * 1000, 3) for name, spent in phases.items()},
+            "bytes_read": READS.bytes_read - self._reads[0],
+            "files_touched": READS.files - self._reads[1],
+        }
+
+
+def _format_profile(elapsed_ms, report):
+    phases = ", ".join(f"{name} {ms:.2f}" for name, ms in report["phases_ms"].items())
+    line = (
+        f"Profile: {elapsed_ms:.2f} ms ({phases});"
+        f" read {report['bytes_read']} bytes from {report['files_touched']} files"
+    )
+    if "startup_ms" in report:
+        line += f"; process startup {report['startup_ms']:.1f} ms"
+    return line
+
+
+# --- STRUCTURED RESULTS (KnowledgeGraphTool.run and --format json) ---
+
+
+@dataclass
+class Result:
+    """What one command returns to in-process callers.
+
+    `text` is exactly what the CLI prints; subclasses carry the same answer
+    as fields, and `to_dict()` is the `--format json` document. `steps` is
+    the tool's step counter after the command, `elapsed_ms` its wall time.
+    """
+
+    command: str
+    ok: bool = True
+    text: str = ""
+    error: str = None
+    steps: int = 0
+    elapsed_ms: float = 0.0
+    # Only with `profile`: ms per phase, bytes read and files touched
+    profile: dict = None
+
+    @classmethod
+    def failed(cls, command, message):
+        return cls(command, ok=False, text=message, error=message)
+
+    def to_dict(self):
+        return dataclasses.asdict(self)
+
+
+@dataclass
+class SearchHit:
+    path: str
+    score: float = None  # ranked and semantic searches only
+    snippet: str = None
+
+
+@dataclass
+class SearchResult(Result):
+    mode: str = "match"  # "match", "ranked" or "semantic"
+    terms: list = field(default_factory=list)  # searched for, synonyms included
+    hits: list = field(default_factory=list)  # SearchHit, best first
+    archived: list = field(default_factory=list)  # notes whose archives match
+    expression: str = None  # the query-language search, if one was given
+
+
+@dataclass
+class NoteMeta:
+    path: str
+    title: str
+    mtime: float
+    size: int
+    links: int
+    tags: list
+    headings: list
+    fields: dict
+
+
+@dataclass
+class QueryResult(Result):
+    filters: list = field(default_factory=list)
+    notes: list = field(default_factory=list)  # NoteMeta, newest first
+
+
+@dataclass
+class NoteContent(Result):
+    path: str = None
+    # "section", "bytes", "lines", "tail" or "archived"; None for the whole note
+    part: str = None
+    content: str = None
+    # The filename asked for, when it named no note and `path` was inferred
+    resolved_from: str = None
+
+
+@dataclass
+class LinksResult(Result):
+    path: str = None
+    notes: list = field(default_factory=list)  # linked notes, vault-relative
+    missing: list = field(default_factory=list)  # link targets with no note
+
+
+@dataclass
+class TraversalNode:
+    depth: int
+    path: str
+    links: list
+    missing: list
+
+
+@dataclass
+class TraversalResult(Result):
+    start: str = None
+    depth: int = 0
+    nodes: list = field(default_factory=list)  # TraversalNode, in visit order
+
+
+@dataclass
+class WriteResult(Result):
+    path: str = None
+
+
+@dataclass
+class CompactResult(Result):
+    notes: int = 0
+    entries: int = 0
+    bytes: int = 0
+    skipped: list = field(default_factory=list)  # notes edited by hand, left alone
+
+
+@dataclass
+class SyncResult(Result):
+    mode: str = "quick"
+    touched: int = 0
+
+
+@dataclass
+class StatusResult(Result):
+    max_steps: int = 0
+    folder: str = None
+    # Per command since the tool started: calls, ms, phases_ms, bytes_read, files_touched
+    timings: dict = field(default_factory=dict)
 
 
 class KnowledgeGraphTool:
@@ -15,11 +2331,22 @@ class KnowledgeGraphTool:
         self,
         storage_folder="./.agent_memory",
         max_steps=15,
+        metrics_log=None,
     ):
         self.storage_folder = os.path.abspath(storage_folder)
         self.visited = set()
         self.max_steps = max_steps
         self.current_step = 0
+        # Step counters of named clients, least recently seen first
+        self.client_steps = OrderedDict()
+        self.index = VaultIndex(self.storage_folder)
+        # None disables synonym expansion
+        self.synonyms = SynonymSource()
+        self.cache = ResultCache()
+        # Per-command totals for get_status, and the running operation's Profile
+        self.timings = {}
+        self.profile = None
+        self.metrics_log = metrics_log or os.environ.get(METRICS_LOG_ENV)
 
         # Ensure the folder exists immediately
         if not os.path.exists(self.storage_folder):
@@ -30,6 +2357,25 @@ class KnowledgeGraphTool:
                 with open(index_path, "w") as f:
                     f.write("# Knowledge Base Index\n\nStarting point.")
 
+    def close(self):
+        """Closes the index databases, the shard worker pool and any watcher.
+
+        The tool stays usable: connections reopen on the next call. Also a
+        context manager, closing on exit.
+        """
+        if self.index.watcher is not None:
+            self.index.watcher.close()
+            self.index.watcher = None
+        self.index.close()
+        if self.synonyms is not None:
+            self.synonyms.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
     def _safe_path(self, filename):
         """Security: Ensure filename ends in .md and stays in folder"""
         if not filename.endswith(".md"):
@@ -38,117 +2384,1112 @@ class KnowledgeGraphTool:
         clean_name = re.sub(r"[^a-zA-Z0-9_\-\.\/]", "", filename)
         return os.path.join(self.storage_folder, clean_name)
 
+    def _rel_path(self, path):
+        """Vault-relative, forward-slash form of a note path (the index key)"""
+        return os.path.relpath(path, self.storage_folder).replace(os.sep, "/")
+
+    def _scope(self, folders):
+        """Shard names for a list of top-level folders ("." is the vault root)."""
+        if folders is None:
+            return None
+        names = {name.strip("/") for name in folders}
+        return {"" if name == "." else name for name in names}
+
+    def _phase(self, name):
+        """Times a block as `name` in the running operation's profile."""
+        if self.profile is None:
+            return contextlib.nullcontext()
+        return self.profile.phase(name)
+
     def _expand_synonyms(self, keywords):
-        """Cheap NLTK synonym expansion"""
-        if not wordnet:
+        """Cheap synonym expansion (precomputed table or NLTK WordNet)"""
+        if self.synonyms is None or not self.synonyms.available:
             return keywords
         expanded = set(keywords)
         # Use set(keywords) to avoid re-processing duplicates
         for k in set(keywords):
             try:
-                expanded.update(
-                    lemma.name().replace("_", " ")
-                    for syn in wordnet.synsets(k)
-                    for lemma in syn.lemmas()
-                )
+                expanded.update(self.synonyms.lookup(k))
             except Exception:
                 pass
         return list(expanded)
 
+    # --- STRUCTURED API ---
+
+    def run(self, command, **params):
+        """Runs one command in-process and returns its Result dataclass.
+
+        `params` are the request keys the CLI and the daemon take (keywords,
+        ranked, top_k, scope, filename, section, ...). The answer is in the
+        result's fields (`hits`, `content`, `notes`, ...); `text` is what the
+        CLI would print.
+        """
+        request = {"command": command, **params}
+        error = validate_request(request)
+        with self._client(params.get("client")):
+            return self._measured(
+                command,
+                (lambda: Result.failed(command, error)) if error else lambda: self._dispatch(request),
+                profile=params.get("profile", False),
+                startup_ms=params.get("startup_ms"),
+            )
+
+    @contextlib.contextmanager
+    def _client(self, client):
+        """Counts steps against `client`'s own counter while its request runs.
+
+        Requests without a client share the tool's counter, which in the
+        daemon is vault-wide.
+        """
+        if not client:
+            yield
+            return
+        shared = self.current_step
+        self.current_step = self.client_steps.pop(client, 0)
+        try:
+            yield
+        finally:
+            self.client_steps[client] = self.current_step
+            while len(self.client_steps) > MAX_CLIENTS:
+                self.client_steps.popitem(last=False)
+            self.current_step = shared
+
+    def _measured(self, command, compute, profile=False, startup_ms=None):
+        """`compute()`'s Result, stamped with the step count and its timings.
+
+        Every operation is profiled (a few clock reads) into the totals
+        get_status reports, and logged to `metrics_log` when one is set.
+        With `profile`, the breakdown is also attached to the result.
+        """
+        started = time.perf_counter()
+        self.profile = Profile()
+        try:
+            result = compute()
+        finally:
+            elapsed = time.perf_counter() - started
+            report, self.profile = self.profile.report(elapsed), None
+        result.steps = self.current_step
+        result.elapsed_ms = round(elapsed * 1000, 3)
+        self._account(command, result, report)
+        if profile:
+            if startup_ms is not None:
+                report["startup_ms"] = round(startup_ms, 3)
+            result.profile = report
+            result.text = f"{result.text}\n{_format_profile(result.elapsed_ms, report)}"
+        return result
+
+    def _account(self, command, result, report):
+        totals = self.timings.setdefault(command, {
+            "calls": 0, "ms": 0.0, "phases_ms": {}, "bytes_read": 0, "files_touched": 0,
+        })
+        totals["calls"] += 1
+        totals["ms"] += result.elapsed_ms
+        for name, ms in report["phases_ms"].items():
+            totals["phases_ms"][name] = totals["phases_ms"].get(name, 0.0) + ms
+        totals["bytes_read"] += report["bytes_read"]
+        totals["files_touched"] += report["files_touched"]
+        if not self.metrics_log:
+            return
+        import json
+
+        record = {
+            "time": round(time.time(), 3),
+            "pid": os.getpid(),
+            "folder": self.storage_folder,
+            "command": command,
+            "ok": result.ok,
+            "steps": result.steps,
+            "elapsed_ms": result.elapsed_ms,
+            **report,
+        }
+        try:
+            # One short O_APPEND write per line, so concurrent agents do not interleave
+            with open(self.metrics_log, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError:
+            pass  # metrics must never fail the operation itself
+
+    def _dispatch(self, request):
+        command = request["command"]
+        if command == "search":
+            return self._search(
+                request.get("keywords"),
+                ranked=request.get("ranked", False),
+                top_k=request.get("top_k", 10),
+                semantic=request.get("semantic", False),
+                scope=request.get("scope"),
+                archived=request.get("archived", False),
+                expression=request.get("expression"),
+            )
+        if command == "query":
+            return self._query(
+                request.get("where"),
+                top_k=request.get("top_k", 10),
+                scope=request.get("scope"),
+            )
+        if command == "read":
+            return self._read(
+                request["filename"],
+                section=request.get("section"),
+                byte_range=request.get("byte_range"),
+                lines=request.get("lines"),
+                tail=request.get("tail"),
+                archived=request.get("archived", False),
+            )
+        if command == "create":
+            return self._create(request["filename"], request["content"])
+        if command == "append":
+            return self._append(request["filename"], request["content"])
+        if command == "neighbors":
+            return self._neighbors(request["filename"])
+        if command == "backlinks":
+            return self._backlinks(request["filename"])
+        if command == "traverse":
+            return self._traverse(
+                request.get("filename") or "000_Index.md",
+                depth=request.get("depth", 2),
+                max_nodes=request.get("max_nodes", 50),
+            )
+        if command == "compact":
+            return self._compact(
+                request.get("filename"),
+                keep=COMPACT_KEEP if request.get("keep") is None else request["keep"],
+            )
+        if command == "sync":
+            return self._sync(full=request.get("full", False))
+        return self._status()
+
     # --- READ TOOLS ---
 
-    def search_notes(self, keywords: list):
-        """Finds files containing keywords (using grep)"""
+    def search_notes(
+        self,
+        keywords: list = None,
+        ranked=False,
+        top_k=10,
+        semantic=False,
+        scope=None,
+        archived=False,
+        expression: str = None,
+    ):
+        """Finds files containing keywords (using the inverted index).
+
+        With `ranked`, returns the `top_k` notes ordered by BM25 score, each
+        with a short snippet around the first match. With `semantic`, ranks
+        by character-trigram similarity instead, which also finds notes that
+        phrase the keywords differently (no synonym expansion; needs numpy).
+        `scope` limits the search to the given top-level folders ("." for
+        notes at the vault root); other folders are not even opened. With
+        `archived`, entries rolled out by compact_notes are searched too.
+
+        Instead of keywords (which match if any of them does), `expression`
+        takes the query language of _parse_expression, e.g.
+        '"hot dog" AND tag:food NOT title:draft' or 'car~ OR heading:bike'.
+        Only terms marked with ~ get synonyms, and archives are not searched.
+        """
+        return self._measured(
+            "search",
+            lambda: self._search(
+                keywords, ranked, top_k, semantic, scope, archived, expression
+            ),
+        ).text
+
+    def _search(
+        self,
+        keywords,
+        ranked=False,
+        top_k=10,
+        semantic=False,
+        scope=None,
+        archived=False,
+        expression=None,
+    ):
         self.current_step += 1
-        all_terms = self._expand_synonyms(keywords)
-        pattern = "|".join(map(re.escape, all_terms))
+        scope = self._scope(scope)
+        if expression is not None:
+            if semantic:
+                return SearchResult.failed(
+                    "search", "Error: semantic search takes keywords, not an expression."
+                )
+            return self._search_expression(expression, ranked, top_k, scope)
+        if semantic:
+            return self._search_semantic(keywords, top_k, scope)
+        with self._phase("synonyms"):
+            all_terms = [t for t in self._expand_synonyms(keywords) if t]
+        if not all_terms:
+            return SearchResult.failed("search", "Error: No keywords provided.")
+
+        try:
+            with self._phase("index"):
+                self.index.refresh(scope)
+        except Exception as e:
+            return SearchResult.failed("search", f"Search Error: {str(e)}")
+        key = (
+            "ranked" if ranked else "match",
+            frozenset(t.lower() for t in all_terms),
+            # Synonyms weigh less in ranking, so it matters which terms were asked for
+            frozenset(k.lower() for k in keywords if k) if ranked else None,
+            top_k,
+            None if scope is None else frozenset(scope),
+            archived,
+        )
+        return self._cached(
+            key,
+            lambda: self._search_keywords(keywords, all_terms, ranked, top_k, scope, archived),
+        )
+
+    def _cached(self, key, compute):
+        """`compute()`'s result, remembered until the vault changes (failures are not)."""
+        result = self.cache.get(self.index.generation, key)
+        if result is None:
+            result = compute()
+            if result.ok:
+                self.cache.put(key, result)
+        # Callers stamp steps and timings on what they get back: hand out a copy
+        return dataclasses.replace(result)
+
+    def _search_keywords(self, keywords, all_terms, ranked, top_k, scope, archived):
+        try:
+            with self._phase("index"):
+                results, matches = self._match_terms(keywords, all_terms, ranked, top_k, scope)
+            with self._phase("io"):
+                in_archives = self.index.search_archives(all_terms, scope) if archived else set()
+        except Exception as e:
+            return SearchResult.failed("search", f"Search Error: {str(e)}")
+
+        if ranked:
+            with self._phase("io"):
+                hits = self._ranked_hits(results, all_terms)
+        else:
+            # Vault-relative filenames
+            hits = [SearchHit(path) for path in sorted(matches)[:top_k]]
+        archived_paths = sorted(in_archives)[:top_k]
+        with self._phase("format"):
+            text = self._format_hits(hits, ranked, all_terms, archived_paths)
+        return SearchResult(
+            "search",
+            text=text,
+            mode="ranked" if ranked else "match",
+            terms=all_terms,
+            hits=hits,
+            archived=archived_paths,
+        )
+
+    def _search_expression(self, expression, ranked, top_k, scope):
+        try:
+            parsed = _parse_expression(expression)
+        except ValueError as e:
+            return SearchResult.failed("search", f"Error: {e}")
+        with self._phase("synonyms"):
+            node = self._expand_node(parsed)
+        try:
+            with self._phase("index"):
+                self.index.refresh(scope)
+        except Exception as e:
+            return SearchResult.failed("search", f"Search Error: {str(e)}")
+        key = (
+            "expression",
+            node,
+            ranked,
+            top_k,
+            None if scope is None else frozenset(scope),
+        )
+        originals = set(_positive_terms(parsed))
+        return self._cached(
+            key,
+            lambda: self._evaluate_expression(expression, node, originals, ranked, top_k, scope),
+        )
 
-        # grep -r -i -l (recursive, case-insensitive, filename only)
-        # Fix: handle cases where pattern might be empty or problematic
-        if not pattern:
-            return "Error: No keywords provided."
+    def _expand_node(self, node):
+        """`node` with each term marked ~ replaced by an OR of it and its synonyms."""
+        kind = node[0]
+        if kind == "term":
+            _, field, text, synonyms = node
+            if not synonyms:
+                return node
+            expanded = [text] + sorted(
+                t for t in self._expand_synonyms([text]) if t and t != text
+            )
+            return ("or", tuple(("term", field, t, False) for t in expanded))
+        if kind == "not":
+            return ("not", self._expand_node(node[1]))
+        if kind in ("and", "or"):
+            return (kind, tuple(self._expand_node(child) for child in node[1]))
+        return node
 
-        cmd = ["grep", "-r", "-i", "-l", "-E", pattern, self.storage_folder]
+    def _evaluate_expression(self, expression, node, originals, ranked, top_k, scope):
+        terms = list(dict.fromkeys(_positive_terms(node)))
+        try:
+            with self._phase("index"):
+                matches = self.index.evaluate(node, scope)
+                results = None
+                if ranked and matches:
+                    weighted = {
+                        t: 1.0 if t in originals else SYNONYM_WEIGHT for t in terms
+                    }
+                    results = self.index.rank(weighted, top_k, scope, within=matches)
+        except Exception as e:
+            return SearchResult.failed("search", f"Search Error: {str(e)}")
+
+        if results is not None:
+            # Notes matched through tags alone score nothing but still match
+            scored = {path for path, _ in results}
+            results += [(path, 0.0) for path in sorted(matches - scored)]
+            with self._phase("io"):
+                hits = self._ranked_hits(results[:top_k], terms)
+        else:
+            hits = [SearchHit(path) for path in sorted(matches)[:top_k]]
+        with self._phase("format"):
+            if not hits:
+                text = f"No matches found for: {expression}"
+            elif ranked:
+                text = self._format_ranked(hits, "ranked")
+            else:
+                text = f"Found matches in: {[hit.path for hit in hits]}"
+        return SearchResult(
+            "search",
+            text=text,
+            mode="ranked" if ranked else "match",
+            terms=terms,
+            hits=hits,
+            expression=expression,
+        )
+
+    def _match_terms(self, keywords, all_terms, ranked, top_k, scope):
+        """(BM25 results, None) when `ranked`, else (None, matching paths)."""
+        if ranked:
+            originals = set(keywords)
+            weighted = {t: 1.0 if t in originals else SYNONYM_WEIGHT for t in all_terms}
+            return self.index.rank(weighted, top_k=top_k, scope=scope), None
+        matches = set()
+        for term in all_terms:
+            paths = self.index.lookup(term, scope)
+            if paths is None:
+                # Punctuation-only terms have no tokens to look up
+                paths = set(self.index.scan(term, scope))
+            matches |= paths
+        return None, matches
 
+    @classmethod
+    def _format_hits(cls, hits, ranked, all_terms, archived_paths):
+        archive_line = ""
+        if archived_paths:
+            archive_line = (
+                f"Archived matches in: {archived_paths}"
+                " (read them with `read --archived`)"
+            )
+        if not hits:
+            text = archive_line or f"No matches found for: {all_terms}"
+        else:
+            if ranked:
+                text = cls._format_ranked(hits, "ranked")
+            else:
+                text = f"Found matches in: {[hit.path for hit in hits]}"
+            if archive_line:
+                text = f"{text}\n{archive_line}"
+        return text
+
+    def _search_semantic(self, keywords, top_k, scope=None):
+        query = " ".join(k for k in keywords if k)
+        if not _tokenize(query):
+            return SearchResult.failed("search", "Error: No keywords provided.")
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if not result.stdout:
-                return f"No matches found for: {all_terms}"
-            # Return list of filenames
-            files = [os.path.basename(f) for f in result.stdout.splitlines()][:10]
-            return f"Found matches in: {files}"
+            with self._phase("index"):
+                self.index.refresh(scope)
         except Exception as e:
-            return f"Search Error: {str(e)}"
+            return SearchResult.failed("search", f"Search Error: {str(e)}")
+        key = (
+            "semantic",
+            tuple(sorted(_tokenize(query))),
+            top_k,
+            None if scope is None else frozenset(scope),
+        )
+        return self._cached(key, lambda: self._rank_semantic(keywords, query, top_k, scope))
 
-    def read_note(self, filename: str):
-        """Reads a specific file"""
+    def _rank_semantic(self, keywords, query, top_k, scope):
+        try:
+            with self._phase("index"):
+                results = self.index.semantic(query, top_k=top_k, scope=scope)
+        except ImportError:
+            return SearchResult.failed(
+                "search", "Error: Semantic search needs numpy (pip install numpy)."
+            )
+        except Exception as e:
+            return SearchResult.failed("search", f"Search Error: {str(e)}")
+        # Matches need not contain the keywords verbatim; stems find a line
+        stems = [token[:4] for token in _tokenize(query)]
+        with self._phase("io"):
+            hits = self._ranked_hits(results, stems)
+        with self._phase("format"):
+            if hits:
+                text = self._format_ranked(hits, "semantic")
+            else:
+                text = f"No matches found for: {keywords}"
+        return SearchResult(
+            "search", text=text, mode="semantic", terms=_tokenize(query), hits=hits
+        )
+
+    def _ranked_hits(self, results, terms):
+        return [
+            SearchHit(path, score, self.index.snippet(path, terms) or None)
+            for path, score in results
+        ]
+
+    @staticmethod
+    def _format_ranked(hits, kind):
+        lines = [f"Found {len(hits)} {kind} matches:"]
+        for i, hit in enumerate(hits, start=1):
+            lines.append(f"{i}. {hit.path} (score {hit.score:.2f})")
+            if hit.snippet:
+                lines.append(f"   {hit.snippet}")
+        return "\n".join(lines)
+
+    def query_notes(self, filters=None, top_k=10, scope=None):
+        """Lists notes by metadata, answered from the index without opening any note.
+
+        `filters` are "key=value" (exact, case-insensitive) or "key~=value"
+        (substring) strings, all of which must hold. Keys: `tag`, `heading`,
+        `title`, `path`, `modified_since`/`modified_before` (ISO date or an
+        age like "7d"), or any frontmatter field. Newest notes first.
+        """
+        return self._measured("query", lambda: self._query(filters, top_k, scope)).text
+
+    def _query(self, filters=None, top_k=10, scope=None):
         self.current_step += 1
+        try:
+            parsed = [_parse_filter(f) for f in filters or []]
+        except ValueError as e:
+            return QueryResult.failed("query", f"Error: {e}")
+        scope = self._scope(scope)
+        try:
+            with self._phase("index"):
+                self.index.refresh(scope)
+                notes = [NoteMeta(**row) for row in self.index.query(parsed, top_k, scope)]
+        except Exception as e:
+            return QueryResult.failed("query", f"Query Error: {str(e)}")
+        filters = list(filters or [])
+        if not notes:
+            return QueryResult("query", text=f"No notes match: {filters}", filters=filters)
+        with self._phase("format"):
+            text = self._format_notes(notes)
+        return QueryResult("query", text=text, filters=filters, notes=notes)
+
+    @staticmethod
+    def _format_notes(notes):
+        lines = [f"Found {len(notes)} notes:"]
+        for note in notes:
+            modified = time.strftime("%Y-%m-%d %H:%M", time.localtime(note.mtime))
+            lines.append(
+                f"- {note.path}: {note.title}"
+                f" (modified {modified}, {note.size} bytes, {note.links} links)"
+            )
+            if note.tags:
+                lines.append(f"  tags: {', '.join(note.tags)}")
+            fields = {
+                key: values
+                for key, values in note.fields.items()
+                if key not in ("title", "tags", "tag") and values
+            }
+            if fields:
+                lines.append("  " + "; ".join(
+                    f"{key}: {', '.join(values)}" for key, values in fields.items()
+                ))
+            if note.headings:
+                shown = " | ".join(note.headings[:QUERY_HEADINGS])
+                if len(note.headings) > QUERY_HEADINGS:
+                    shown += f" (+{len(note.headings) - QUERY_HEADINGS} more)"
+                lines.append(f"  headings: {shown}")
+        return "\n".join(lines)
+
+    def read_note(
+        self,
+        filename: str,
+        section: str = None,
+        byte_range: tuple = None,
+        lines: tuple = None,
+        tail: int = None,
+        archived: bool = False,
+    ):
+        """Reads a specific file, or only part of it.
+
+        At most one selector applies: `section` (heading substring, served
+        from the heading index), `byte_range` or `lines` ((start, end) with
+        either side None; lines are 1-based and inclusive), or `tail` (the
+        last N entries added by append_note). With `archived`, returns the
+        whole note with the entries compact_notes archived put back in place.
+
+        A filename that names no note is looked up in the index's names
+        (VaultIndex.find_note): an unambiguous near-miss is read instead,
+        behind a one-line notice; otherwise the error lists the closest notes.
+        """
+        return self._measured(
+            "read", lambda: self._read(filename, section, byte_range, lines, tail, archived)
+        ).text
+
+    def _read(
+        self, filename, section=None, byte_range=None, lines=None, tail=None, archived=False
+    ):
+        self.current_step += 1
+        try:
+            if byte_range is not None:
+                byte_range = _check_range(byte_range)
+            if lines is not None:
+                lines = _check_range(lines, first=1)
+        except ValueError as e:
+            return NoteContent.failed("read", f"Error: {e}")
+        if tail is not None and tail < 1:
+            return NoteContent.failed("read", f"Error: tail must be at least 1, got {tail}")
         path = self._safe_path(filename)
 
+        resolved_from = None
         if not os.path.exists(path):
-            return "Error: File does not exist. Did you mean to create it?"
+            with self._phase("index"):
+                if not self.index.exists():
+                    self.index.refresh()
+                found, suggestions = self.index.find_note(filename)
+            if found is None:
+                message = "Error: File does not exist. Did you mean to create it?"
+                if suggestions:
+                    message = f"Error: File does not exist. Closest notes: {suggestions}"
+                return NoteContent.failed("read", message)
+            path, resolved_from = os.path.join(self.storage_folder, found), filename
 
+        rel_path = self._rel_path(path)
+        with self._phase("io"):
+            part, content = self._read_part(path, section, byte_range, lines, tail, archived)
+        if part == "section" and content is None:
+            titles = [title for _, title, _, _ in self.index.sections(rel_path)]
+            return NoteContent.failed(
+                "read",
+                f"Error: Section '{section}' not found in '{rel_path}'. Headings: {titles}",
+            )
+        text = content
+        if resolved_from is not None:
+            text = f"(No note '{resolved_from}'; read '{rel_path}' instead.)\n{content}"
+        return NoteContent(
+            "read",
+            text=text,
+            path=rel_path,
+            part=part,
+            content=content,
+            resolved_from=resolved_from,
+        )
+
+    def _read_part(self, path, section, byte_range, lines, tail, archived):
+        """(part name, text) of the selected part of a note; text None if not found."""
+        if archived:
+            return "archived", self._read_archived(path)
+        if section is not None:
+            return "section", self._read_section(path, section)
+        if byte_range is not None:
+            start, end = byte_range
+            return "bytes", _read_range(path, start or 0, end)
+        if lines is not None:
+            return "lines", self._read_lines(path, *lines)
+        if tail is not None:
+            return "tail", self._read_tail(path, tail)
         with open(path, "r", encoding="utf-8") as f:
-            return f.read()
+            content = f.read()
+        READS.add(len(content))
+        return None, content
+
+    def _read_section(self, path, section):
+        """The section's text, or None when no heading contains `section`."""
+        rel_path = self._rel_path(path)
+        with self._phase("index"):
+            self.index.ensure_current(rel_path)
+            sections = self.index.sections(rel_path)
+        needle = section.lower()
+        for _, title, start, end in sections:
+            if needle in title.lower():
+                return _read_range(path, start, end).strip()
+        return None
+
+    def _read_lines(self, path, start=None, end=None):
+        start = max(start or 1, 1)
+        selected = []
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            READS.add(0)
+            for number, line in enumerate(f, start=1):
+                READS.add(len(line), files=0)
+                if end is not None and number > end:
+                    break  # stop reading once past the range
+                if number >= start:
+                    selected.append(line)
+        return "".join(selected)
+
+    def _read_archived(self, path):
+        with open(path, "r", encoding="utf-8") as f:
+            live = f.read()
+        READS.add(len(live))
+        history = self.index.read_archive(self._rel_path(path))
+        if history is None:
+            return live
+        pointer = ARCHIVE_POINTER_RE.search(live)
+        if pointer is None:  # the pointer was edited away: history goes last
+            return live + history
+        # The pointer line replaced the archived entries, newline included
+        return live[: pointer.start() - 1] + history + live[pointer.end() :]
+
+    def _read_tail(self, path, count):
+        with open(path, "rb") as f:
+            offsets = self.index.entry_offsets(self._rel_path(path), f) or []
+        # The note's original body counts as the first entry
+        start = offsets[-count] if 0 < count <= len(offsets) else 0
+        return _read_range(path, start)
+
+    # --- GRAPH TOOLS (answered from the link index) ---
+
+    def _indexed_note(self, filename):
+        """Refreshes the index and returns the note's index key, or None if missing."""
+        rel_path = self._rel_path(self._safe_path(filename))
+        with self._phase("index"):
+            self.index.refresh()
+        return rel_path if self.index.has_note(rel_path) else None
+
+    @staticmethod
+    def _format_links(links):
+        return [
+            resolved if resolved else f"{target} (missing)" for target, resolved in links
+        ]
+
+    @staticmethod
+    def _split_links(links):
+        """([resolved paths], [missing targets]) of [(target, resolved)] links."""
+        return (
+            [resolved for _, resolved in links if resolved],
+            [target for target, resolved in links if not resolved],
+        )
+
+    def neighbors(self, filename: str):
+        """Lists the notes a note links to"""
+        return self._measured("neighbors", lambda: self._neighbors(filename)).text
+
+    def _neighbors(self, filename):
+        self.current_step += 1
+        rel_path = self._indexed_note(filename)
+        if rel_path is None:
+            return LinksResult.failed(
+                "neighbors", "Error: File does not exist. Did you mean to create it?"
+            )
+        with self._phase("index"):
+            links = self.index.outgoing(rel_path)
+        if links:
+            text = f"Links from '{rel_path}': {self._format_links(links)}"
+        else:
+            text = f"No links from '{rel_path}'."
+        notes, missing = self._split_links(links)
+        return LinksResult("neighbors", text=text, path=rel_path, notes=notes, missing=missing)
+
+    def backlinks(self, filename: str):
+        """Lists the notes linking to a note"""
+        return self._measured("backlinks", lambda: self._backlinks(filename)).text
+
+    def _backlinks(self, filename):
+        self.current_step += 1
+        rel_path = self._indexed_note(filename)
+        if rel_path is None:
+            return LinksResult.failed(
+                "backlinks", "Error: File does not exist. Did you mean to create it?"
+            )
+        with self._phase("index"):
+            sources = self.index.incoming(rel_path)
+        if sources:
+            text = f"Links to '{rel_path}': {sources}"
+        else:
+            text = f"No links to '{rel_path}'."
+        return LinksResult("backlinks", text=text, path=rel_path, notes=list(sources))
+
+    def traverse(self, start: str = "000_Index.md", depth: int = 2, max_nodes: int = 50):
+        """Breadth-first walk of the link graph from `start`"""
+        return self._measured("traverse", lambda: self._traverse(start, depth, max_nodes)).text
+
+    def _traverse(self, start="000_Index.md", depth=2, max_nodes=50):
+        self.current_step += 1
+        rel_path = self._indexed_note(start)
+        if rel_path is None:
+            return TraversalResult.failed(
+                "traverse", "Error: File does not exist. Did you mean to create it?"
+            )
+        with self._phase("index"):
+            order = self.index.traverse(rel_path, depth, max_nodes)
+        lines = [f"Traversal from '{rel_path}' (depth {depth}, {len(order)} notes):"]
+        nodes = []
+        for level, path, links in order:
+            line = f"{level} {path}"
+            if links:
+                line += " -> " + ", ".join(self._format_links(links))
+            lines.append(line)
+            nodes.append(TraversalNode(level, path, *self._split_links(links)))
+        return TraversalResult(
+            "traverse", text="\n".join(lines), start=rel_path, depth=depth, nodes=nodes
+        )
 
     # --- WRITE TOOLS (New) ---
 
     def create_note(self, filename: str, content: str):
         """Creates a new file. Fails if it already exists."""
+        return self._measured("create", lambda: self._create(filename, content)).text
+
+    def _create(self, filename, content):
         path = self._safe_path(filename)
-        if os.path.exists(path):
-            return f"Error: '{filename}' already exists. Use append_note or overwrite logic."
+        with self._phase("io"):
+            created = not os.path.exists(path) and _create_exclusive(path, content)
+        if not created:
+            return WriteResult.failed(
+                "create",
+                f"Error: '{filename}' already exists. Use append_note or overwrite logic.",
+            )
 
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(content)
-        return f"Success: Created '{filename}'."
+        rel_path = self._rel_path(path)
+        with open(path, "rb") as f, _locked(f), self._phase("index"):
+            # Sidecars left by an earlier note at this path do not apply
+            self.index.forget_entries(rel_path)
+            self.index.discard_append(rel_path)
+            self.index.update(rel_path)
+        return WriteResult("create", text=f"Success: Created '{filename}'.", path=rel_path)
 
     def append_note(self, filename: str, content: str):
-        """Adds text to the end of an existing note."""
+        """Adds text to the end of an existing note.
+
+        Appends hold the note's lock and go through a write-ahead record, so
+        parallel writers never interleave and a crash mid-write is repaired
+        by the next append. They leave the index alone: the note's new size
+        and mtime get it re-indexed by the next query's refresh, once for
+        any number of appends, and appends to different notes never wait
+        on a shard's write lock.
+        """
+        return self._measured("append", lambda: self._append(filename, content)).text
+
+    def _append(self, filename, content):
         path = self._safe_path(filename)
         if not os.path.exists(path):
-            return f"Error: '{filename}' does not exist. Use create_note first."
+            return WriteResult.failed(
+                "append", f"Error: '{filename}' does not exist. Use create_note first."
+            )
+
+        rel_path = self._rel_path(path)
+        payload = ("\n" + content).encode("utf-8")
+        with open(path, "r+b") as f, _locked(f):
+            with self._phase("io"):
+                self.index.recover_append(rel_path, f)
+                offsets = self.index.entry_offsets(rel_path, f) or []
+                f.seek(0)
+                data = f.read()
+                offset = len(data)
+                self.index.begin_append(rel_path, offset, payload)
+                _write_durably(f, payload)
+                # The entry proper starts after the separating newline
+                self.index.replace_entries(
+                    rel_path, offsets + [offset + 1], data + payload, os.fstat(f.fileno())
+                )
+                self.index.end_append(rel_path)
+        return WriteResult("append", text=f"Success: Appended to '{filename}'.", path=rel_path)
+
+    def compact_notes(self, filename: str = None, keep: int = COMPACT_KEEP):
+        """Moves all but the last `keep` appended entries into gzip archives.
+
+        Compacts one note, or every note with appended entries. The live
+        note keeps its original body, a pointer line to the archive and the
+        hot tail; read_note/search_notes reach the archive with `archived`.
+        """
+        return self._measured("compact", lambda: self._compact(filename, keep)).text
+
+    def _compact(self, filename=None, keep=COMPACT_KEEP):
+        if keep < 0:
+            return CompactResult.failed("compact", "Error: keep must be zero or more.")
+        if filename is not None:
+            path = self._safe_path(filename)
+            if not os.path.exists(path):
+                return CompactResult.failed(
+                    "compact", "Error: File does not exist. Did you mean to create it?"
+                )
+            rel_paths = [self._rel_path(path)]
+        else:
+            rel_paths = sorted(self.index.appended_notes())
+
+        notes = entries = size = 0
+        skipped = []
+        for rel_path in rel_paths:
+            try:
+                with self._phase("io"):
+                    compacted = self._compact_note(rel_path, keep)
+            except OSError as e:
+                return CompactResult.failed("compact", f"Error compacting '{rel_path}': {e}")
+            if compacted is None:
+                skipped.append(rel_path)
+                continue
+            count, archived = compacted
+            if count:
+                notes += 1
+                entries += count
+                size += archived
+        if filename is not None and skipped:
+            return CompactResult.failed(
+                "compact",
+                f"Error: '{skipped[0]}' was edited outside the tool since its entries were"
+                " recorded, so they no longer line up; left it as is.",
+            )
+        text = f"Compacted {notes} notes: archived {entries} entries ({size} bytes)."
+        if skipped:
+            text += f" Skipped notes edited outside the tool: {', '.join(skipped)}."
+        return CompactResult(
+            "compact",
+            text=text,
+            notes=notes,
+            entries=entries,
+            bytes=size,
+            skipped=skipped,
+        )
+
+    def _compact_note(self, rel_path, keep):
+        """Compacts one note. Returns (entries archived, bytes archived).
+
+        Runs under the note's lock, like append_note. The archive is written
+        first; the note is then rewritten from the first archived entry on
+        through a WAL record, so a crash leaves either the old note or the
+        new one (at worst archiving the same entries twice). Returns None,
+        touching nothing, if the note was edited by hand since its entries
+        were recorded: their offsets no longer say where entries start.
+        """
+        path = os.path.join(self.storage_folder, rel_path)
+        try:
+            f = open(path, "r+b")
+        except FileNotFoundError:
+            return 0, 0
+        with f, _locked(f):
+            self.index.recover_append(rel_path, f)
+            offsets = self.index.entry_offsets(rel_path, f)
+            if offsets is None:
+                return None
+            f.seek(0)
+            data = f.read()
+            # Entries start after their "\n" separator; `bounds` are the separators
+            bounds = [offset - 1 for offset in offsets] + [len(data)]
+            total, total_bytes = 0, 0
+            first = 0
+            if offsets:
+                pointer = ARCHIVE_POINTER_RE.match(
+                    data[offsets[0] : bounds[1]].decode("utf-8", errors="replace")
+                )
+                if pointer:  # compacted before: count on from the previous totals
+                    total, total_bytes = int(pointer.group(1)), int(pointer.group(2))
+                    first = 1
+            hot = max(len(offsets) - keep, first)
+            if hot <= first:
+                return 0, 0
+
+            chunk = data[bounds[first] : bounds[hot]]
+            total += hot - first
+            total_bytes += len(chunk)
+            archive = posixpath.join(ARCHIVE_DIR, rel_path + ".gz")
+            pointer = (
+                f"\n> Archived {total} older entries ({total_bytes} bytes) to {archive};"
+                " read them with `read --archived`."
+            ).encode("utf-8")
+            cut = bounds[0]
+            payload = pointer + data[bounds[hot] :]
+            shift = cut + len(pointer) - bounds[hot]
 
-        with open(path, "a", encoding="utf-8") as f:
-            f.write("\n" + content)
-        return f"Success: Appended to '{filename}'."
+            self.index.archive_entries(rel_path, chunk)
+            self.index.begin_append(rel_path, cut, payload)
+            offsets = [cut + 1] + [offset + shift for offset in offsets[hot:]]
+            self.index.replace_entries(rel_path, offsets, data[:cut] + payload)
+            f.truncate(cut)
+            f.seek(cut)
+            _write_durably(f, payload)
+            self.index.replace_entries(
+                rel_path, offsets, data[:cut] + payload, os.fstat(f.fileno())
+            )
+            self.index.end_append(rel_path)
+            self.index.update(rel_path)
+        return hot - first, len(chunk)
+
+    def sync_notes(self, full=False):
+        """Brings the index up to date with notes changed outside the tool"""
+        return self._measured("sync", lambda: self._sync(full)).text
+
+    def _sync(self, full=False):
+        started = time.perf_counter()
+        with self._phase("index"):
+            touched = self.index.sync(full=full)
+        elapsed = (time.perf_counter() - started) * 1000
+        mode = "full" if full else "quick"
+        return SyncResult(
+            "sync",
+            text=f"Synced ({mode}): {touched} notes updated in {elapsed:.1f} ms.",
+            mode=mode,
+            touched=touched,
+        )
 
     def get_status(self):
-        return f"Steps: {self.current_step}/{self.max_steps}. Folder: {self.storage_folder}"
-
-
-def main():
-    parser = argparse.ArgumentParser(description="Librarian: Knowledge Base Tool")
-    parser.add_argument("command", choices=["search", "read", "create", "append"])
-    parser.add_argument("--filename", help="Filename for read/create/append")
-    parser.add_argument("--content", help="Content for create/append")
-    parser.add_argument("--keywords", nargs="+", help="Keywords for search")
-    parser.add_argument("--storage", default="./.agent_memory", help="Storage folder")
-
-    args = parser.parse_args()
-    tool = KnowledgeGraphTool(storage_folder=args.storage)
-
-    if args.command == "search":
-        if not args.keywords:
-            print("Error: --keywords required for search")
-            sys.exit(1)
-        print(tool.search_notes(args.keywords))
-    elif args.command == "read":
-        if not args.filename:
-            print("Error: --filename required for read")
-            sys.exit(1)
-        print(tool.read_note(args.filename))
-    elif args.command == "create":
-        if not args.filename or not args.content:
-            print("Error: --filename and --content required for create")
-            sys.exit(1)
-        print(tool.create_note(args.filename, args.content))
-    elif args.command == "append":
-        if not args.filename or not args.content:
-            print("Error: --filename and --content required for append")
-            sys.exit(1)
-        print(tool.append_note(args.filename, args.content))
+        return self._measured("status", self._status).text
+
+    def _status(self):
+        lines = [f"Steps: {self.current_step}/{self.max_steps}. Folder: {self.storage_folder}"]
+        if self.timings:
+            lines.append("Timing (ms): " + "; ".join(
+                f"{command} x{totals['calls']} {totals['ms']:.1f} ("
+                + ", ".join(f"{name} {ms:.1f}" for name, ms in totals["phases_ms"].items())
+                + ")"
+                for command, totals in self.timings.items()
+            ))
+            lines.append(
+                f"Read: {sum(t['bytes_read'] for t in self.timings.values())} bytes"
+                f" from {sum(t['files_touched'] for t in self.timings.values())} files"
+            )
+        return StatusResult(
+            "status",
+            text="\n".join(lines),
+            max_steps=self.max_steps,
+            folder=self.storage_folder,
+            timings={
+                command: {**totals, "phases_ms": dict(totals["phases_ms"])}
+                for command, totals in self.timings.items()
+            },
+        )
+
+
+def run_request(tool, request):
+    """Executes one request dict (the CLI arguments) against `tool`.
+
+    Returns the command's text, or its Result as a JSON document when the
+    request has "format": "json".
+    """
+    params = {
+        key: value for key, value in request.items() if key not in ("command", "format", "id")
+    }
+    result = tool.run(request.get("command"), **params)
+    if request.get("format") == "json":
+        import json
+
+        return json.dumps(result.to_dict())
+    return result.text
+
+
+def run_batch(storage_folder, lines, out, use_daemon=True):
+    """Runs a JSONL stream of requests, writing one JSONL result per line.
+
+    Each line is a request dict as accepted by `run_request` (e.g.
+    {"command": "read", "filename": "x.md"}); an optional "id" is echoed
+    back. Requests with "format": "json" get their Result under "result"
+    instead of the text under "output". All requests share one tool (or,
+    as one client, the daemon's), so step counting carries across the batch.
+    """
+    import json
+
+    tool = None
+    client = f"batch-{os.getpid()}-{os.urandom(4).hex()}"
+    try:
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("request must be a JSON object")
+            except ValueError as e:
+                result = {"error": f"Invalid request: {str(e)}"}
+            else:
+                for key in ("keywords", "scope", "where"):
+                    if isinstance(request.get(key), str):
+                        request[key] = [request[key]]
+                request.setdefault("client", client)
+                try:
+                    output = call_daemon(storage_folder, request) if use_daemon else None
+                    if output is None:
+                        if tool is None:
+                            tool = KnowledgeGraphTool(storage_folder=storage_folder)
+                        output = run_request(tool, request)
+                    if request.get("format") == "json":
+                        result = {"command": request.get("command"), "result": json.loads(output)}
+                    else:
+                        result = {"command": request.get("command"), "output": output}
+                except Exception as e:
+                    # One bad request must not take the rest of the stream with it
+                    result = {"command": request.get("command"), "error": f"Request failed: {e}"}
+                if "id" in request:
+                    result = {"id": request["id"], **result}
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+    finally:
+        if tool is not None:
+            tool.close()
+
+
+def make_server(tool, path):
+    """Unix socket server answering requests with one warm `tool`.
+
+    Requests are handled one at a time, so the tool and its sqlite
+    connection never see concurrent access.
+    """
+    import json
+    import socketserver
+
+    class RequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            line = self.rfile.readline()
+            if not line:
+                return  # liveness probe from call_daemon
+            try:
+                request = json.loads(line)
+                output = run_request(tool, request)
+            except Exception as e:
+                output = f"Daemon Error: {str(e)}"
+            self.wfile.write(json.dumps({"output": output}).encode() + b"\n")
+
+    class Server(socketserver.UnixStreamServer):
+        def service_actions(self):
+            # Between requests, fold in whatever the watcher saw
+            if tool.index.watcher is not None:
+                tool.index.refresh()
+
+    return Server(path, RequestHandler)
+
+
+def serve(storage_folder, watch=True, metrics_log=None):
+    """Runs the daemon in the foreground until interrupted.
+
+    With `watch`, an inotify watcher keeps the index current, so queries
+    skip the per-call stat walk. Operations are logged to `metrics_log`
+    (or $LIBRARIAN_METRICS_LOG) whichever client sent them.
+    """
+    path = socket_path(storage_folder)
+    if call_daemon(storage_folder, None) is not None:
+        print(f"Error: A librarian daemon is already listening on {path}")
+        sys.exit(1)
+    if os.path.exists(path):
+        os.remove(path)  # stale socket from a daemon that did not shut down
+
+    tool = KnowledgeGraphTool(storage_folder=storage_folder, metrics_log=metrics_log)
+    if watch:
+        try:
+            # Started before the initial sync so no change slips in between
+            tool.index.watcher = VaultWatcher(tool.storage_folder)
+        except OSError as e:
+            print(f"Watcher unavailable ({e}); syncing on each query instead")
+    # Pay the one-off costs now rather than on the first request
+    tool.index.sync(full=True)
+    tool._expand_synonyms(["index"])
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    server = make_server(tool, path)
+    print(f"Librarian daemon listening on {path}", flush=True)
+    import signal
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        tool.close()
+        if os.path.exists(path):
+            os.remove(path)
 
 
 if __name__ == "__main__":
+    # Run as a script, the fallback's `import librarian` gets this module
+    # rather than loading the file a second time
+    sys.modules.setdefault("librarian", sys.modules[__name__])
     main()
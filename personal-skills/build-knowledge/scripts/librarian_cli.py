@@ -0,0 +1,308 @@
+"""Command line for the Librarian: `python librarian_cli.py <command> ...`.
+
+Kept apart from librarian.py so that a call the daemon answers only pays
+for this file: it parses the arguments, checks the request and sends it
+over the daemon's socket. librarian.py (several thousand lines to load)
+is imported only when no daemon is listening, or for `serve` and `batch`.
+The request checks, the socket location and the protocol constants live
+here too, and librarian.py imports them from this module.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+# Index files live in a hidden folder inside the vault so they travel with it
+INDEX_DIR = ".librarian"
+# Where to append one JSON line of timings per operation (or --metrics-log)
+METRICS_LOG_ENV = "LIBRARIAN_METRICS_LOG"
+
+# Daemon: one JSON request line in, one JSON response out, over a Unix socket
+SOCKET_NAME = "librarian.sock"
+SOCKET_TIMEOUT = 30.0
+# Requests carrying a client name (--client, or this variable) get a step
+# counter of their own in the daemon
+CLIENT_ENV = "LIBRARIAN_CLIENT"
+# AF_UNIX paths are limited to ~104-108 bytes depending on the platform
+MAX_SOCKET_PATH = 100
+
+COMMANDS = (
+    "search", "query", "read", "create", "append",
+    "neighbors", "backlinks", "traverse", "compact", "sync", "status",
+)
+
+
+def _parse_range(value, first=0):
+    """"START:END" (either side optional) -> (start or None, end or None).
+
+    ValueError unless the range is valid for `_check_range`.
+    """
+    start, sep, end = value.partition(":")
+    if not sep:
+        raise ValueError(f"expected START:END, got '{value}'")
+    return _check_range((int(start) if start else None, int(end) if end else None), first)
+
+
+def _check_range(value, first=0):
+    """A (start, end) pair as a tuple; ValueError if a side is below `first`, or end < start."""
+    start, end = value
+    for bound in (start, end):
+        if bound is not None and bound < first:
+            raise ValueError(f"range bounds must be at least {first}, got {bound}")
+    if start is not None and end is not None and end < start:
+        raise ValueError(f"range end {end} is before its start {start}")
+    return start, end
+
+
+def _json_type(value):
+    """The JSON name of a decoded value's type, for error messages."""
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    return "array" if isinstance(value, (list, tuple)) else "object"
+
+
+def validate_request(request):
+    """Returns a usage error message for `request`, or None if it is complete and well-typed."""
+    command = request.get("command")
+    # Batch and daemon requests are JSON: check what argparse would have
+    for key in ("filename", "content", "section", "expression", "client"):
+        value = request.get(key)
+        if value is not None and not isinstance(value, str):
+            return f"Error: {key} must be a string, got {_json_type(value)}"
+    for key in ("keywords", "scope", "where"):
+        value = request.get(key)
+        if value is not None and not (
+            isinstance(value, list) and all(isinstance(item, str) for item in value)
+        ):
+            return f"Error: {key} must be a list of strings, got {_json_type(value)}"
+    for key in ("tail", "top_k", "depth", "max_nodes", "keep"):
+        value = request.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, int)):
+            return f"Error: {key} must be an integer, got {_json_type(value)}"
+    for key in ("byte_range", "lines"):
+        value = request.get(key)
+        if value is not None and not (
+            isinstance(value, (list, tuple))
+            and len(value) == 2
+            and all(bound is None or type(bound) is int for bound in value)
+        ):
+            return f"Error: {key} must be a [start, end] pair of integers or nulls"
+    if command == "search" and not (request.get("keywords") or request.get("expression")):
+        return "Error: --keywords or --expr required for search"
+    if command == "read" and not request.get("filename"):
+        return "Error: --filename required for read"
+    if command in ("create", "append") and (
+        not request.get("filename") or not request.get("content")
+    ):
+        return f"Error: --filename and --content required for {command}"
+    if command in ("neighbors", "backlinks") and not request.get("filename"):
+        return f"Error: --filename required for {command}"
+    if command not in COMMANDS:
+        return f"Error: Unknown command '{command}'"
+    return None
+
+
+def socket_path(storage_folder):
+    """Where the daemon for `storage_folder` listens.
+
+    Next to the index when the path fits the AF_UNIX limit, otherwise in the
+    temp dir under a name derived from the vault path.
+    """
+    storage_folder = os.path.abspath(storage_folder)
+    path = os.path.join(storage_folder, INDEX_DIR, SOCKET_NAME)
+    if len(path.encode()) <= MAX_SOCKET_PATH:
+        return path
+    import hashlib
+    import tempfile
+
+    digest = hashlib.sha1(storage_folder.encode()).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"librarian-{digest}.sock")
+
+
+def call_daemon(storage_folder, request):
+    """Sends `request` to a running daemon and returns its output.
+
+    Returns None when no daemon is reachable, so the caller can run the
+    request in-process. A None `request` only probes for a live daemon.
+    """
+    path = socket_path(storage_folder)
+    if not os.path.exists(path):
+        return None
+    import json
+    import socket
+
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(SOCKET_TIMEOUT)
+            sock.connect(path)
+            if request is None:
+                return ""
+            sock.sendall(json.dumps(request).encode() + b"\n")
+            with sock.makefile("rb") as response:
+                return json.loads(response.readline())["output"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Librarian: Knowledge Base Tool")
+    parser.add_argument("command", choices=[*COMMANDS, "batch", "serve"])
+    parser.add_argument(
+        "--filename",
+        help="Filename for read/create/append/neighbors/backlinks/compact (traverse start)",
+    )
+    parser.add_argument("--content", help="Content for create/append")
+    parser.add_argument("--section", help="read: only the section under this heading")
+    parser.add_argument("--bytes", help="read: only bytes START:END")
+    parser.add_argument("--lines", help="read: only lines START:END (1-based, inclusive)")
+    parser.add_argument("--tail", type=int, help="read: only the last N appended entries")
+    parser.add_argument(
+        "--archived",
+        action="store_true",
+        help="read/search: include entries moved to the archive by compact",
+    )
+    parser.add_argument(
+        "--keep",
+        type=int,
+        help="compact: appended entries to leave in each note (default: 10)",
+    )
+    parser.add_argument("--keywords", nargs="+", help="Keywords for search")
+    parser.add_argument(
+        "--expr",
+        help='search: query like \'"hot dog" AND tag:food NOT title:draft\' (~ adds synonyms)',
+    )
+    parser.add_argument(
+        "--where",
+        nargs="+",
+        help="query: filters like tag=x, heading~=setup, modified_since=7d, status=draft",
+    )
+    parser.add_argument(
+        "--ranked", action="store_true", help="Rank search results (BM25) with snippets"
+    )
+    parser.add_argument(
+        "--semantic",
+        action="store_true",
+        help="Rank search results by character n-gram similarity (needs numpy)",
+    )
+    parser.add_argument(
+        "--scope",
+        nargs="+",
+        help="search/query: only these top-level folders ('.' for notes at the vault root)",
+    )
+    parser.add_argument("--top-k", type=int, default=10, help="Max search/query results")
+    parser.add_argument("--depth", type=int, default=2, help="Max hops for traverse")
+    parser.add_argument("--max-nodes", type=int, default=50, help="Max notes for traverse")
+    parser.add_argument("--storage", default="./.agent_memory", help="Storage folder")
+    parser.add_argument(
+        "--full", action="store_true", help="sync: also re-list folders whose mtime did not move"
+    )
+    parser.add_argument(
+        "--no-watch", action="store_true", help="serve: do not watch the vault with inotify"
+    )
+    parser.add_argument(
+        "--no-daemon", action="store_true", help="Run in-process even if a daemon is up"
+    )
+    parser.add_argument(
+        "--format",
+        choices=["text", "json"],
+        default="text",
+        help="Print text, or the result as JSON (paths, scores, steps, timings)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Add a timing breakdown (synonyms, index, io, format) and read counts",
+    )
+    parser.add_argument(
+        "--client",
+        default=os.environ.get(CLIENT_ENV),
+        help=f"Name to count steps under in the daemon (default: ${CLIENT_ENV})",
+    )
+    parser.add_argument(
+        "--metrics-log",
+        help=f"Append one JSON line of timings per operation here (default: ${METRICS_LOG_ENV})",
+    )
+    return parser
+
+
+def main(argv=None):
+    # CPU time so far is almost all interpreter startup and imports
+    startup_ms = time.process_time() * 1000
+    args = build_parser().parse_args(argv)
+    if args.command == "serve":
+        import librarian
+
+        librarian.serve(args.storage, watch=not args.no_watch, metrics_log=args.metrics_log)
+        return
+    if args.command == "batch":
+        import librarian
+
+        librarian.run_batch(args.storage, sys.stdin, sys.stdout, use_daemon=not args.no_daemon)
+        return
+
+    def fail(message):
+        if args.format == "json":
+            import json
+            import librarian
+
+            message = json.dumps(librarian.Result.failed(args.command, message).to_dict())
+        print(message)
+        sys.exit(1)
+
+    try:
+        byte_range = _parse_range(args.bytes) if args.bytes else None
+        lines = _parse_range(args.lines, first=1) if args.lines else None
+    except ValueError as e:
+        fail(f"Error: {e}")
+
+    request = {
+        "command": args.command,
+        "filename": args.filename,
+        "content": args.content,
+        "section": args.section,
+        "byte_range": byte_range,
+        "lines": lines,
+        "tail": args.tail,
+        "archived": args.archived,
+        "keep": args.keep,
+        "keywords": args.keywords,
+        "expression": args.expr,
+        "where": args.where,
+        "ranked": args.ranked,
+        "semantic": args.semantic,
+        "scope": args.scope,
+        "top_k": args.top_k,
+        "depth": args.depth,
+        "max_nodes": args.max_nodes,
+        "full": args.full,
+        "format": args.format,
+        "profile": args.profile,
+        "startup_ms": startup_ms,
+        "client": args.client,
+    }
+    error = validate_request(request)
+    if error:
+        fail(error)
+
+    output = None if args.no_daemon else call_daemon(args.storage, request)
+    if output is None:
+        import librarian
+
+        with librarian.KnowledgeGraphTool(
+            storage_folder=args.storage, metrics_log=args.metrics_log
+        ) as tool:
+            output = librarian.run_request(tool, request)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
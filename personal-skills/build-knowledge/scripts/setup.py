@@ -1,6 +1,8 @@
 import os
 import nltk
 
+from librarian import build_synonym_table
+
 print("Initializing Independent Knowledge Graph...")
 
 # 1. Download Synonym Data
@@ -10,13 +12,20 @@ try:
 except:  # noqa: E722
     pass
 
-# 2. Create the Memory Folder
+# 2. Precompute synonyms so searches never have to load WordNet
+try:
+    count = build_synonym_table()
+    print(f"Built synonym table ({count} words)")
+except Exception as e:
+    print(f"Skipped synonym table: {e}")
+
+# 3. Create the Memory Folder
 folder = "./.agent_memory"
 if not os.path.exists(folder):
     os.makedirs(folder)
     print(f"Created memory folder at {folder}")
 
-# 3. Create the Root Node (The Entry Point)
+# 4. Create the Root Node (The Entry Point)
 index_path = os.path.join(folder, "000_Index.md")
 if not os.path.exists(index_path):
     with open(index_path, "w") as f:
@@ -1,7 +1,27 @@
 import unittest
 import os
 import shutil
-from librarian import KnowledgeGraphTool
+import io
+import sys
+import json
+import sqlite3
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+import importlib.util
+from unittest import mock
+import librarian
+from librarian import (
+    KnowledgeGraphTool,
+    SearchResult,
+    SynonymSource,
+    VaultWatcher,
+    call_daemon,
+    make_server,
+    run_batch,
+    socket_path,
+)
 
 class TestLibrarian(unittest.TestCase):
     def setUp(self):
@@ -10,6 +30,7 @@ class TestLibrarian(unittest.TestCase):
         os.makedirs(self.storage_folder, exist_ok=True)
 
     def tearDown(self):
+        self.tool.close()
         shutil.rmtree(self.storage_folder)
 
     def test_search_with_special_characters(self):
@@ -22,5 +43,719 @@ class TestLibrarian(unittest.TestCase):
         result = self.tool.search_notes(keywords)
         self.assertIn(test_file, result)
 
+    def test_search_uses_index_and_tracks_writes(self):
+        self.tool.create_note("alpha.md", "Notes about database migrations")
+        self.assertIn("alpha.md", self.tool.search_notes(["migration"]))
+        self.assertTrue(self.tool.index.exists())
+
+        self.tool.append_note("alpha.md", "Added kubernetes rollout")
+        self.assertIn("alpha.md", self.tool.search_notes(["kubernetes"]))
+
+    def test_search_picks_up_external_edits(self):
+        self.tool.search_notes(["anything"])  # builds the index
+        os.makedirs(os.path.join(self.storage_folder, "team"), exist_ok=True)
+        with open(os.path.join(self.storage_folder, "team", "beta.md"), "w") as f:
+            f.write("Hand written note on zeppelins")
+        self.assertIn("team/beta.md", self.tool.search_notes(["zeppelin"]))
+
+        os.remove(os.path.join(self.storage_folder, "team", "beta.md"))
+        self.assertIn("No matches", self.tool.search_notes(["zeppelin"]))
+
+    def test_index_phrase_lookup(self):
+        self.tool.create_note("gamma.md", "the hot dog stand")
+        self.tool.create_note("delta.md", "a dog that is hot")
+        self.tool.index.refresh()
+        self.assertEqual(self.tool.index.lookup("hot dog"), {"gamma.md"})
+
+    def test_search_expressions(self):
+        self.tool.create_note("gamma.md", "# Street food\n\nthe hot dog stand #food")
+        self.tool.create_note(
+            "delta.md", "---\ntitle: Draft dogs\n---\na dog that is hot #food/snacks"
+        )
+        self.tool.create_note("car.md", "My automobile and the database migration")
+
+        def found(expression, **kwargs):
+            result = self.tool.run("search", expression=expression, **kwargs)
+            self.assertTrue(result.ok, result.text)
+            return [hit.path for hit in result.hits]
+
+        self.assertEqual(found('"hot dog"'), ["gamma.md"])
+        self.assertEqual(found("dog AND hot"), ["delta.md", "gamma.md"])
+        self.assertEqual(found("tag:food NOT title:draft"), ["gamma.md"])
+        self.assertEqual(found("heading:street OR migration"), ["car.md", "gamma.md"])
+        self.assertEqual(found("database migration NOT (dog OR cat)"), ["car.md"])
+        self.assertEqual(found("food NOT migration", ranked=True), ["gamma.md", "delta.md"])
+
+        table = os.path.join(self.storage_folder, "synonyms.db")
+        conn = sqlite3.connect(table)
+        with conn:
+            conn.execute("CREATE TABLE synonyms (word TEXT, pos TEXT, expansions TEXT)")
+            conn.execute("INSERT INTO synonyms VALUES ('car', 'n', 'car\nautomobile')")
+        conn.close()
+        self.tool.synonyms = SynonymSource(table)
+        self.assertEqual(found("car"), [])
+        self.assertEqual(found("car~"), ["car.md"])
+        self.assertIn("missing ')'", self.tool.search_notes(expression="(dog"))
+
+    def test_ranked_search_orders_by_relevance_with_snippets(self):
+        self.tool.create_note("weak.md", "A long note " * 30 + "mentioning migration once")
+        self.tool.create_note("strong.md", "# Migration guide\n\nEvery migration step.")
+        result = self.tool.search_notes(["migration"], ranked=True)
+        lines = result.splitlines()
+        self.assertIn("1. strong.md", lines[1])
+        self.assertIn("# Migration guide", lines[2])
+        self.assertLess(result.index("strong.md"), result.index("weak.md"))
+
+    def test_search_results_are_cached_per_generation(self):
+        self.tool.create_note("a.md", "llama facts")
+        first = self.tool.search_notes(["llama"], ranked=True)
+        self.assertEqual(self.tool.search_notes(["LLAMA"], ranked=True), first)
+        self.assertEqual(self.tool.cache.hits, 1)
+
+        self.tool.append_note("a.md", "more llama")
+        self.tool.create_note("b.md", "a llama too")
+        self.assertIn("b.md", self.tool.search_notes(["llama"], ranked=True))
+        with open(os.path.join(self.storage_folder, "c.md"), "w") as f:
+            f.write("hand written llama")
+        self.assertIn("c.md", self.tool.search_notes(["llama"]))
+        self.assertEqual(self.tool.cache.hits, 1)
+
+        self.tool.cache.maxsize = 2
+        for word in ("facts", "hand", "written"):
+            self.tool.search_notes([word])
+        self.tool.search_notes(["facts"])  # evicted as least recently used
+        self.assertEqual(self.tool.cache.hits, 1)
+        self.tool.search_notes(["written"])
+        self.assertEqual(self.tool.cache.hits, 2)
+
+    def test_cache_sees_writes_from_other_processes(self):
+        self.tool.create_note("x.md", "llama")
+        self.tool.create_note("y.md", "alpaca")
+        self.assertIn("x.md", self.tool.search_notes(["llama"]))
+        self.assertEqual(self.tool.read_note("zz"), self.tool.read_note("zz"))
+
+        # Another tool stands in for another process: its own connections, its own memory
+        with KnowledgeGraphTool(storage_folder=self.storage_folder) as other:
+            other.append_note("y.md", "llama")
+            other.create_note("z.md", "llama too")
+        result = self.tool.search_notes(["llama"])
+        self.assertTrue(all(name in result for name in ("x.md", "y.md", "z.md")), result)
+        self.assertEqual(self.tool.read_note("z"), "llama too")
+
+    def test_precomputed_synonym_table(self):
+        table = os.path.join(self.storage_folder, "synonyms.db")
+        conn = sqlite3.connect(table)
+        with conn:
+            conn.execute("CREATE TABLE synonyms (word TEXT, pos TEXT, expansions TEXT)")
+            conn.executemany("INSERT INTO synonyms VALUES (?, ?, ?)", [
+                ("car", "n", "car\nauto\nautomobile"),
+                ("red", "a", "red\ncrimson"),
+                ("r", "n", "r\nroentgen"),
+                ("b", "n", "b\nboron"),
+                ("walk", "v", "walk\nstroll"),
+                ("walk", "n", "walk\nwalkway"),
+            ])
+        conn.close()
+
+        synonyms = SynonymSource(table)
+        self.assertIn("automobile", synonyms.lookup("Cars"))
+        self.assertEqual(synonyms.lookup("zzz"), frozenset())
+        # Suffix rules only apply within a part of speech, and only to unknown words
+        self.assertEqual(synonyms.lookup("red"), {"red", "crimson"})
+        self.assertEqual(synonyms.lookup("bed"), frozenset())  # no verb "b"
+        self.assertEqual(synonyms.lookup("walking"), {"walk", "stroll"})  # "-ing" is verbal
+        synonyms.lookup("Cars")
+        self.assertEqual(synonyms.lookup.cache_info().hits, 1)
+
+        self.tool.synonyms = synonyms
+        self.tool.create_note("ride.md", "My automobile broke down")
+        self.assertIn("ride.md", self.tool.search_notes(["car"]))
+
+    @unittest.skipUnless(importlib.util.find_spec("numpy"), "needs numpy")
+    def test_semantic_search_matches_paraphrases(self):
+        self.tool.create_note("deploy.md", "How we deploy the release pipeline")
+        self.tool.create_note("bread.md", "Baking sourdough bread at home")
+        result = self.tool.search_notes(["deployment pipelines"], semantic=True, top_k=1)
+        self.assertIn("1. deploy.md", result)
+        self.assertIn("release pipeline", result)
+
+        os.remove(os.path.join(self.storage_folder, "bread.md"))
+        self.assertNotIn("bread.md", self.tool.search_notes(["sourdough"], semantic=True))
+        self.tool.create_note("cake.md", "Sourdough cake")  # reuses the freed row
+        self.assertIn("cake.md", self.tool.search_notes(["sourdough"], semantic=True))
+
+    def test_link_graph(self):
+        os.makedirs(os.path.join(self.storage_folder, "team"), exist_ok=True)
+        self.tool.create_note("hub.md", "See [[Spoke|the spoke]] and [other](team/leaf.md)")
+        self.tool.create_note("Spoke.md", "Back to [[hub]], on to [[leaf]] and [[Nowhere]]")
+        self.tool.create_note("team/leaf.md", "A leaf")
+
+        self.assertIn("['Spoke.md', 'team/leaf.md']", self.tool.neighbors("hub"))
+        self.assertIn("Nowhere.md (missing)", self.tool.neighbors("Spoke"))
+        self.assertIn("['Spoke.md', 'hub.md']", self.tool.backlinks("team/leaf"))
+
+        lines = self.tool.traverse("hub.md", depth=1, max_nodes=10).splitlines()
+        self.assertEqual([line.split(" ")[:2] for line in lines[1:]], [
+            ["0", "hub.md"], ["1", "Spoke.md"], ["1", "team/leaf.md"],
+        ])
+        self.assertEqual(len(self.tool.traverse("hub.md", max_nodes=2).splitlines()), 3)
+
+    def test_metadata_query(self):
+        self.tool.create_note(
+            "plan.md",
+            "---\ntitle: Launch plan\ntags: [Launch, q4]\nstatus: draft\nowners:\n"
+            "  - ana\n  - bo\n---\n# Overview\n\nSee [[risks]]. #urgent\n\n## Rollout steps\n",
+        )
+        self.tool.create_note("risks.md", "# Risks\n\nNothing #launch related, see [a](x.md#launch)")
+        old = os.path.join(self.storage_folder, "000_Index.md")
+        os.utime(old, (0, 0))
+
+        result = self.tool.query_notes(["tag=launch"])
+        self.assertIn("plan.md: Launch plan", result)
+        self.assertIn("risks.md: Risks", result)
+        self.assertIn("tags: launch, q4, urgent", result)
+        self.assertIn("status: draft; owners: ana, bo", result)
+        self.assertIn("headings: Overview | Rollout steps", result)
+        self.assertIn("1 links", result)
+
+        self.assertNotIn("risks.md", self.tool.query_notes(["heading~=rollout", "owners=BO"]))
+        self.assertIn("No notes match", self.tool.query_notes(["status~=final"]))
+        recent = self.tool.query_notes(["modified_since=1d"])
+        self.assertNotIn("000_Index.md", recent)
+        self.assertIn("000_Index.md", self.tool.query_notes(["modified_before=2000-01-01"]))
+        self.assertTrue(self.tool.query_notes(["tag"]).startswith("Error:"))
+
+    def test_partial_reads(self):
+        body = "# Log\n\nintro\n\n## Setup\n\nsteps here\n\n### Detail\n\nfine print\n\n## Usage\n\nrun it\n"
+        self.tool.create_note("log.md", body)
+        self.tool.append_note("log.md", "entry one")
+        self.tool.append_note("log.md", "entry two")
+
+        section = self.tool.read_note("log", section="setup")
+        self.assertTrue(section.startswith("## Setup"))
+        self.assertIn("fine print", section)
+        self.assertNotIn("run it", section)
+        self.assertIn("Headings:", self.tool.read_note("log", section="missing"))
+
+        self.assertEqual(self.tool.read_note("log", byte_range=(2, 5)), "Log")
+        self.assertEqual(self.tool.read_note("log", lines=(3, 3)), "intro\n")
+        self.assertEqual(self.tool.read_note("log", tail=1), "entry two")
+        self.assertEqual(self.tool.read_note("log", tail=2), "entry one\nentry two")
+        self.assertTrue(self.tool.read_note("log", tail=5).startswith("# Log"))
+
+        # Negative or inverted ranges and tail counts below 1 are errors
+        for selector, message in (
+            ({"byte_range": (-5, None)}, "at least 0"),
+            ({"byte_range": (2, 1)}, "before its start"),
+            ({"lines": (3, 1)}, "before its start"),
+            ({"lines": (0, 2)}, "at least 1"),
+            ({"tail": 0}, "tail must be at least 1"),
+            ({"tail": -1}, "tail must be at least 1"),
+        ):
+            result = self.tool.read_note("log", **selector)
+            self.assertTrue(result.startswith("Error: "), selector)
+            self.assertIn(message, result)
+        out = subprocess.run(
+            [sys.executable, SCRIPT, "read", "--filename", "log", "--bytes=-5:",
+             "--storage", self.storage_folder, "--no-daemon"],
+            capture_output=True, text=True,
+        )
+        self.assertEqual(out.returncode, 1)
+        self.assertTrue(out.stdout.startswith("Error: range bounds"), out.stdout + out.stderr)
+
+    def test_fenced_comments_are_not_headings(self):
+        body = (
+            "---\n# not a heading\n---\n# Deploy\n\n## Setup\n\n"
+            "```bash\n# install the tools\nmake install\n```\n\nthen run\n\n## Usage\n\nrun it\n"
+        )
+        self.tool.create_note("deploy.md", body)
+
+        section = self.tool.read_note("deploy", section="setup")
+        self.assertIn("make install", section)
+        self.assertIn("then run", section)
+        self.assertNotIn("run it", section)
+        self.assertIn("Headings:", self.tool.read_note("deploy", section="install"))
+        self.assertEqual(self.tool.run("query").notes[0].headings, ["Deploy", "Setup", "Usage"])
+        self.assertEqual(self.tool.run("search", expression="heading:install").hits, [])
+
+        # bolt-skills ships its own copy of the tokenizer, which must not drift
+        bolt_copy = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "..", "..", "..",
+            "bolt-skills", "scripts", "md_headings.py",
+        )
+        if os.path.isdir(os.path.dirname(bolt_copy)):
+            with open(bolt_copy, "rb") as a, open(sys.modules["md_headings"].__file__, "rb") as b:
+                self.assertEqual(a.read(), b.read())
+
+    def test_read_resolves_near_miss_filenames(self):
+        os.makedirs(os.path.join(self.storage_folder, "team"), exist_ok=True)
+        self.tool.create_note("team/Meeting_Notes.md", "minutes")
+        self.tool.create_note("roadmap-2024.md", "plans")
+        self.tool.create_note("roadmap-2025.md", "more plans")
+
+        result = self.tool.run("read", filename="meeting-notes")
+        self.assertEqual((result.path, result.content), ("team/Meeting_Notes.md", "minutes"))
+        self.assertEqual(result.resolved_from, "meeting-notes")
+        self.assertIn("read 'team/Meeting_Notes.md' instead", result.text)
+        self.assertEqual(self.tool.run("read", filename="team/meet").content, "minutes")
+        self.assertEqual(self.tool.run("read", filename="Meetng_Notes").content, "minutes")
+
+        ambiguous = self.tool.read_note("roadmap")
+        self.assertIn("Closest notes: ['roadmap-2024.md', 'roadmap-2025.md']", ambiguous)
+        self.assertIn("Closest notes: ['roadmap-2024.md'", self.tool.read_note("roadmap-2023"))
+        self.assertEqual(self.tool.read_note("zzz"), (
+            "Error: File does not exist. Did you mean to create it?"
+        ))
+
+    def test_compact_archives_old_entries(self):
+        self.tool.create_note("log.md", "# Log\n\nbody")
+        for i in range(5):
+            self.tool.append_note("log.md", f"entry {i} yak{i}")
+        full = self.tool.read_note("log")
+
+        self.assertIn("archived 3 entries", self.tool.compact_notes(keep=2))
+        live = self.tool.read_note("log")
+        self.assertNotIn("yak2", live)
+        self.assertIn("> Archived 3 older entries", live)
+        self.assertEqual(self.tool.read_note("log", tail=2), "entry 3 yak3\nentry 4 yak4")
+        self.assertEqual(self.tool.read_note("log", archived=True), full)
+
+        self.assertIn("No matches", self.tool.search_notes(["yak1"]))
+        self.assertIn("Archived matches in: ['log.md']", self.tool.search_notes(["yak1"], archived=True))
+
+        # A second compaction extends the archive and the pointer's totals
+        self.tool.append_note("log.md", "entry 5")
+        self.assertIn("archived 2 entries", self.tool.compact_notes("log", keep=1))
+        self.assertIn("> Archived 5 older entries", self.tool.read_note("log"))
+        self.assertEqual(self.tool.read_note("log", archived=True), full + "\nentry 5")
+        self.assertIn("0 notes", self.tool.compact_notes(keep=1))
+
+    def test_hand_edit_invalidates_entry_offsets(self):
+        self.tool.create_note("log.md", "# Log\nbody")
+        for i in range(4):
+            self.tool.append_note("log.md", f"entry number {i}")
+        path = os.path.join(self.storage_folder, "log.md")
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        edited = text.replace("# Log\n", "# Log\nA hand-written line\n")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(edited)
+
+        # The offsets no longer say where entries start: nothing is cut by them
+        self.assertIn("edited outside the tool", self.tool.compact_notes("log", keep=1))
+        self.assertIn("Skipped notes edited outside the tool: log.md", self.tool.compact_notes(keep=1))
+        self.assertEqual(self.tool.read_note("log"), edited)
+        self.assertEqual(self.tool.read_note("log", tail=2), edited)
+
+        # Appends count entries afresh from there
+        self.tool.append_note("log.md", "entry number 4")
+        self.assertEqual(self.tool.read_note("log", tail=1), "entry number 4")
+        self.assertIn("archived 1 entries", self.tool.compact_notes("log", keep=0))
+
+        # Touched but unchanged (a checkout, say) keeps them
+        os.utime(path, ns=(0, 10**18))
+        self.tool.append_note("log.md", "entry number 5")
+        self.assertEqual(self.tool.read_note("log", tail=1), "entry number 5")
+
+    def test_quick_and_full_sync(self):
+        self.tool.create_note("kept.md", "original text")
+        self.tool.sync_notes(full=True)
+
+        os.makedirs(os.path.join(self.storage_folder, "sub"))
+        with open(os.path.join(self.storage_folder, "sub", "added.md"), "w") as f:
+            f.write("walrus")
+        os.remove(os.path.join(self.storage_folder, "kept.md"))
+        self.assertIn("2 notes updated", self.tool.sync_notes())
+        self.assertEqual(self.tool.index.lookup("walrus"), {"sub/added.md"})
+        self.assertEqual(self.tool.index.lookup("original"), set())
+
+        # An in-place edit leaves the folder mtime alone; the note's own stat moves
+        sub = os.path.join(self.storage_folder, "sub")
+        with open(os.path.join(sub, "added.md"), "a") as f:
+            f.write(" narwhal")
+        self.assertIn("1 notes updated", self.tool.sync_notes())
+        self.assertEqual(self.tool.index.lookup("narwhal"), {"sub/added.md"})
+        with open(os.path.join(self.storage_folder, "000_Index.md"), "a") as f:
+            f.write(" platypus")
+        with KnowledgeGraphTool(storage_folder=self.storage_folder) as fresh:
+            self.assertIn("000_Index.md", fresh.search_notes(["platypus"]))
+
+        # A folder whose mtime did not move is only listed again by a full sync
+        stat = os.stat(sub)
+        with open(os.path.join(sub, "hidden.md"), "w") as f:
+            f.write("dugong")
+        os.utime(sub, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertIn("0 notes updated", self.tool.sync_notes())
+        self.assertIn("1 notes updated", self.tool.sync_notes(full=True))
+        self.assertEqual(self.tool.index.lookup("dugong"), {"sub/hidden.md"})
+
+    def test_watcher_feeds_refresh(self):
+        try:
+            watcher = VaultWatcher(self.tool.storage_folder)
+        except OSError:
+            self.skipTest("inotify not available")
+        self.tool.index.sync(full=True)
+        self.tool.index.watcher = watcher
+        try:
+            os.makedirs(os.path.join(self.storage_folder, "team", "deep"))
+            with open(os.path.join(self.storage_folder, "team", "deep", "w.md"), "w") as f:
+                f.write("okapi")
+            self.assertEqual(self.tool.index.refresh(), 1)
+            self.assertEqual(self.tool.index.lookup("okapi"), {"team/deep/w.md"})
+
+            shutil.rmtree(os.path.join(self.storage_folder, "team"))
+            self.assertEqual(self.tool.index.refresh(), 1)
+            self.assertEqual(self.tool.index.lookup("okapi"), set())
+        finally:
+            watcher.close()
+
+    def test_shards_scope_and_parallel_search(self):
+        for rel_path, text in [
+            ("root.md", "quokka at the root"),
+            ("work/a.md", "quokka quokka at work"),
+            ("home/deep/b.md", "a quokka at home, see [[root.md]]"),
+        ]:
+            path = os.path.join(self.storage_folder, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(text)
+
+        result = self.tool.search_notes(["quokka"], scope=["work", "."])
+        self.assertIn("work/a.md", result)
+        self.assertIn("root.md", result)
+        self.assertNotIn("home/deep/b.md", result)
+        # Out-of-scope folders are not even indexed yet
+        self.assertEqual(self.tool.index.indexed_shards(), ["", "work"])
+        self.assertIn("home/deep/b.md", self.tool.backlinks("root.md"))
+        self.assertEqual(self.tool.index.indexed_shards(), ["", "home", "work"])
+
+        # Pooled shard work gives the same answers as the in-process path
+        serial = self.tool.search_notes(["quokka"], ranked=True)
+        self.tool.index.workers = 2
+        self.tool.index.parallel_min_bytes = 0
+        try:
+            self.assertEqual(self.tool.search_notes(["quokka"], ranked=True), serial)
+        finally:
+            self.tool.index.close()
+
+        shutil.rmtree(os.path.join(self.storage_folder, "work"))
+        self.assertIn("1 notes updated", self.tool.sync_notes())
+        self.assertEqual(self.tool.index.indexed_shards(), ["", "home"])
+
+    def test_batch_shares_one_tool(self):
+        requests = [
+            {"id": "c", "command": "create", "filename": "b.md", "content": "batched"},
+            {"id": "s", "command": "search", "keywords": "batched"},
+            {"id": "r", "command": "read", "filename": "b.md"},
+            {"id": "x", "command": "status"},
+        ]
+        lines = [json.dumps(r) for r in requests] + ["not json"]
+        out = io.StringIO()
+        run_batch(self.storage_folder, lines, out, use_daemon=False)
+
+        results = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([r.get("id") for r in results], ["c", "s", "r", "x", None])
+        self.assertIn("b.md", results[1]["output"])
+        self.assertEqual(results[2]["output"], "batched")
+        self.assertIn("Steps: 2/", results[3]["output"])
+        self.assertIn("error", results[4])
+
+        # Badly typed requests fail on their own line; the stream goes on
+        os.makedirs(os.path.join(self.storage_folder, "work"))
+        self.tool.create_note("work/w.md", "batched at work")
+        requests = [
+            {"id": 1, "command": "read", "filename": "b.md", "tail": "2"},
+            {"id": 2, "command": "read", "filename": 5},
+            {"id": 3, "command": "search", "keywords": "x", "top_k": "3"},
+            {"id": 4, "command": "read", "filename": "b.md", "lines": "1:2"},
+            {"id": 5, "command": "search", "keywords": "batched", "scope": "work"},
+        ]
+        out = io.StringIO()
+        run_batch(self.storage_folder, [json.dumps(r) for r in requests], out, use_daemon=False)
+        results = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([r["id"] for r in results], [1, 2, 3, 4, 5])
+        self.assertIn("tail must be an integer, got string", results[0]["output"])
+        self.assertIn("filename must be a string, got number", results[1]["output"])
+        self.assertIn("top_k must be an integer", results[2]["output"])
+        self.assertIn("lines must be a [start, end] pair", results[3]["output"])
+        self.assertIn("work/w.md", results[4]["output"])
+        self.assertNotIn("b.md", results[4]["output"])
+
+        real_run_request = librarian.run_request
+
+        def flaky(tool, request):
+            if request.get("id") == "boom":
+                raise RuntimeError("disk on fire")
+            return real_run_request(tool, request)
+
+        out = io.StringIO()
+        lines = [json.dumps({"id": "boom", "command": "status"}), json.dumps({"command": "status"})]
+        with mock.patch.object(librarian, "run_request", flaky):
+            run_batch(self.storage_folder, lines, out, use_daemon=False)
+        results = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(
+            results[0], {"id": "boom", "command": "status", "error": "Request failed: disk on fire"}
+        )
+        self.assertIn("Steps:", results[1]["output"])
+
+    def test_structured_results_and_json_format(self):
+        self.tool.create_note("weak.md", "A long note " * 30 + "mentioning migration once")
+        self.tool.create_note("strong.md", "# Migration guide\n\nSee [[weak]] and [[gone]].")
+        result = self.tool.run("search", keywords=["migration"], ranked=True)
+        self.assertIsInstance(result, SearchResult)
+        self.assertTrue(result.ok)
+        self.assertEqual([hit.path for hit in result.hits], ["strong.md", "weak.md"])
+        self.assertGreater(result.hits[0].score, result.hits[1].score)
+        self.assertIn("# Migration guide", result.hits[0].snippet)
+        self.assertEqual(result.steps, 1)
+        self.assertEqual(result.text, self.tool.search_notes(["migration"], ranked=True))
+
+        links = self.tool.run("neighbors", filename="strong.md")
+        self.assertEqual((links.notes, links.missing), (["weak.md"], ["gone.md"]))
+        read = self.tool.run("read", filename="strong.md", section="guide")
+        self.assertEqual((read.path, read.part), ("strong.md", "section"))
+        missing = self.tool.run("read", filename="nope.md")
+        self.assertFalse(missing.ok)
+        self.assertIn("does not exist", missing.error)
+
+        out = io.StringIO()
+        request = {"id": 1, "command": "search", "keywords": "guide", "format": "json"}
+        run_batch(self.storage_folder, [json.dumps(request)], out, use_daemon=False)
+        document = json.loads(out.getvalue())["result"]
+        self.assertEqual(document["command"], "search")
+        self.assertEqual(document["hits"], [{"path": "strong.md", "score": None, "snippet": None}])
+        self.assertIn("elapsed_ms", document)
+
+    def test_profile_status_timings_and_metrics_log(self):
+        log = os.path.join(self.storage_folder, "metrics.jsonl")
+        self.tool.metrics_log = log
+        self.tool.create_note("p.md", "# Plan\n\nprofiled words")
+        result = self.tool.run("search", keywords=["profiled"], ranked=True, profile=True)
+        phases = result.profile["phases_ms"]
+        self.assertTrue({"synonyms", "index", "io", "format", "other"} <= set(phases))
+        self.assertAlmostEqual(sum(phases.values()), result.elapsed_ms, delta=0.05)
+        self.assertGreater(result.profile["bytes_read"], 0)
+        self.assertIn("Profile: ", result.text.splitlines()[-1])
+        self.assertIsNone(self.tool.run("read", filename="p.md").profile)
+
+        status = self.tool.run("status")
+        self.assertEqual(status.timings["search"]["calls"], 1)
+        self.assertEqual(status.timings["read"]["files_touched"], 1)
+        self.assertIn("Timing (ms): create x1", status.text)
+
+        with open(log) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([r["command"] for r in records], ["create", "search", "read", "status"])
+        self.assertEqual(records[2]["bytes_read"], len("# Plan\n\nprofiled words"))
+
+    @unittest.skipUnless(hasattr(__import__("socket"), "AF_UNIX"), "needs Unix sockets")
+    def test_daemon_round_trip(self):
+        self.assertIsNone(call_daemon(self.storage_folder, {"command": "read"}))
+
+        path = socket_path(self.storage_folder)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        server = make_server(self.tool, path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            request = {"command": "create", "filename": "d.md", "content": "via daemon"}
+            self.assertIn("Success", call_daemon(self.storage_folder, request))
+            request = {"command": "search", "keywords": ["daemon"]}
+            self.assertIn("d.md", call_daemon(self.storage_folder, request))
+
+            # Each named client has its own step count; unnamed ones share the daemon's
+            def steps(client):
+                request = {"command": "status", "format": "json", "client": client}
+                return json.loads(call_daemon(self.storage_folder, request))["steps"]
+
+            read = {"command": "read", "filename": "d.md"}
+            for _ in range(3):
+                call_daemon(self.storage_folder, {**read, "client": "agent-a"})
+            call_daemon(self.storage_folder, {**read, "client": "agent-b"})
+            self.assertEqual((steps("agent-a"), steps("agent-b"), steps(None)), (3, 1, 1))
+
+            # The command line answered by the daemon never loads librarian.py
+            storage = os.path.abspath(self.storage_folder)
+            times = _import_times([SCRIPT, "read", "--filename", "d.md", "--storage", storage])
+            self.assertNotIn("librarian", times)
+            self.assertEqual(steps("agent-a"), 3)
+            self.assertEqual(steps(None), 2)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            os.remove(path)
+
+
+def _stress_writer(args):
+    """One writer process: contest a shared create, then append many entries."""
+    storage, worker, count = args
+    with KnowledgeGraphTool(storage_folder=storage) as tool:
+        created = tool.create_note("contested.md", f"winner {worker}").startswith("Success")
+        tool.create_note(f"own_{worker}.md", f"private note of worker{worker}")
+        for i in range(count):
+            tool.append_note("shared.md", f"entry-{worker}-{i} " + "x" * 2000)
+    return created
+
+
+class TestConcurrentWrites(unittest.TestCase):
+    WORKERS = 6
+    APPENDS = 20
+
+    def setUp(self):
+        self.storage_folder = tempfile.mkdtemp()
+        self.tool = KnowledgeGraphTool(storage_folder=self.storage_folder)
+        self.tool.create_note("shared.md", "# Shared")
+        self.tool.search_notes(["shared"])  # writers must keep an existing index current
+
+    def tearDown(self):
+        self.tool.close()
+        shutil.rmtree(self.storage_folder)
+
+    def test_parallel_writers(self):
+        jobs = [(self.storage_folder, w, self.APPENDS) for w in range(self.WORKERS)]
+        with multiprocessing.Pool(self.WORKERS) as pool:
+            created = pool.map(_stress_writer, jobs)
+
+        self.assertEqual(sum(created), 1)
+        with open(os.path.join(self.storage_folder, "shared.md"), encoding="utf-8") as f:
+            lines = f.read().split("\n")[1:]
+        expected = {
+            f"entry-{w}-{i} " + "x" * 2000
+            for w in range(self.WORKERS)
+            for i in range(self.APPENDS)
+        }
+        self.assertEqual(len(lines), len(expected))
+        self.assertEqual(set(lines), expected)
+
+        # Creates are indexed as they happen; the appends leave it to the next
+        # refresh, which re-reads the shared note once
+        self.assertEqual(self.tool.index.refresh(), 1)
+        self.assertEqual(self.tool.index.refresh(), 0)
+        self.assertEqual(len(self.tool.index.lookup("entry")), 1)
+        self.assertEqual(
+            self.tool.index.lookup("private"), {f"own_{w}.md" for w in range(self.WORKERS)}
+        )
+        self.assertEqual(len(self.tool.index.lookup("winner")), 1)
+        with open(os.path.join(self.storage_folder, "shared.md"), "rb") as f:
+            self.assertEqual(len(self.tool.index.entry_offsets("shared.md", f)), len(expected))
+
+    def test_interrupted_append_is_repaired(self):
+        path = os.path.join(self.storage_folder, "shared.md")
+        size = os.path.getsize(path)
+        self.tool.index.begin_append("shared.md", size, b"\nwhole entry")
+        with open(path, "ab") as f:
+            f.write(b"\nwho")  # torn write: the process died here
+
+        self.tool.append_note("shared.md", "next entry")
+        with open(path, encoding="utf-8") as f:
+            self.assertEqual(f.read(), "# Shared\nwhole entry\nnext entry")
+        self.assertEqual(self.tool.read_note("shared.md", tail=2), "whole entry\nnext entry")
+
+    def test_stale_append_record_after_hand_edit(self):
+        path = os.path.join(self.storage_folder, "shared.md")
+        self.tool.index.begin_append("shared.md", os.path.getsize(path), b"\nlost entry")
+        with open(path, "ab") as f:
+            f.write(b"\nlost")  # torn write: the process died here
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("# Shared\nedited by hand")
+
+        self.tool.append_note("shared.md", "new entry")
+        with open(path, encoding="utf-8") as f:
+            self.assertEqual(f.read(), "# Shared\nedited by hand\nnew entry")
+
+    def test_stale_append_record_after_recreate(self):
+        path = os.path.join(self.storage_folder, "fresh.md")
+        self.tool.create_note("fresh.md", "# Fresh\nold body")
+        self.tool.index.begin_append("fresh.md", os.path.getsize(path), b"\nstale")
+        os.remove(path)
+        self.tool.create_note("fresh.md", "# Fre")
+
+        self.tool.append_note("fresh.md", "x")
+        with open(path, encoding="utf-8") as f:
+            self.assertEqual(f.read(), "# Fre\nx")
+
+        # A note deleted by hand takes its record along at the next sync
+        self.tool.index.begin_append("fresh.md", os.path.getsize(path), b"\nstale")
+        os.remove(path)
+        self.tool.search_notes(["fresh"])
+        self.assertFalse(os.path.exists(self.tool.index._wal_path("fresh.md")))
+
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "librarian_cli.py")
+# Cumulative `-X importtime` budget for `import librarian`, in microseconds.
+# Wall-clock, so only checked when LIBRARIAN_TIMING_TESTS is set (on a quiet
+# machine); the import checks below hold everywhere.
+IMPORT_BUDGET_US = 100_000
+# Modules the non-search commands must never pay for
+HEAVY_MODULES = {"nltk", "numpy", "sqlite3", "socketserver", "concurrent"}
+
+
+def _import_times(args):
+    """{module: cumulative microseconds} from a `python -X importtime` run."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(SCRIPT),
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+class TestStartupBudget(unittest.TestCase):
+    def test_import_skips_heavy_modules(self):
+        times = _import_times(["-c", "import librarian"])
+        self.assertIn("librarian", times)
+        self.assertFalse({name.split(".")[0] for name in times} & HEAVY_MODULES)
+
+    @unittest.skipUnless(os.environ.get("LIBRARIAN_TIMING_TESTS"), "timing tests not enabled")
+    def test_import_time_within_budget(self):
+        times = _import_times(["-c", "import librarian"])
+        self.assertLess(times["librarian"], IMPORT_BUDGET_US)
+
+    def test_non_search_commands_skip_heavy_imports(self):
+        with tempfile.TemporaryDirectory() as storage:
+            for command in (
+                ["create", "--filename", "n", "--content", "text"],
+                ["append", "--filename", "n", "--content", "more"],
+                ["read", "--filename", "n"],
+            ):
+                times = _import_times([SCRIPT, *command, "--storage", storage])
+                loaded = {name.split(".")[0] for name in times}
+                self.assertFalse(loaded & HEAVY_MODULES, command)
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_generated_vault_and_report(self):
+        import benchmark
+
+        with tempfile.TemporaryDirectory() as base:
+            paths = benchmark.generate_vault(os.path.join(base, "a"), 40, seed=3)
+            again = benchmark.generate_vault(os.path.join(base, "b"), 40, seed=3)
+            self.assertEqual(paths, again)
+            with open(os.path.join(base, "a", paths[0])) as f:
+                self.assertIn("Related: ", f.read())
+
+            out = os.path.join(base, "report.json")
+            benchmark.run([40], out, vault_dir=base, repeat=1, seed=3)
+            with open(out) as f:
+                vault = json.load(f)["vaults"][0]
+            self.assertEqual(vault["notes"], 40)
+            for op in ("search", "search_ranked", "read", "create", "append"):
+                self.assertIn("median_ms", vault[op]["warm"], op)
+                self.assertIn("median_ms", vault[op]["cold"], op)
+            # Notes written by the benchmark are cleaned up so the vault can be reused
+            leftovers = [
+                name for name in os.listdir(os.path.join(base, "vault-40-3"))
+                if name.startswith(benchmark.BENCH_PREFIX)
+            ]
+            self.assertEqual(leftovers, [])
+
 if __name__ == "__main__":
     unittest.main()